@@ -1,18 +1,30 @@
 import argparse
 import csv
+import hashlib
+import heapq
+import itertools
 import json
 import os.path
+import random
 import re
-from typing import List
-
-import wandb
-from tqdm import tqdm
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
 
 from .utils import (
     downstream,
     downstream_bpb,
     downstream_newline,
     downstream_newline_bpb,
+    get_accuracy_keys,
+    get_bpb_keys,
+    get_log_soft_keys,
+    get_mc_accuracy_keys,
+    get_soft_keys,
+    get_task_sets,
+    tasks,
     v2_downstream_bpb,
     v2_downstream_mc_acc,
     v2_downstream_rc_acc,
@@ -25,6 +37,9 @@ from .utils import (
 run_path_re = re.compile(r"^[^/]+/[^/]+/[^/]+$")
 run_path_url = re.compile(r"^https?://wandb.ai/([^/]+)/([^/]+)/runs/([^/]+)")
 
+# page_size cannot be too big, it will make it faster but it will start to downsample
+PAGE_SIZE = 10000
+
 
 def parse_run_path(run_path: str) -> str:
     """For convenience, we allow run paths as well as URLs."""
@@ -40,9 +55,54 @@ def parse_run_path(run_path: str) -> str:
     raise ValueError(f"Could not parse '{run_path}'")
 
 
-def get_runs(run_paths: List) -> List:
+def get_api():
+    import wandb
+
+    return wandb.Api()
+
+
+class RateLimiter:
+    """
+    Spaces out requests to the W&B API across all download threads, to at most
+    requests_per_second (no limit if None).
+    """
+
+    def __init__(self, requests_per_second: Optional[float] = None):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def with_retries(func: Callable, description: str, max_retries: int = 5, backoff: float = 2.0):
+    """
+    Calls func, retrying failed calls with exponential backoff (with jitter) up to max_retries
+    times before giving up.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2**attempt * random.uniform(0.5, 1.0)
+            print(f"{description} failed ({e!r}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def get_runs(run_paths: List, api=None, rate_limiter: Optional[RateLimiter] = None) -> List:
     all_wb_runs: List = []
-    api = wandb.Api()
+    api = api or get_api()
+    rate_limiter = rate_limiter or RateLimiter()
     for run_path in run_paths:
         run_path = parse_run_path(run_path)
         run_name = run_path.split("/")[-1]
@@ -50,53 +110,34 @@ def get_runs(run_paths: List) -> List:
         wb_filters = {
             "$or": [{"display_name": (n if "*" not in n else {"$regex": n})} for n in [run_name]]
         }
+        rate_limiter.wait()
         wb_runs = api.runs(path=wb_path, filters=wb_filters)
         print(f"Found {len(wb_runs)} matching runs in {wb_path}")
         all_wb_runs += wb_runs
     return all_wb_runs
 
 
-def parse_args():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "-n", "--wandb-names", type=str, nargs="+", required=True, help="Full run name or regex"
-    )
-    parser.add_argument("-x", "--x-axis", type=str, default="_step", help="X axis")
-    parser.add_argument(
-        "-y", "--y-axis", nargs="+", type=str, default=["train/Perplexity"], help="Y axis"
-    )
-    parser.add_argument("-e", "--eval-only", action="store_true")
-    parser.add_argument(
-        "-o",
-        "--output-path",
-        type=str,
-        required=True,
-        help="Output csv file",
-    )
-
-    return parser.parse_args()
+def get_y_axis(y_axis: List[str], eval_only: bool = False) -> List[str]:
+    """
+    Expands the metric group aliases (e.g. "validation-and-downstream-v2") into W&B keys.
+    """
+    if y_axis == ["eval/all-validation/CrossEntropyLoss"]:
+        y_axis = [f"eval/{d}/CrossEntropyLoss" for d in validation]
 
+    elif y_axis == ["eval/all-v3-validation/CrossEntropyLoss"]:
+        y_axis = [f"eval/{d}/CrossEntropyLoss" for d in v3_validation]
 
-def main(args):
-    if args.y_axis == ["eval/all-validation/CrossEntropyLoss"]:
-        args.y_axis = [f"eval/{d}/CrossEntropyLoss" for d in validation]
-
-    elif args.y_axis == ["eval/all-v3-validation/CrossEntropyLoss"]:
-        args.y_axis = [f"eval/{d}/CrossEntropyLoss" for d in v3_validation]
+    elif y_axis == ["eval/all-validation-and-bpb/CrossEntropyLoss"]:
+        y_axis = [f"eval/{d}/CrossEntropyLoss" for d in validation] + downstream_bpb
 
-    elif args.y_axis == ["eval/all-validation-and-bpb/CrossEntropyLoss"]:
-        args.y_axis = [f"eval/{d}/CrossEntropyLoss" for d in validation] + downstream_bpb
+    elif y_axis == ["eval/downstream/all"]:
+        y_axis = downstream
 
-    elif args.y_axis == ["eval/downstream/all"]:
-        args.y_axis = downstream
+    elif y_axis == ["eval/validation-and-bpb-and-downstream"]:
+        y_axis = [f"eval/{d}/CrossEntropyLoss" for d in validation] + downstream_bpb + downstream
 
-    elif args.y_axis == ["eval/validation-and-bpb-and-downstream"]:
-        args.y_axis = (
-            [f"eval/{d}/CrossEntropyLoss" for d in validation] + downstream_bpb + downstream
-        )
-
-    elif args.y_axis == ["eval/validation-and-bpb-and-downstream-newline"]:
-        args.y_axis = (
+    elif y_axis == ["eval/validation-and-bpb-and-downstream-newline"]:
+        y_axis = (
             [f"eval/{d}/CrossEntropyLoss" for d in validation]
             + downstream_bpb
             + downstream
@@ -104,8 +145,8 @@ def main(args):
             + [f"eval/downstream/{d}" for d in downstream_newline]
         )
 
-    elif args.y_axis == ["validation-and-downstream-v2"]:
-        args.y_axis = (
+    elif y_axis == ["validation-and-downstream-v2"]:
+        y_axis = (
             [f"eval/{d}/CrossEntropyLoss" for d in validation]
             + v2_downstream_bpb
             + v2_downstream_rc_acc
@@ -113,8 +154,8 @@ def main(args):
             + v2_downstream_soft_log
         )
 
-    elif args.y_axis == ["validation-and-downstream-v2-mc"]:
-        args.y_axis = (
+    elif y_axis == ["validation-and-downstream-v2-mc"]:
+        y_axis = (
             [f"eval/{d}/CrossEntropyLoss" for d in validation]
             + v2_downstream_bpb
             + v2_downstream_rc_acc
@@ -123,63 +164,473 @@ def main(args):
             + v2_downstream_soft_log
         )
 
-    if not args.eval_only:
-        args.y_axis += [
+    if not eval_only:
+        y_axis = y_axis + [
             "throughput/total_tokens",
             "throughput/total_training_Gflops",
             "optim/learning_rate_group0",
         ]
-
-    wb_runs = get_runs(args.wandb_names)
-
-    print(
-        "Downloading the data from the following wandb runs:\n",
-        "\n".join([str(run) for run in wb_runs]),
+    return y_axis
+
+
+# the keys of each metric, for a dict of tasks
+METRIC_KEY_GETTERS: Dict[str, Callable[[Dict], List[str]]] = {
+    "bpb": get_bpb_keys,
+    "rc_acc": get_accuracy_keys,
+    "mc_acc": get_mc_accuracy_keys,
+    "soft": get_soft_keys,
+    "soft_log": get_log_soft_keys,
+    "c4": lambda _: ["eval/c4_en-validation/CrossEntropyLoss"],
+}
+# what the step1/step2 loaders read for the rc_bpb, rc_acc, mc_acc and rc_soft_log metrics
+DEFAULT_TASK_METRICS = ["bpb", "rc_acc", "mc_acc", "soft_log"]
+
+
+def get_task_keys(task_names: List[str], metrics: Optional[List[str]] = None) -> List[str]:
+    """
+    Returns the W&B keys of the given metrics (see METRIC_KEY_GETTERS) for the given tasks or
+    task sets (e.g. "v2_main", see get_task_sets), without duplicates.
+    """
+    task_subset = {name: tasks[name] for name in get_task_sets(task_names)}
+    keys: List[str] = []
+    for metric in metrics or DEFAULT_TASK_METRICS:
+        keys += METRIC_KEY_GETTERS[metric](task_subset)
+    return [key for key in dict.fromkeys(keys) if key]
+
+
+def get_field_names(job: Dict[str, Any]) -> List[str]:
+    """
+    The columns to download for a job: its x axis, the keys of its tasks (if any) and its y
+    axis keys, which default to train/Perplexity when no tasks are given.
+    """
+    keys = get_task_keys(job["tasks"], job.get("metrics")) if job.get("tasks") else []
+    y_axis = job.get("y_axis")
+    if y_axis is None:
+        y_axis = [] if job.get("tasks") else ["train/Perplexity"]
+    keys += get_y_axis(y_axis, job["eval_only"])
+    return [job["x_axis"]] + [key for key in dict.fromkeys(keys) if key != job["x_axis"]]
+
+
+def _write_chunk(chunk_dir: str, field_names: List[str], x_axis: str, rows: List[Dict]) -> str:
+    rows.sort(key=lambda row: float(row[x_axis]))
+    fd, path = tempfile.mkstemp(dir=chunk_dir, suffix=".csv")
+    with os.fdopen(fd, "w", newline="") as file_ref:
+        _write_stream(file_ref, field_names, rows, header=True)
+    return path
+
+
+def download_run(
+    wb_run,
+    field_names: List[str],
+    rate_limiter: RateLimiter,
+    chunk_dir: str,
+    min_step: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Streams the history of a run (from min_step on, if given), with its peak learning rate and
+    batch size added, into csv chunks of at most PAGE_SIZE rows in chunk_dir, each sorted by the
+    x axis (field_names[0]). Returns the chunk paths in download order, the number of rows and
+    the run's last step.
+    """
+    config = json.loads(wb_run.json_config)
+    batch_size_in_tokens = (
+        config["global_train_batch_size"]["value"] * config["model"]["value"]["max_sequence_length"]
     )
-
-    field_names = [args.x_axis] + args.y_axis
-
-    dirname = os.path.dirname(args.output_path)
+    learning_rate_peak = config["optimizer"]["value"]["learning_rate"]
+
+    x_axis = field_names[0]
+    chunks: List[str] = []
+    rows: List[Dict] = []
+    num_rows, last_step = 0, None
+    scan_kwargs = {"min_step": min_step} if min_step is not None else {}
+    history = iter(wb_run.scan_history(keys=field_names, page_size=PAGE_SIZE, **scan_kwargs))
+    try:
+        while True:
+            # the history is fetched lazily, one request per page
+            if num_rows % PAGE_SIZE == 0:
+                rate_limiter.wait()
+            wb_step = next(history, None)
+            if wb_step is None:
+                break
+            wb_step["learning_rate_peak"] = learning_rate_peak
+            # With certain run restarts, we also update the batch size.
+            wb_step["batch_size_in_tokens"] = batch_size_in_tokens
+            if wb_step.get("_step") is not None:
+                last_step = max(wb_step["_step"], last_step if last_step is not None else 0)
+            rows.append(wb_step)
+            num_rows += 1
+            if len(rows) == PAGE_SIZE:
+                chunks.append(_write_chunk(chunk_dir, field_names, x_axis, rows))
+                rows = []
+        if rows:
+            chunks.append(_write_chunk(chunk_dir, field_names, x_axis, rows))
+    except BaseException:
+        # a failed attempt is retried from scratch
+        for path in chunks:
+            os.remove(path)
+        raise
+    return {"chunks": chunks, "num_rows": num_rows, "last_step": last_step}
+
+
+def _read_chunk(path: str, x_axis: str, order: int) -> Iterator:
+    with open(path, newline="") as file_ref:
+        for i, row in enumerate(csv.DictReader(file_ref)):
+            yield float(row[x_axis]), order, i, row
+
+
+def merge_chunks(paths: List[str], x_axis: str) -> Iterator[Dict]:
+    """
+    K-way merges csv chunks, each sorted by x_axis, into a single stream sorted by x_axis. Of
+    the rows sharing an x value, the last one (in chunk order, then row order) wins, so that
+    later runs (e.g. restarts) overwrite the steps they share with earlier ones. Only one row per
+    chunk is held in memory.
+    """
+    merged = heapq.merge(*[_read_chunk(path, x_axis, order) for order, path in enumerate(paths)])
+    previous = None
+    for x, _, _, row in merged:
+        if previous is not None and x != previous[0]:
+            yield previous[1]
+        previous = (x, row)
+    if previous is not None:
+        yield previous[1]
+
+
+def _write_stream(file_ref, field_names: List[str], rows: Iterable[Dict], header: bool):
+    writer = csv.DictWriter(
+        file_ref,
+        fieldnames=field_names + ["learning_rate_peak", "batch_size_in_tokens"],
+    )
+    if header:
+        writer.writeheader()
+    last_row = None
+    for last_row in rows:
+        writer.writerow(last_row)
+    return last_row
+
+
+def write_rows(output_path: str, field_names: List[str], rows: Iterable[Dict]) -> Optional[Dict]:
+    """
+    Writes rows (already sorted and deduplicated, see merge_chunks) to output_path through a
+    temporary file. Returns the last row written.
+    """
+    dirname = os.path.dirname(output_path)
     if dirname:
         os.makedirs(dirname, exist_ok=True)
-    with open(args.output_path, "w") as file_ref:
-        writer = csv.DictWriter(
-            file_ref,
-            fieldnames=field_names + ["learning_rate_peak", "batch_size_in_tokens"],
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", newline="") as file_ref:
+        last_row = _write_stream(file_ref, field_names, rows, header=True)
+    os.replace(tmp_path, output_path)
+    return last_row
+
+
+def _state_path(output_path: str) -> str:
+    return f"{output_path}.sync.json"
+
+
+def get_config_hash(wb_run) -> str:
+    return hashlib.sha256(wb_run.json_config.encode()).hexdigest()
+
+
+def load_sync_state(output_path: str, field_names: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Returns the state recorded by the last sync of output_path: the csv's committed size and
+    last x value, and each run's id, config hash and last step. Returns None if the csv has to
+    be downloaded from scratch (no state, a different set of columns, or a truncated csv).
+    """
+    try:
+        with open(_state_path(output_path)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state["field_names"] != field_names:
+        return None
+    if not os.path.exists(output_path) or os.path.getsize(output_path) < state["size"]:
+        return None
+    return state
+
+
+def save_sync_state(output_path: str, state: Dict[str, Any]):
+    state = {**state, "size": os.path.getsize(output_path)}
+    tmp_path = f"{_state_path(output_path)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, _state_path(output_path))
+
+
+def sync_rows(
+    output_path: str,
+    field_names: List[str],
+    x_axis: str,
+    chunks: List[str],
+    state: Optional[Dict[str, Any]],
+) -> Optional[float]:
+    """
+    Adds the rows of the newly downloaded chunks to output_path and returns the csv's last x
+    value. If the new rows all come after the rows already synced, they are appended;
+    otherwise (e.g. a restarted run rewinding to an earlier step) the csv is merged with them
+    and rewritten. Anything past the size recorded in the state, i.e. an append that was never
+    committed by saving the state, is discarded first.
+    """
+    if state is None:
+        last_row = write_rows(output_path, field_names, merge_chunks(chunks, x_axis))
+        return float(last_row[x_axis]) if last_row is not None else None
+
+    with open(output_path, "r+") as file_ref:
+        file_ref.truncate(state["size"])
+    rows = merge_chunks(chunks, x_axis)
+    first_row = next(rows, None)
+    if first_row is None:
+        return state["last_x"]
+    if state["last_x"] is None or float(first_row[x_axis]) > state["last_x"]:
+        with open(output_path, "a", newline="") as file_ref:
+            last_row = _write_stream(
+                file_ref, field_names, itertools.chain([first_row], rows), header=False
+            )
+            file_ref.flush()
+            os.fsync(file_ref.fileno())
+    else:
+        # the existing csv is itself a sorted chunk, older than the new ones
+        last_row = write_rows(
+            output_path, field_names, merge_chunks([output_path] + chunks, x_axis)
+        )
+    if last_row is None:
+        return state["last_x"]
+    return float(last_row[x_axis])
+
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """
+    Reads a manifest of downloads (JSON, or YAML if PyYAML is installed), either a list of
+    entries or {"defaults": {...}, "runs": [entries]}. Each entry has `names` (run path(s) or
+    patterns, see parse_run_path) and `output` (csv path), and optionally `x_axis`, `y_axis`,
+    `tasks` and `metrics` (see get_field_names), `eval_only` and `sync` (see download), which
+    default to the values in "defaults" and then to the CLI defaults:
+
+        defaults:
+          tasks: [v2_main]
+          metrics: [bpb, rc_acc]
+        runs:
+          - names: ai2-llm/olmo-ladder/peteish-moreeval-190M-1xC
+            output: wandb/peteish-moreeval/190M-1xC.csv
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"runs": manifest}
+
+    defaults: Dict[str, Any] = {"x_axis": "_step", "y_axis": None, "eval_only": False}
+    defaults.update(manifest.get("defaults", {}))
+    jobs = []
+    for entry in manifest["runs"]:
+        job = {**defaults, **entry}
+        for key in ["names", "y_axis", "tasks", "metrics"]:
+            if isinstance(job.get(key), str):
+                job[key] = [job[key]]
+        jobs.append(job)
+    return jobs
+
+
+def download(
+    jobs: List[Dict[str, Any]],
+    api=None,
+    workers: int = 8,
+    max_retries: int = 5,
+    backoff: float = 2.0,
+    requests_per_second: Optional[float] = 5.0,
+):
+    """
+    Downloads each job's runs (see load_manifest) into its output csv. All runs, across jobs,
+    are downloaded concurrently by a pool of `workers` threads sharing one W&B API client (a
+    wandb.Api, or any stand-in with the same runs() interface) and one rate limit; failed
+    requests are retried with exponential backoff.
+
+    Jobs with `sync` set are updated incrementally: each run's history is requested from the
+    step after the last one synced (recorded in a <output>.sync.json sidecar with the run ids,
+    config hashes and last steps), and the new rows are appended to the csv.
+    """
+    api = api or get_api()
+    rate_limiter = RateLimiter(requests_per_second)
+
+    def list_runs(job):
+        return with_retries(
+            lambda: get_runs(job["names"], api=api, rate_limiter=rate_limiter),
+            f"Listing {job['names']}",
+            max_retries=max_retries,
+            backoff=backoff,
         )
 
-        writer.writeheader()
-
-        rows = []
-        for wb_run in tqdm(wb_runs):
-            print(f"Processing {wb_run.name}")
-            history = wb_run.scan_history(
-                keys=field_names,
-                page_size=10000,
-            )  # page_size cannot be too big, it will make it faster but it will start to downsample
-
-            config = json.loads(wb_run.json_config)
-            batch_size_in_tokens = (
-                config["global_train_batch_size"]["value"]
-                * config["model"]["value"]["max_sequence_length"]
+    with tempfile.TemporaryDirectory(prefix="wandb-chunks-") as chunk_dir, ThreadPoolExecutor(
+        max_workers=workers
+    ) as executor:
+        runs_by_job = list(executor.map(list_runs, jobs))
+        field_names_by_job = [get_field_names(job) for job in jobs]
+
+        # in sync mode, each run resumes after the last step already in the csv, unless its
+        # config has changed since (then the whole csv is downloaded again)
+        states_by_job, run_jobs = [], []
+        for job, wb_runs, field_names in zip(jobs, runs_by_job, field_names_by_job):
+            state = load_sync_state(job["output"], field_names) if job.get("sync") else None
+            if state is not None and any(
+                wb_run.id in state["runs"]
+                and state["runs"][wb_run.id]["config_hash"] != get_config_hash(wb_run)
+                for wb_run in wb_runs
+            ):
+                state = None
+            states_by_job.append(state)
+            for wb_run in wb_runs:
+                run_state = state["runs"].get(wb_run.id) if state is not None else None
+                if run_state is not None and run_state["last_step"] is not None:
+                    run_jobs.append((wb_run, field_names, run_state["last_step"] + 1))
+                else:
+                    run_jobs.append((wb_run, field_names, None))
+
+        progress = {"done": 0}
+        progress_lock = threading.Lock()
+
+        def fetch(run_job):
+            wb_run, field_names, min_step = run_job
+            start = time.monotonic()
+            result = with_retries(
+                lambda: download_run(
+                    wb_run, field_names, rate_limiter, chunk_dir, min_step=min_step
+                ),
+                f"Downloading {wb_run.name}",
+                max_retries=max_retries,
+                backoff=backoff,
+            )
+            resumed = f" from step {min_step}" if min_step is not None else ""
+            with progress_lock:
+                progress["done"] += 1
+                print(
+                    f"[{progress['done']}/{len(run_jobs)}] {wb_run.name}: "
+                    f"{result['num_rows']} rows{resumed} in {time.monotonic() - start:.1f}s"
+                )
+            return result
+
+        results = list(executor.map(fetch, run_jobs))
+
+        # the chunks of each job's runs, in the order the runs were listed
+        offset = 0
+        for job, wb_runs, field_names, state in zip(
+            jobs, runs_by_job, field_names_by_job, states_by_job
+        ):
+            run_results = results[offset : offset + len(wb_runs)]
+            offset += len(wb_runs)
+            chunks = [path for result in run_results for path in result["chunks"]]
+            if not job.get("sync"):
+                write_rows(job["output"], field_names, merge_chunks(chunks, job["x_axis"]))
+                continue
+
+            last_x = sync_rows(job["output"], field_names, job["x_axis"], chunks, state)
+            runs = dict(state["runs"]) if state is not None else {}
+            for wb_run, result in zip(wb_runs, run_results):
+                steps = [result["last_step"]]
+                if wb_run.id in runs:
+                    steps.append(runs[wb_run.id]["last_step"])
+                runs[wb_run.id] = {
+                    "name": wb_run.name,
+                    "config_hash": get_config_hash(wb_run),
+                    "last_step": max([step for step in steps if step is not None], default=None),
+                }
+            save_sync_state(
+                job["output"], {"field_names": field_names, "last_x": last_x, "runs": runs}
             )
 
-            for wb_step in history:
-                wb_step["learning_rate_peak"] = config["optimizer"]["value"]["learning_rate"]
-                # With certain run restarts, we also update the batch size.
-                wb_step["batch_size_in_tokens"] = batch_size_in_tokens
-                rows.append(wb_step)
 
-        row_by_key = {}
-        for row in rows:
-            key = row[args.x_axis]
-            row_by_key[key] = row
-        rows = list(row_by_key.values())
-        rows = sorted(rows, key=lambda x: x[args.x_axis])
-        writer.writerows(rows)
+def parse_args():
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-n", "--wandb-names", type=str, nargs="+", help="Full run name or regex")
+    source.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        help="JSON/YAML manifest of runs to download (see load_manifest)",
+    )
+    parser.add_argument("-x", "--x-axis", type=str, default="_step", help="X axis")
+    parser.add_argument(
+        "-y",
+        "--y-axis",
+        nargs="+",
+        type=str,
+        default=None,
+        help="Y axis (default: train/Perplexity, or nothing beyond the task keys with -t)",
+    )
+    parser.add_argument(
+        "-t",
+        "--tasks",
+        nargs="+",
+        type=str,
+        default=None,
+        help="Tasks or task sets (e.g. v2_main) whose metric keys to download",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        choices=list(METRIC_KEY_GETTERS),
+        default=None,
+        help=f"Metrics to download for the tasks (default: {' '.join(DEFAULT_TASK_METRICS)})",
+    )
+    parser.add_argument("-e", "--eval-only", action="store_true")
+    parser.add_argument(
+        "-o",
+        "--output-path",
+        type=str,
+        default=None,
+        help="Output csv file (with -n)",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Only download the steps missing from existing outputs and append them",
+    )
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent downloads")
+    parser.add_argument("--max-retries", type=int, default=5, help="Retries per failed request")
+    parser.add_argument(
+        "--requests-per-second", type=float, default=5.0, help="Global limit on W&B API requests"
+    )
+
+    args = parser.parse_args()
+    if args.wandb_names and not args.output_path:
+        parser.error("-o/--output-path is required with -n/--wandb-names")
+    return args
+
+
+def main(args):
+    if args.manifest:
+        jobs = load_manifest(args.manifest)
+    else:
+        jobs = [
+            {
+                "names": args.wandb_names,
+                "output": args.output_path,
+                "x_axis": args.x_axis,
+                "y_axis": args.y_axis,
+                "tasks": args.tasks,
+                "metrics": args.metrics,
+                "eval_only": args.eval_only,
+            }
+        ]
+    if args.sync:
+        for job in jobs:
+            job.setdefault("sync", True)
+    download(
+        jobs,
+        workers=args.workers,
+        max_retries=args.max_retries,
+        requests_per_second=args.requests_per_second,
+    )
 
 
 if __name__ == "__main__":
+    # python -m scaling.download_wandb_logs -m wandb/peteish-moreeval.yaml --workers 16
+    # python -m scaling.download_wandb_logs -n 'ai2-llm/olmo-ladder/peteish-moreeval-190M-1xC' -t v2_main --metrics bpb rc_acc -o wandb/peteish-moreeval/190M-1xC.csv
+
     # python olmo/scaling/scaling_laws/download_wandb_logs.py -n 'ai2-llm/olmo-mup/new_mup_olmo_256*' -y train/CrossEntropyLoss -o wandb_outputs/mup-olmo-256-train.csv
 
     # python olmo/scaling/scaling_laws/download_wandb_logs.py -n 'ai2-llm/olmo-tiny/tiny-olmo-20M-rms-norm-adam-eps-1e-8-lr-6e-4-emb-wd' -y eval/all-validation/CrossEntropyLoss -o wandb/tiny-olmo-20M-rms-norm-adam-eps-1e-8-lr-6e-4-emb-wd_val-all.csv
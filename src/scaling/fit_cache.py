@@ -0,0 +1,191 @@
+"""
+On-disk cache for curve fits, keyed by the content of everything that determines a fit:
+the training arrays, the fitting function (by name and bytecode), the initial point, the
+bounds and the solver options. Entries are small .npz files; the least recently used ones
+are evicted once the cache directory grows past its size limit.
+
+The cache is off unless enabled, either with set_fit_cache() (which defaults to
+``~/.cache/olmo-ladder/fits``) or from the environment:
+
+- ``OLMO_LADDER_FIT_CACHE``: cache directory, e.g. ``~/.cache/olmo-ladder/fits``; unset or
+  empty disables caching.
+- ``OLMO_LADDER_FIT_CACHE_MAX_BYTES``: size limit in bytes (default 512 MiB).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import types
+from typing import Any, Dict, Optional
+
+import numpy as np
+import scipy
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "olmo-ladder", "fits")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# part of every key: bump it when a change to the solvers that the hashed fitting functions do
+# not capture (the Huber objective, get_huber_covariance, the solver wrappers) changes results
+CACHE_VERSION = 1
+
+_config: Dict[str, Any] = {
+    "cache_dir": os.path.expanduser(os.environ.get("OLMO_LADDER_FIT_CACHE", "")),
+    "max_bytes": int(os.environ.get("OLMO_LADDER_FIT_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+}
+# bytes written since the directory size was last checked; eviction scans are amortized over
+# max_bytes / 16 of writes so that many small fits (e.g. bootstrap replicates) stay cheap
+_bytes_since_check = None
+
+
+def set_fit_cache(cache_dir: Optional[str] = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+    """
+    Points the cache at cache_dir (None or "" disables it) with the given size limit.
+    """
+    global _bytes_since_check
+    _config["cache_dir"] = cache_dir or ""
+    _config["max_bytes"] = max_bytes
+    _bytes_since_check = None
+
+
+def get_solver_version() -> str:
+    """
+    Identifies the solver code (CACHE_VERSION) and SciPy version, for keys of cached results.
+    """
+    return f"v{CACHE_VERSION}:scipy={scipy.__version__}"
+
+
+def _code_digest(code: types.CodeType, digest):
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_digest(const, digest)
+        else:
+            digest.update(repr(const).encode())
+    digest.update(repr(code.co_names).encode())
+
+
+def _canonical(obj):
+    # JSON-serializable form of the options, recursing into dicts (e.g. solver options) and
+    # sequences so that arrays and NumPy scalars nested anywhere hash by value
+    if isinstance(obj, dict):
+        return {key: _canonical(value) for key, value in obj.items()}
+    if isinstance(obj, np.ndarray):
+        return [_canonical(value) for value in obj.tolist()]
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(value) for value in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def get_fit_key(solver: str, train_xs, train_ys, funcs, **options) -> Optional[str]:
+    """
+    Returns the cache key of a fit, or None if caching is disabled or one of the fitting
+    functions is a closure (whose captured state cannot be hashed reliably). Only the bytecode
+    of the functions themselves is hashed, not that of the helpers they call.
+    """
+    if not _config["cache_dir"]:
+        return None
+    digest = hashlib.sha256()
+    digest.update(f"{solver}:{get_solver_version()}".encode())
+    for func in funcs:
+        if getattr(func, "__closure__", None) is not None or not hasattr(func, "__code__"):
+            return None
+        digest.update(f"{func.__module__}.{func.__qualname__}".encode())
+        _code_digest(func.__code__, digest)
+    for values in (train_xs, train_ys):
+        values = np.ascontiguousarray(values, dtype=float)
+        digest.update(repr(values.shape).encode())
+        digest.update(values.tobytes())
+    digest.update(json.dumps(_canonical(options), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def load_fit(key: Optional[str]) -> Optional[Dict]:
+    if key is None:
+        return None
+    path = os.path.join(_config["cache_dir"], f"{key}.npz")
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            result = {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        # missing, or a partially written / corrupt entry
+        return None
+    try:
+        # mark as recently used for the eviction order
+        os.utime(path)
+    except OSError:
+        pass
+    result["cov"] = result["cov"] if result["cov"].size else None
+    return result
+
+
+def save_fit(key: Optional[str], result: Dict):
+    """
+    Stores result (coefficients, cov and convergence info) under key and evicts the least
+    recently used entries if the cache has grown past its size limit.
+    """
+    global _bytes_since_check
+    if key is None:
+        return
+    cache_dir = _config["cache_dir"]
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.npz")
+    tmp_path = os.path.join(cache_dir, f"{key}.{os.getpid()}-{threading.get_ident()}.tmp.npz")
+    arrays = {name: np.asarray(value) for name, value in result.items()}
+    if result.get("cov") is None:
+        arrays["cov"] = np.empty(0)
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+    if _bytes_since_check is not None:
+        _bytes_since_check += os.path.getsize(path)
+        if _bytes_since_check < _config["max_bytes"] // 16:
+            return
+    _bytes_since_check = 0
+    evict(cache_dir, _config["max_bytes"])
+
+
+def evict(cache_dir: str, max_bytes: int):
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".npz") and ".tmp." not in entry.name:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def load_json_result(cache_dir: Optional[str], key: str) -> Optional[Any]:
+    """
+    Reads a result stored by save_json_result in cache_dir (None or "" disables the cache), for
+    scripts that cache whole results of their own (e.g. cross-validation folds).
+    """
+    if not cache_dir:
+        return None
+    path = os.path.join(cache_dir, f"{key}.json")
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # missing, or a partially written / corrupt entry
+        return None
+
+
+def save_json_result(cache_dir: Optional[str], key: str, result: Any):
+    if not cache_dir:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(result, f)
+    os.replace(tmp_path, path)
@@ -1,6 +1,13 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Tuple, Union
+
 import numpy as np
 import scipy
 
+from scaling.fit_cache import get_fit_key, load_fit, save_fit
+
 # Power Law functions
 
 
@@ -20,11 +27,18 @@ def chinchilla_contaminated_fit(x, a, b, c, d):
 def get_coefficients(
     train_xs, train_ys, fitting_func, p0, bounds=(-np.inf, np.inf), disp=True, return_cov=False
 ):
-    if isinstance(train_xs[0], list):
+    if np.ndim(train_xs) == 2:
         train_xs = np.array(train_xs).transpose()
-    coeffs, cov = scipy.optimize.curve_fit(
-        fitting_func, train_xs, train_ys, p0=p0, bounds=bounds, maxfev=500000
-    )
+    key = get_fit_key("curve_fit", train_xs, train_ys, [fitting_func], p0=p0, bounds=bounds)
+    result = load_fit(key)
+    if result is None:
+        coeffs, cov = scipy.optimize.curve_fit(
+            fitting_func, train_xs, train_ys, p0=p0, bounds=bounds, maxfev=500000
+        )
+        # curve_fit raises instead of returning an unconverged fit
+        save_fit(key, {"coefficients": coeffs, "cov": cov, "converged": True})
+    else:
+        coeffs, cov = result["coefficients"], result["cov"]
     if disp:
         coeffs_string = ", ".join(
             [chr(ord("a") + i) + f" = {coeffs[i]:.2f}" for i in range(len(coeffs))]
@@ -35,16 +49,104 @@ def get_coefficients(
     return coeffs
 
 
-def get_std_errors(xs, ys, coefficients, cov, fitting_func, grad_fitting_func):
-    # Compute the Jacobian matrix
-    jacobian = np.zeros((len(xs), len(coefficients)))
-    for j, x in enumerate(xs):
-        jacobian[j] = grad_fitting_func(x, coefficients)
-
-    # Compute standard errors for predictions
-    # intermediate = np.sum(jacobian @ cov @ jacobian.T, axis=1)
-    intermediate = np.diag(jacobian @ cov @ jacobian.T)
-    std_errors = np.sqrt(intermediate.clip(min=0.0))
+# Vectorized evaluation: xs is (n_points,) or (n_points, n_dims), and the fitting functions
+# index x[i] along the leading axis, so we hand them the transposed (n_dims, n_points) array
+def _as_columns(xs):
+    xs = np.asarray(xs, dtype=float)
+    return xs.T if xs.ndim == 2 else xs
+
+
+def _stack_jacobian(grads, n_points):
+    # constant entries (e.g. grad_E = 1) are broadcast by the column assignment
+    jacobian = np.empty((n_points, len(grads)))
+    for i, grad in enumerate(grads):
+        jacobian[:, i] = grad
+    return jacobian
+
+
+def evaluate_fit(fitting_func, xs, p):
+    columns = _as_columns(xs)
+    return np.broadcast_to(fitting_func(columns, p), columns.shape[-1:]).astype(float)
+
+
+def evaluate_jacobian(grad_func, xs, p):
+    # returns the (n_points, n_params) Jacobian of fitting_func w.r.t. p
+    columns = _as_columns(xs)
+    return _stack_jacobian(grad_func(columns, p), columns.shape[-1])
+
+
+# Huber loss on log residuals (same objective as get_coefficients_huber), evaluated for all
+# points in one NumPy call and returned with its gradient, so the model is evaluated once per step
+def _huber_loss_and_jac(p, fitting_func, grad_func, train_columns, log_train_ys, delta):
+    preds = fitting_func(train_columns, p)
+    jacobian = _stack_jacobian(grad_func(train_columns, p), log_train_ys.shape[0])
+    us = np.log(preds) - log_train_ys
+    abs_us = np.abs(us)
+    loss = np.sum(np.where(abs_us < delta, 0.5 * us**2, delta * (abs_us - 0.5 * delta)))
+    grad_us = np.clip(us, -delta, delta)
+    return loss, (grad_us / preds) @ jacobian
+
+
+# Same objective for forms with a fused value_and_grad function (see VALUE_AND_GRAD), which
+# returns the predictions and the (n_params, n_points) Jacobian from one pass over the terms
+# they share. grad_us @ (us - grad_us / 2) is the summed Huber loss of the residuals.
+def _fused_huber_loss_and_jac(p, value_and_grad, train_columns, log_train_ys, delta):
+    preds, jacobian = value_and_grad(train_columns, p)
+    us = np.log(preds) - log_train_ys
+    grad_us = np.minimum(np.maximum(us, -delta), delta)
+    return grad_us @ (us - 0.5 * grad_us), jacobian @ (grad_us / preds)
+
+
+def _get_huber_objective(
+    fitting_func, grad_func, train_xs, train_ys, delta
+) -> Tuple[Callable[..., Any], tuple]:
+    # (fun, args) of the vectorized Huber objective, for scipy.optimize.minimize(jac=True)
+    train_columns = _as_columns(train_xs)
+    log_train_ys = np.log(np.asarray(train_ys, dtype=float))
+    value_and_grad = VALUE_AND_GRAD.get(fitting_func)
+    if value_and_grad is not None:
+        return _fused_huber_loss_and_jac, (value_and_grad, train_columns, log_train_ys, delta)
+    return _huber_loss_and_jac, (fitting_func, grad_func, train_columns, log_train_ys, delta)
+
+
+def get_huber_covariance(train_xs, train_ys, fitting_func, grad_func, coefficients, delta=1e-3):
+    """
+    Sandwich (Gauss-Newton) covariance of the coefficients fitted by get_coefficients_huber,
+    computed from a single Jacobian evaluation at the optimum.
+
+    With log residuals u, their Jacobian J = grad / pred and the Huber IRLS weights
+    w = min(1, delta / |u|): H = J^T W J, B = J^T diag((w * u)^2) J, and
+    cov = n / (n - p) * H^-1 B H^-1.
+    """
+    train_ys = np.asarray(train_ys, dtype=float)
+    preds = evaluate_fit(fitting_func, train_xs, coefficients)
+    jacobian = evaluate_jacobian(grad_func, train_xs, coefficients) / preds[:, None]
+    us = np.log(preds) - np.log(train_ys)
+    weights = np.minimum(1.0, delta / np.maximum(np.abs(us), np.finfo(float).tiny))
+    return _sandwich_covariance(jacobian, us, weights)
+
+
+def _sandwich_covariance(jacobian, us, weights):
+    # weights are the IRLS weights psi(u) / u of the robust loss
+    n_points, n_params = jacobian.shape
+    hess_inv = np.linalg.pinv(jacobian.T @ (weights[:, None] * jacobian))
+    meat = jacobian.T @ (((weights * us) ** 2)[:, None] * jacobian)
+    return n_points / max(n_points - n_params, 1) * hess_inv @ meat @ hess_inv
+
+
+def get_std_errors(xs, ys, coefficients, cov, fitting_func, grad_fitting_func, chunk_size=10000):
+    xs = np.asarray(xs, dtype=float)
+    cov = np.asarray(cov, dtype=float)
+
+    # Only the diagonal of jacobian @ cov @ jacobian.T is needed, so compute it row-wise:
+    # O(n * p^2) time, and O(chunk_size * p) memory when streaming over large grids
+    std_errors = np.empty(len(xs))
+    for start in range(0, len(xs), chunk_size):
+        jacobian = evaluate_jacobian(
+            grad_fitting_func, xs[start : start + chunk_size], coefficients
+        )
+        intermediate = np.sum((jacobian @ cov) * jacobian, axis=1)
+        std_errors[start : start + chunk_size] = np.sqrt(intermediate.clip(min=0.0))
 
     return std_errors
 
@@ -63,6 +165,12 @@ def grad_chinchilla_flops_fit(x, p):
     return [grad_a, grad_alpha, grad_E]
 
 
+def value_and_grad_chinchilla_flops_fit(x, p):
+    p = np.asarray(p)
+    term = np.exp(p[0]) / x ** p[1]
+    return term + p[2], np.stack([term, -term * np.log(x), np.ones_like(term)])
+
+
 # x[0] = d, x[1] = h
 # p[0] = b = log100(B), p[1] = beta, p[2] = E, p[3] = F
 def chinchilla_d_lr_fit(x, p):
@@ -103,13 +211,25 @@ def grad_chinchilla_n_d_fit(x, p):
     return [grad_a, grad_b, grad_alpha, grad_beta, grad_E]
 
 
+def value_and_grad_chinchilla_n_d_fit(x, p):
+    # x is (2, n_points); the N and D terms are computed together and reused by the Jacobian
+    p = np.asarray(p)
+    log_x = np.log(x)
+    terms = np.exp(p[:2, None] - log_x * p[2:4, None])
+    jacobian = np.empty((5, terms.shape[1]))
+    jacobian[:2] = terms
+    jacobian[2:4] = -terms * log_x
+    jacobian[4] = 1.0
+    return terms[0] + terms[1] + p[4], jacobian
+
+
 # x[0] = n, x[1] = d
 # p[0] = a = log(A), p[1] = b = log(B), p[2] = alpha, p[3] = beta, p[4] = E
 # p[5] = p, p[6] = q
 def combined_fit(x, p):
     step1 = np.exp(p[0]) / x[0] ** p[2] + np.exp(p[1]) / x[1] ** p[3] + p[4]
     step2 = p[5] / (1 + np.exp(-step1)) + p[6]
-    step2 = max(1e-6, step2)
+    step2 = np.maximum(1e-6, step2)
     return step2
 
 
@@ -142,6 +262,24 @@ def grad_chinchilla_n_d_negated_fit(x, p):
     return [grad_a, grad_b, grad_alpha, grad_beta, grad_E]
 
 
+def value_and_grad_chinchilla_n_d_negated_fit(x, p):
+    p = np.asarray(p)
+    terms = np.exp(p[:2, None]) / x ** p[2:4, None]
+    jacobian = np.empty((5, terms.shape[1]))
+    jacobian[:2] = -terms
+    jacobian[2:4] = terms * np.log(x)
+    jacobian[4] = 1.0
+    return -terms[0] - terms[1] + p[4], jacobian
+
+
+# Fused value-and-Jacobian functions used by the vectorized Huber fits of these forms
+VALUE_AND_GRAD: Dict[Callable, Callable] = {
+    chinchilla_flops_fit: value_and_grad_chinchilla_flops_fit,
+    chinchilla_n_d_fit: value_and_grad_chinchilla_n_d_fit,
+    chinchilla_n_d_negated_fit: value_and_grad_chinchilla_n_d_negated_fit,
+}
+
+
 # x[0] = n, x[1] = d, x[2] = h
 # p[0] = a = log(A), p[1] = b = log(B), p[2] = alpha, p[3] = beta, p[4] = E, p[5] = F
 def chinchilla_n_d_lr_fit(x, p):
@@ -331,7 +469,7 @@ def grad_chinchilla_n_d_lr_logt_minus_logtd_fit(x, p):
 
 def tissue_fit(x, p):
     # return e**a / x[0]**alpha + e**b / x[1]**beta + E - F * x[2] * x[0]**r
-    return max(
+    return np.maximum(
         1e-8,
         np.exp(p[0]) / x[0] ** p[2]
         + np.exp(p[1]) / x[1] ** p[3]
@@ -400,6 +538,49 @@ def grad_sigmoid_fit(x, p):
     return [grad_a, grad_x0, grad_k, grad_b]
 
 
+# Prediction kernels: array-in/array-out evaluation of the fitted forms, so that a plotted
+# curve, an (N, D) grid or a batch of (e.g. bootstrap) coefficients is a single call
+def _unstack_coefficients(coefficients):
+    # (..., n_params) -> n_params arrays of shape (...), which broadcast against the inputs
+    return np.moveaxis(np.asarray(coefficients, dtype=float), -1, 0)
+
+
+def predict_fit(fitting_func, xs, coefficients):
+    """
+    Evaluates a form taking (x, p) on arrays, e.g. chinchilla_n_d_fit with xs = [ns, ds] or
+    chinchilla_flops_fit with xs = fs. The inputs broadcast against each other and against
+    the leading axes of coefficients, an (..., n_params) array: ns[:, None] and ds[None, :]
+    give an (N, D) grid, and (B, 1, 1, n_params) coefficients a (B, N, D) batch of grids.
+    """
+    if isinstance(xs, (list, tuple)):
+        xs = [np.asarray(x, dtype=float) for x in xs]
+    else:
+        xs = np.asarray(xs, dtype=float)
+    return fitting_func(xs, _unstack_coefficients(coefficients))
+
+
+def predict_sigmoid(xs, coefficients, use_log_sigmoid=False):
+    """
+    Evaluates the step 2 form (sigmoid, or log_sigmoid) on arrays, broadcasting like
+    predict_fit.
+    """
+    fit_fn: Callable[..., np.ndarray] = sigmoid
+    if use_log_sigmoid:
+        fit_fn = log_sigmoid
+    return fit_fn(np.asarray(xs, dtype=float), *_unstack_coefficients(coefficients))
+
+
+def predict_chained_fit(
+    xs, step1_coefficients, step2_coefficients, step1_func=chinchilla_n_d_fit, use_log_sigmoid=False
+):
+    """
+    Returns the (loss, accuracy) arrays predicted by step 1 (step1_func) chained into step 2.
+    Batches of coefficients must have the same leading axes for both steps.
+    """
+    losses = predict_fit(step1_func, xs, step1_coefficients)
+    return losses, predict_sigmoid(losses, step2_coefficients, use_log_sigmoid)
+
+
 def exponential_fit(x, a, b, c):
     return a * np.exp(b * x) + c
 
@@ -415,6 +596,7 @@ def get_coefficients_huber(
     disp: bool = True,
     max_iter: int = 10000,
     return_cov: bool = False,
+    vectorized: bool = False,
 ):
     def huber_loss(x, delta):
         if np.abs(x) < delta:
@@ -449,11 +631,45 @@ def get_coefficients_huber(
 
     assert len(train_xs) == len(train_ys)
     delta = 1e-3
+    key = get_fit_key(
+        "huber",
+        train_xs,
+        train_ys,
+        [fitting_func, grad_func],
+        p0=p0,
+        bounds=bounds,
+        max_iter=max_iter,
+        vectorized=vectorized,
+        delta=delta,
+    )
+    result = load_fit(key)
+    if result is not None:
+        coeffs = result["coefficients"]
+        if disp:
+            print(f"coeffs: {coeffs}")
+        if return_cov:
+            cov = result["cov"]
+            if cov is None:
+                cov = get_huber_covariance(
+                    train_xs, train_ys, fitting_func, grad_func, coeffs, delta
+                )
+                save_fit(key, {**result, "cov": cov})
+            return coeffs, cov
+        return coeffs
+
+    fun: Callable[..., Any]
+    args: tuple
+    jac: Union[bool, Callable]
+    if vectorized:
+        fun, args = _get_huber_objective(fitting_func, grad_func, train_xs, train_ys, delta)
+        jac = True
+    else:
+        fun, args, jac = loss_fn, (train_xs, train_ys, delta), jac_fn
     res = scipy.optimize.minimize(
-        loss_fn,
+        fun,
         p0,
-        args=(train_xs, train_ys, delta),
-        jac=jac_fn,
+        args=args,
+        jac=jac,
         bounds=bounds,
         tol=0.0,
         method="L-BFGS-B",
@@ -465,16 +681,20 @@ def get_coefficients_huber(
     if disp:
         print(f"coeffs: {coeffs}")
 
-    # TODO: review
+    cov = None
+    if return_cov:
+        cov = get_huber_covariance(train_xs, train_ys, fitting_func, grad_func, coeffs, delta)
+    save_fit(
+        key,
+        {
+            "coefficients": coeffs,
+            "cov": cov,
+            "converged": res.success,
+            "n_iter": res.nit,
+            "message": str(res.message),
+        },
+    )
     if return_cov:
-        if res.hess_inv is not None:
-            if isinstance(res.hess_inv, scipy.sparse.linalg.LinearOperator):
-                hess_inv = res.hess_inv.todense()
-            else:
-                hess_inv = res.hess_inv
-            cov = np.array(hess_inv)
-        else:
-            cov = None
         return coeffs, cov
     return coeffs
 
@@ -533,3 +753,459 @@ def get_coefficients_huber_nolog(
     if disp:
         print(f"coeffs: {coeffs}")
     return coeffs
+
+
+# Scipy least_squares (trust-region reflective) w/ a robust loss on log residuals
+def get_coefficients_least_squares(
+    train_xs,
+    train_ys,
+    fitting_func,
+    grad_func,
+    p0,
+    bounds,
+    loss: str = "huber",
+    f_scale: float = 1e-3,
+    disp: bool = True,
+    max_iter: int = 10000,
+    return_cov: bool = False,
+):
+    """
+    Same objective as get_coefficients_huber when loss="huber" (f_scale plays the role of
+    delta), solved on the residual vector with the analytic Jacobian grad / pred instead of on
+    the summed scalar loss. loss can be any of least_squares' losses, e.g. "soft_l1" or "linear".
+    bounds are given per parameter as (lower, upper), with None for unbounded.
+    """
+    train_columns = _as_columns(train_xs)
+    log_train_ys = np.log(np.asarray(train_ys, dtype=float))
+    n_points = log_train_ys.shape[0]
+
+    def residuals(p):
+        return np.log(fitting_func(train_columns, p)) - log_train_ys
+
+    def jac(p):
+        preds = fitting_func(train_columns, p)
+        return _stack_jacobian(grad_func(train_columns, p), n_points) / preds[:, None]
+
+    lower = [-np.inf if lo is None else lo for lo, _ in bounds]
+    upper = [np.inf if hi is None else hi for _, hi in bounds]
+    key = get_fit_key(
+        "least_squares",
+        train_xs,
+        train_ys,
+        [fitting_func, grad_func],
+        p0=p0,
+        bounds=[lower, upper],
+        loss=loss,
+        f_scale=f_scale,
+        max_iter=max_iter,
+    )
+    result = load_fit(key)
+    cached = result is not None
+    if result is None:
+        options = dict(
+            jac=jac,
+            bounds=(lower, upper),
+            method="trf",
+            ftol=1e-12,
+            xtol=1e-12,
+            gtol=1e-12,
+            max_nfev=max_iter,
+            verbose=2 if disp else 0,
+        )
+        # With a small f_scale every residual at p0 is in the linear regime of the robust loss
+        # and TRF stalls far from the optimum, so start from the plain least-squares solution
+        res = scipy.optimize.least_squares(residuals, p0, loss="linear", **options)
+        n_evals = res.nfev
+        if loss != "linear":
+            res = scipy.optimize.least_squares(
+                residuals, res.x, loss=loss, f_scale=f_scale, **options
+            )
+            n_evals += res.nfev
+        result = {
+            "coefficients": res.x,
+            "cov": None,
+            "converged": res.status > 0,
+            "n_iter": n_evals,
+            "message": str(res.message),
+        }
+    coeffs = result["coefficients"]
+    if disp:
+        print(f"coeffs: {coeffs}")
+
+    if return_cov and result["cov"] is None:
+        cached = False
+        us = residuals(coeffs)
+        z = (us / f_scale) ** 2
+        if loss == "huber":
+            weights = np.minimum(1.0, 1.0 / np.maximum(np.sqrt(z), np.finfo(float).tiny))
+        elif loss == "soft_l1":
+            weights = 1.0 / np.sqrt(1.0 + z)
+        elif loss == "cauchy":
+            weights = 1.0 / (1.0 + z)
+        elif loss == "arctan":
+            weights = 1.0 / (1.0 + z**2)
+        else:
+            weights = np.ones_like(us)
+        result["cov"] = _sandwich_covariance(jac(coeffs), us, weights)
+    if not cached:
+        save_fit(key, result)
+
+    if return_cov:
+        return coeffs, result["cov"]
+    return coeffs
+
+
+# Multi-start search (Chinchilla Approach 3): grid / Latin-hypercube initializations
+def get_grid_initializations(values_per_param):
+    return np.array(list(itertools.product(*values_per_param)), dtype=float)
+
+
+def get_latin_hypercube_initializations(ranges, num_starts, seed=0):
+    # one sample per stratum along every parameter, strata shuffled independently per parameter
+    lower, upper = np.array(ranges, dtype=float).T
+    rng = np.random.default_rng(seed)
+    strata = rng.permuted(np.tile(np.arange(num_starts), (len(ranges), 1)), axis=1).T
+    sample = (strata + rng.random((num_starts, len(ranges)))) / num_starts
+    return lower + sample * (upper - lower)
+
+
+def _fit_huber_start(train_xs, train_ys, fitting_func, grad_func, p0, bounds, max_iter):
+    fun, args = _get_huber_objective(fitting_func, grad_func, train_xs, train_ys, delta=1e-3)
+    # far-off initializations routinely overflow before they are stopped; that is expected here
+    with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+        res = scipy.optimize.minimize(
+            fun,
+            p0,
+            args=args,
+            jac=True,
+            bounds=bounds,
+            tol=0.0,
+            method="L-BFGS-B",
+            options={"ftol": 0.0, "gtol": 1e-10, "maxiter": max_iter},
+        )
+    return {
+        "coefficients": res.x,
+        "loss": float(res.fun),
+        "n_iter": res.nit,
+        "converged": res.success,
+    }
+
+
+def _map_starts(train_xs, train_ys, fitting_func, grad_func, p0s, bounds, max_iter, num_workers):
+    n = len(p0s)
+    args = (
+        [train_xs] * n,
+        [train_ys] * n,
+        [fitting_func] * n,
+        [grad_func] * n,
+        list(p0s),
+        [bounds] * n,
+        [max_iter] * n,
+    )
+    num_workers = min(num_workers or os.cpu_count() or 1, n)
+    if num_workers == 1:
+        return list(map(_fit_huber_start, *args))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        chunksize = max(1, n // (4 * num_workers))
+        return list(executor.map(_fit_huber_start, *args, chunksize=chunksize))
+
+
+def get_coefficients_huber_multistart(
+    train_xs,
+    train_ys,
+    fitting_func,
+    grad_func,
+    p0s,
+    bounds,
+    disp: bool = True,
+    max_iter: int = 10000,
+    return_cov: bool = False,
+    screen_iter: int = 100,
+    keep_fraction: float = 0.1,
+    num_workers=None,
+):
+    """
+    Runs get_coefficients_huber (vectorized) from every initialization in p0s across a process pool.
+
+    Every start first runs for screen_iter L-BFGS-B iterations; only the best keep_fraction of the
+    starts that have not converged yet are continued (warm-started) up to max_iter, the clearly
+    losing ones are stopped. Returns the best coefficients (and covariance if return_cov) along
+    with a summary of every start.
+    """
+    train_xs = np.asarray(train_xs, dtype=float)
+    train_ys = np.asarray(train_ys, dtype=float)
+    p0s = np.atleast_2d(np.asarray(p0s, dtype=float))
+    assert len(train_xs) == len(train_ys)
+
+    starts = _map_starts(
+        train_xs, train_ys, fitting_func, grad_func, p0s, bounds, screen_iter, num_workers
+    )
+    for p0, start in zip(p0s, starts):
+        start["p0"] = p0
+        start["stopped_early"] = False
+
+    # continue the most promising unconverged starts, stop the rest
+    pending = [i for i, start in enumerate(starts) if not start["converged"]]
+    pending = sorted(pending, key=lambda i: starts[i]["loss"])
+    num_keep = int(np.ceil(keep_fraction * len(pending)))
+    for i in pending[num_keep:]:
+        starts[i]["stopped_early"] = True
+    continued = pending[:num_keep]
+    if continued and max_iter > screen_iter:
+        results = _map_starts(
+            train_xs,
+            train_ys,
+            fitting_func,
+            grad_func,
+            [starts[i]["coefficients"] for i in continued],
+            bounds,
+            max_iter - screen_iter,
+            num_workers,
+        )
+        for i, result in zip(continued, results):
+            result["n_iter"] += starts[i]["n_iter"]
+            starts[i].update(result)
+
+    best = min(range(len(starts)), key=lambda i: starts[i]["loss"])
+    coeffs = starts[best]["coefficients"]
+    if disp:
+        num_converged = sum(start["converged"] for start in starts)
+        num_stopped = sum(start["stopped_early"] for start in starts)
+        print(
+            f"{len(starts)} starts ({num_converged} converged, {num_stopped} stopped early), "
+            f"best loss: {starts[best]['loss']:.3e}, coeffs: {coeffs}"
+        )
+
+    if return_cov:
+        cov = get_huber_covariance(train_xs, train_ys, fitting_func, grad_func, coeffs)
+        return coeffs, cov, starts
+    return coeffs, starts
+
+
+# Variable projection (VarPro) for chinchilla_n_d_fit: once the exponents (alpha, beta) are fixed,
+# L = A / N^alpha + B / D^beta + E is linear in (A, B, E), so only the exponents are optimized
+# nonlinearly and the linear terms are solved in closed form at every step.
+def _chinchilla_n_d_design(log_ns, log_ds, exponents):
+    return np.stack(
+        [np.exp(-exponents[0] * log_ns), np.exp(-exponents[1] * log_ds), np.ones_like(log_ns)],
+        axis=-1,
+    )
+
+
+def _get_linear_bounds(log_prefactor_bounds, constant_bounds):
+    # maps bounds on the log prefactors (a = log A) and on E to bounds on the linear terms (A, E)
+    lower = [np.exp(lo) if lo is not None else 0.0 for lo, _ in log_prefactor_bounds]
+    upper = [np.exp(hi) if hi is not None else np.inf for _, hi in log_prefactor_bounds]
+    e_lo, e_hi = constant_bounds
+    lower.append(e_lo if e_lo is not None else -np.inf)
+    upper.append(e_hi if e_hi is not None else np.inf)
+    return np.array(lower), np.array(upper)
+
+
+def _solve_linear_terms(weighted_design, lower, upper):
+    # (pred - y) / y approximates the log residuals used by the Huber fits, hence the 1 / y weights
+    target = np.ones(weighted_design.shape[0])
+    linear = np.linalg.lstsq(weighted_design, target, rcond=None)[0]
+    if np.any(linear < lower) or np.any(linear > upper):
+        linear = scipy.optimize.lsq_linear(
+            weighted_design, target, bounds=(lower, upper), method="bvls"
+        ).x
+    return linear
+
+
+def get_coefficients_varpro(
+    train_nds,
+    train_ys,
+    exponents0=(0.3, 0.3),
+    bounds=None,
+    disp: bool = True,
+    max_iter: int = 10000,
+    refine: bool = True,
+    return_cov: bool = False,
+):
+    """
+    Fits chinchilla_n_d_fit by variable projection. Returns coefficients in the same layout as the
+    Huber fits, [a, b, alpha, beta, E], and uses the same bounds layout (a and b are log-bounds).
+
+    The projected problem is a relative least-squares fit. With refine, the solution is polished by
+    get_coefficients_huber so the result optimizes the same objective as the Huber fits.
+    """
+    if bounds is None:
+        bounds = [(0, None), (0, None), (0, None), (0, None), (0, None)]
+    train_nds = np.asarray(train_nds, dtype=float)
+    train_ys = np.asarray(train_ys, dtype=float)
+    log_ns, log_ds = np.log(train_nds[:, 0]), np.log(train_nds[:, 1])
+
+    lower, upper = _get_linear_bounds([bounds[0], bounds[1]], bounds[4])
+
+    def project(exponents):
+        weighted_design = _chinchilla_n_d_design(log_ns, log_ds, exponents) / train_ys[:, None]
+        linear = _solve_linear_terms(weighted_design, lower, upper)
+        return linear, weighted_design @ linear - 1.0
+
+    def reduced_loss_fn(exponents):
+        _, residuals = project(exponents)
+        return residuals @ residuals
+
+    res = scipy.optimize.minimize(
+        reduced_loss_fn,
+        exponents0,
+        bounds=bounds[2:4],
+        method="L-BFGS-B",
+        options={"maxiter": max_iter},
+    )
+    (A, B, E), _ = project(res.x)
+    tiny = np.finfo(float).tiny
+    coeffs = np.array([np.log(max(A, tiny)), np.log(max(B, tiny)), res.x[0], res.x[1], E])
+    if disp:
+        print(f"varpro coeffs: {coeffs}")
+
+    if refine:
+        return get_coefficients_huber(
+            train_nds,
+            train_ys,
+            chinchilla_n_d_fit,
+            grad_chinchilla_n_d_fit,
+            p0=coeffs,
+            bounds=bounds,
+            disp=disp,
+            max_iter=max_iter,
+            return_cov=return_cov,
+            vectorized=True,
+        )
+    if return_cov:
+        cov = get_huber_covariance(
+            train_nds, train_ys, chinchilla_n_d_fit, grad_chinchilla_n_d_fit, coeffs
+        )
+        return coeffs, cov
+    return coeffs
+
+
+# Exponent grid search for chinchilla_n_d_fit / chinchilla_flops_fit: the linear terms of every
+# grid cell are solved in one batched least-squares call (cells that violate the bounds fall back to
+# BVLS), the best cells are then refined with the vectorized Huber fit. Gives the global optimum up
+# to grid resolution in predictable time; used by step1.py --grid_search.
+def _grid_search_linear_terms(log_xs, exponents, train_ys, lower, upper, chunk_size=4096):
+    # log_xs: (k, n_points), exponents: (n_cells, k) -> linear terms (n_cells, k + 1), losses
+    n_cells, n_points = exponents.shape[0], log_xs.shape[1]
+    linear = np.empty((n_cells, exponents.shape[1] + 1))
+    losses = np.empty(n_cells)
+    for start in range(0, n_cells, chunk_size):
+        cell_exponents = exponents[start : start + chunk_size]
+        power_terms = np.exp(-cell_exponents[:, :, None] * log_xs[None])
+        ones = np.ones((len(cell_exponents), 1, n_points))
+        # same 1 / y weighting as the variable-projection solver
+        design = np.concatenate([power_terms, ones], axis=1).transpose(0, 2, 1)
+        design = design / train_ys[None, :, None]
+        # batched normal equations on unit-norm columns; the small ridge keeps degenerate cells
+        # (e.g. a zero exponent, where a power term equals the constant term) solvable
+        scale = np.linalg.norm(design, axis=1)
+        normalized = design / scale[:, None, :]
+        gram = normalized.transpose(0, 2, 1) @ normalized + 1e-12 * np.eye(design.shape[2])
+        rhs = normalized.sum(axis=1)
+        cell_linear = np.linalg.solve(gram, rhs[..., None])[..., 0] / scale
+        # cells whose unconstrained solution violates the bounds are re-solved under them
+        infeasible = np.any((cell_linear < lower) | (cell_linear > upper), axis=1)
+        for i in np.flatnonzero(infeasible):
+            cell_linear[i] = _solve_linear_terms(design[i], lower, upper)
+        residuals = np.einsum("gnk,gk->gn", design, cell_linear) - 1.0
+        linear[start : start + chunk_size] = cell_linear
+        losses[start : start + chunk_size] = np.sum(residuals**2, axis=1)
+    return linear, losses
+
+
+def _refine_grid_cells(train_xs, train_ys, fitting_func, grad_func, p0s, bounds, max_iter, disp):
+    starts = [
+        _fit_huber_start(train_xs, train_ys, fitting_func, grad_func, p0, bounds, max_iter)
+        for p0 in p0s
+    ]
+    best = min(starts, key=lambda start: start["loss"])
+    if disp:
+        print(f"refined {len(starts)} grid cells, best loss: {best['loss']:.3e}")
+    return best["coefficients"]
+
+
+def grid_search_chinchilla_n_d_fit(
+    train_nds,
+    train_ys,
+    alphas,
+    betas,
+    bounds=None,
+    num_refine: int = 5,
+    disp: bool = True,
+    max_iter: int = 10000,
+    return_landscape: bool = False,
+):
+    """
+    Evaluates every (alpha, beta) in the alphas x betas grid, then refines the num_refine best
+    cells. Coefficients and bounds use the chinchilla_n_d_fit layout [a, b, alpha, beta, E].
+    The landscape is the weighted least-squares loss of each cell, shaped (len(alphas), len(betas)).
+    """
+    if bounds is None:
+        bounds = [(0, None), (0, None), (0, None), (0, None), (0, None)]
+    train_nds = np.asarray(train_nds, dtype=float)
+    train_ys = np.asarray(train_ys, dtype=float)
+    lower, upper = _get_linear_bounds([bounds[0], bounds[1]], bounds[4])
+
+    grid = np.stack(np.meshgrid(alphas, betas, indexing="ij"), axis=-1).reshape(-1, 2)
+    linear, losses = _grid_search_linear_terms(np.log(train_nds).T, grid, train_ys, lower, upper)
+
+    tiny = np.finfo(float).tiny
+    best_cells = np.argsort(losses)[:num_refine]
+    p0s = [
+        [np.log(max(linear[i, 0], tiny)), np.log(max(linear[i, 1], tiny)), *grid[i], linear[i, 2]]
+        for i in best_cells
+    ]
+    coeffs = _refine_grid_cells(
+        train_nds,
+        train_ys,
+        chinchilla_n_d_fit,
+        grad_chinchilla_n_d_fit,
+        p0s,
+        bounds,
+        max_iter,
+        disp,
+    )
+    if return_landscape:
+        return coeffs, losses.reshape(len(alphas), len(betas))
+    return coeffs
+
+
+def grid_search_chinchilla_flops_fit(
+    train_fs,
+    train_ys,
+    alphas,
+    bounds=None,
+    num_refine: int = 5,
+    disp: bool = True,
+    max_iter: int = 10000,
+    return_landscape: bool = False,
+):
+    """
+    Same as grid_search_chinchilla_n_d_fit for chinchilla_flops_fit, with layout [a, alpha, E].
+    """
+    if bounds is None:
+        bounds = [(0, None), (0, None), (0, None)]
+    train_fs = np.asarray(train_fs, dtype=float)
+    train_ys = np.asarray(train_ys, dtype=float)
+    lower, upper = _get_linear_bounds([bounds[0]], bounds[2])
+
+    grid = np.asarray(alphas, dtype=float).reshape(-1, 1)
+    linear, losses = _grid_search_linear_terms(np.log(train_fs)[None], grid, train_ys, lower, upper)
+
+    tiny = np.finfo(float).tiny
+    best_cells = np.argsort(losses)[:num_refine]
+    p0s = [[np.log(max(linear[i, 0], tiny)), grid[i, 0], linear[i, 1]] for i in best_cells]
+    coeffs = _refine_grid_cells(
+        train_fs,
+        train_ys,
+        chinchilla_flops_fit,
+        grad_chinchilla_flops_fit,
+        p0s,
+        bounds,
+        max_iter,
+        disp,
+    )
+    if return_landscape:
+        return coeffs, losses
+    return coeffs
@@ -1,37 +1,150 @@
-import csv
-import sys
-
-train_path = sys.argv[1]
-eval_path = sys.argv[2]
-
-train_row_by_step = {}
-with open(train_path, "r") as f:
-    reader = csv.DictReader(f)
-    for row in reader:
-        step = int(row["_step"])
-        train_row_by_step[step] = row
-
-rows = []
-with open(eval_path, "r") as f:
-    reader = csv.DictReader(f)
-    fieldnames = reader.fieldnames
-    for row in reader:
-        step = int(row["_step"])
-        if step in train_row_by_step:
-            train_row = train_row_by_step[step]
-            train_row = {
-                k: train_row[k]
-                for k in [
-                    "throughput/total_tokens",
-                    "throughput/total_training_Gflops",
-                    "optim/learning_rate_group0",
-                ]
-            }
-            row.update(train_row)
-            rows.append(row)
-
-with open(eval_path, "w") as f:
-    writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-    writer.writeheader()
-    for row in rows:
-        writer.writerow(row)
+"""
+Merges W&B logs downloaded in segments (e.g. the evals of a long run, downloaded as
+peteish7_medlr_eval_5k-205k.csv, _210k-325k.csv and _330k-490k.csv) into a single csv, and
+optionally joins the throughput columns of the run's train log onto it.
+
+Values are carried over as text, so rows that are not modified are written back unchanged.
+"""
+
+import argparse
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+TRAIN_COLUMNS = [
+    "throughput/total_tokens",
+    "throughput/total_training_Gflops",
+    "optim/learning_rate_group0",
+]
+
+
+def read_log(path: str, key: str = "_step") -> pd.DataFrame:
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    if key not in df.columns:
+        raise ValueError(f"{path} has no {key} column")
+    df[key] = pd.to_numeric(df[key]).astype(np.int64)
+    return df
+
+
+def merge_segments(paths: List[str], key: str = "_step", on_conflict: str = "last") -> pd.DataFrame:
+    """
+    Concatenates the segments and sorts them by key. A step logged in more than one segment
+    (or twice in one) keeps its last row ("last"), its first row ("first"), or raises a
+    ValueError ("error"). Columns missing from a segment are left empty in its rows.
+    """
+    df = pd.concat([read_log(path, key) for path in paths], ignore_index=True).fillna("")
+    duplicated = df[key].duplicated(keep=False)
+    if duplicated.any():
+        steps = df.loc[duplicated, key].unique()
+        if on_conflict == "error":
+            raise ValueError(f"{len(steps)} steps are logged more than once, e.g. {steps[:5]}")
+        print(f"{len(steps)} steps are logged more than once, keeping the {on_conflict} row")
+        df = df.drop_duplicates(subset=key, keep=on_conflict)
+    return df.sort_values(key, kind="stable").reset_index(drop=True)
+
+
+def join_train(
+    df: pd.DataFrame,
+    train_path: str,
+    key: str = "_step",
+    columns: Optional[List[str]] = None,
+    tolerance: int = 0,
+    drop_unmatched: bool = False,
+) -> pd.DataFrame:
+    """
+    Sets the train columns (TRAIN_COLUMNS by default) of each row of df (sorted by key, as
+    returned by merge_segments) to those of the train log row with the nearest step, if it is
+    at most `tolerance` steps away. Rows without a match are dropped with drop_unmatched;
+    otherwise they raise a ValueError, as empty train columns cannot be read back as numbers.
+    """
+    train = read_log(train_path, key)
+    columns = [column for column in columns or TRAIN_COLUMNS if column in train.columns]
+    train = train[[key] + columns].drop_duplicates(subset=key, keep="last").sort_values(key)
+    matched = pd.merge_asof(
+        df[[key]],
+        train.rename(columns={key: "_train_step"}),
+        left_on=key,
+        right_on="_train_step",
+        direction="nearest",
+        tolerance=tolerance,
+    )
+    unmatched = matched["_train_step"].isna().to_numpy()
+    if unmatched.any():
+        message = f"{unmatched.sum()} steps have no train log row within {tolerance} steps"
+        if not drop_unmatched:
+            steps = df.loc[unmatched, key].to_numpy()
+            raise ValueError(f"{message}, e.g. {steps[:5]} (increase the tolerance or drop them)")
+        print(f"{message}, dropping them")
+    df = df.copy()
+    for column in columns:
+        # existing columns keep their position, new ones are appended
+        df[column] = matched[column].fillna("").to_numpy()
+    if unmatched.any():
+        df = df[~unmatched].reset_index(drop=True)
+    return df
+
+
+def write_csv(df: pd.DataFrame, output_path: str):
+    dirname = os.path.dirname(output_path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    # same line endings as the csv module, which the downloader writes with
+    df.to_csv(tmp_path, index=False, lineterminator="\r\n")
+    os.replace(tmp_path, output_path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-e", "--eval-paths", nargs="+", required=True, help="Eval log segments, in order"
+    )
+    parser.add_argument("-t", "--train-path", default=None, help="Train log to join onto them")
+    parser.add_argument("-o", "--output-path", required=True, help="Output csv file")
+    parser.add_argument(
+        "--on-conflict",
+        default="last",
+        choices=["last", "first", "error"],
+        help="Which row to keep for a step logged in several segments",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=int,
+        default=0,
+        help="Max distance (in steps) to the train log row joined onto an eval row",
+    )
+    parser.add_argument(
+        "--train-columns", nargs="+", default=None, help="Columns to take from the train log"
+    )
+    parser.add_argument(
+        "--drop-unmatched",
+        action="store_true",
+        help="Drop eval rows without a train log row (instead of failing)",
+    )
+    args = parser.parse_args()
+    if args.output_path in args.eval_paths:
+        parser.error("the output path must not be one of the eval paths")
+    return args
+
+
+def main(args):
+    df = merge_segments(args.eval_paths, on_conflict=args.on_conflict)
+    if args.train_path:
+        df = join_train(
+            df,
+            args.train_path,
+            columns=args.train_columns,
+            tolerance=args.tolerance,
+            drop_unmatched=args.drop_unmatched,
+        )
+    write_csv(df, args.output_path)
+    print(f"Wrote {len(df)} rows to {args.output_path}")
+
+
+if __name__ == "__main__":
+    # python -m scaling.merge_wandb_logs -e src/scripts/paper/data/ladder-runs/peteish7_medlr_eval_5k-205k.csv src/scripts/paper/data/ladder-runs/peteish7_medlr_eval_210k-325k.csv src/scripts/paper/data/ladder-runs/peteish7_medlr_eval_330k-490k.csv -o src/scripts/paper/data/ladder-runs/peteish7_medlr_eval_full.csv
+    # python -m scaling.merge_wandb_logs -e wandb/peteish7_eval.csv -t wandb/peteish7_train.csv --tolerance 10 -o wandb/peteish7_eval_full.csv
+
+    main(parse_args())
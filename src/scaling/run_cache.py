@@ -0,0 +1,276 @@
+"""
+Columnar cache of the ladder-run CSVs. Each CSV is converted once into a column-major .npy
+matrix, and loaders memory-map it and read only the columns they need instead of re-parsing
+every row and column of the CSV. A cached run is invalidated when the CSV changes: a changed
+mtime or size triggers a content hash, and the run is re-ingested only if the hash differs.
+Loaders that only need a run's last rows (load_run_tail) read them from the end of the file
+when the cache is disabled.
+
+The cache location is read from ``OLMO_LADDER_DATA_CACHE`` (default
+``~/.cache/olmo-ladder/runs``); set it to an empty string to read the CSVs directly. If the
+cache cannot be written (e.g. a read-only directory), the CSVs are read directly as well.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import shutil
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "olmo-ladder", "runs")
+
+_config: Dict[str, Any] = {
+    "cache_dir": os.environ.get("OLMO_LADDER_DATA_CACHE", DEFAULT_CACHE_DIR),
+    # runs kept in memory once parsed (see _parsed_runs)
+    "max_parsed_runs": 256,
+}
+
+
+def set_data_cache(cache_dir: Optional[str] = DEFAULT_CACHE_DIR):
+    """
+    Points the columnar cache at cache_dir (None or "" disables it).
+    """
+    _config["cache_dir"] = cache_dir or ""
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _to_array(values):
+    # empty cells (e.g. evals missing at some steps) become NaN
+    try:
+        return np.array([float(value) if value != "" else np.nan for value in values])
+    except ValueError:
+        return np.array(values, dtype=str)
+
+
+def parse_csv(path: str, columns: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    Parses a run CSV into {column: array}, with float64 columns wherever the values are numeric.
+    Only the requested columns are converted (all columns if None).
+    """
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    return _to_columns(header, rows, columns)
+
+
+def _to_columns(header, rows, columns):
+    indices = {column: i for i, column in enumerate(header)}
+    if columns is not None:
+        indices = {column: indices[column] for column in columns if column in indices}
+    return {
+        column: _to_array([row[i] if i < len(row) else "" for row in rows])
+        for column, i in indices.items()
+    }
+
+
+def _ingest(path: str, run_dir: str, stat: os.stat_result, file_hash: str):
+    columns = parse_csv(path)
+    numeric = [column for column, values in columns.items() if values.dtype.kind == "f"]
+    strings = [column for column, values in columns.items() if values.dtype.kind != "f"]
+    num_rows = len(next(iter(columns.values()))) if columns else 0
+
+    tmp_dir = f"{run_dir}.{os.getpid()}-{threading.get_ident()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    # numeric columns go into one column-major matrix, so that a column is a contiguous block
+    # and a run is a single memory map
+    matrix = np.empty((num_rows, len(numeric)), order="F")
+    for j, column in enumerate(numeric):
+        matrix[:, j] = columns[column]
+    np.save(os.path.join(tmp_dir, "numeric.npy"), matrix)
+    for j, column in enumerate(strings):
+        np.save(os.path.join(tmp_dir, f"strings-{j}.npy"), columns[column])
+    meta = {
+        "path": os.path.realpath(path),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": file_hash,
+        "numeric": {column: j for j, column in enumerate(numeric)},
+        "strings": {column: j for j, column in enumerate(strings)},
+        "num_rows": num_rows,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    shutil.rmtree(run_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, run_dir)
+    except OSError:
+        # another process ingested the same run concurrently: its files are in run_dir now, so
+        # describe those rather than ours
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        with open(os.path.join(run_dir, "meta.json")) as f:
+            meta = json.load(f)
+    return meta
+
+
+def _get_meta(path: str, run_dir: str, stat: os.stat_result):
+    meta_path = os.path.join(run_dir, "meta.json")
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return _ingest(path, run_dir, stat, _file_hash(path))
+    if meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+        return meta
+    file_hash = _file_hash(path)
+    if file_hash != meta["sha256"]:
+        return _ingest(path, run_dir, stat, file_hash)
+    # touched but unchanged: keep the cached columns
+    meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+    tmp_path = f"{meta_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+    return meta
+
+
+def _parse_read_only(path: str) -> Dict[str, np.ndarray]:
+    run = parse_csv(path)
+    for values in run.values():
+        values.flags.writeable = False
+    return run
+
+
+def _load_run(path: str, stat: os.stat_result) -> Dict[str, np.ndarray]:
+    cache_dir = _config["cache_dir"]
+    if not cache_dir:
+        return _parse_read_only(path)
+    try:
+        return _load_cached_run(path, stat, cache_dir)
+    except OSError as e:
+        warnings.warn(f"cannot use the run cache in {cache_dir} ({e}); reading {path} directly")
+        return _parse_read_only(path)
+
+
+def _load_cached_run(path: str, stat: os.stat_result, cache_dir: str) -> Dict[str, np.ndarray]:
+    run_dir = os.path.join(cache_dir, hashlib.sha256(os.path.realpath(path).encode()).hexdigest())
+    meta = _get_meta(path, run_dir, stat)
+    # empty files cannot be memory-mapped
+    mmap_mode = "r" if meta["num_rows"] and meta["numeric"] else None
+    matrix = np.load(os.path.join(run_dir, "numeric.npy"), mmap_mode=mmap_mode)
+    run = {column: matrix[:, j] for column, j in meta["numeric"].items()}
+    for column, j in meta["strings"].items():
+        run[column] = np.load(os.path.join(run_dir, f"strings-{j}.npy"))
+    return run
+
+
+# Parsed runs are kept in memory for the lifetime of the process, so that each file is parsed
+# (or mapped) once however many tasks and metrics read it. Entries are keyed by path and
+# revalidated by mtime and size on every lookup; the least recently used are dropped first.
+# Loaders may run in threads (e.g. the stages of a pipeline), so the dict is only accessed
+# under the lock; two threads missing the same run both parse it, and the last one is kept.
+_parsed_runs: "OrderedDict[str, Tuple[Tuple, Any]]" = OrderedDict()
+_parsed_runs_lock = threading.Lock()
+
+
+def _lookup_parsed(path: str, stat: os.stat_result, loader: Callable):
+    key = os.path.realpath(path)
+    stamp = (stat.st_mtime_ns, stat.st_size, _config["cache_dir"], loader)
+    with _parsed_runs_lock:
+        if key in _parsed_runs and _parsed_runs[key][0] == stamp:
+            _parsed_runs.move_to_end(key)
+            return _parsed_runs[key][1]
+    return None
+
+
+def _get_parsed(path: str, loader: Callable):
+    stat = os.stat(path)
+    parsed = _lookup_parsed(path, stat, loader)
+    if parsed is not None:
+        return parsed
+    key = os.path.realpath(path)
+    stamp = (stat.st_mtime_ns, stat.st_size, _config["cache_dir"], loader)
+    parsed = loader(path, stat)
+    with _parsed_runs_lock:
+        _parsed_runs[key] = (stamp, parsed)
+        _parsed_runs.move_to_end(key)
+        while len(_parsed_runs) > _config["max_parsed_runs"]:
+            _parsed_runs.popitem(last=False)
+    return parsed
+
+
+def clear_parsed_runs():
+    with _parsed_runs_lock:
+        _parsed_runs.clear()
+
+
+def load_run_columns(path: str, columns: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    Returns {column: array} for the requested columns of a run CSV (all columns if None).
+    Columns missing from the CSV are left out of the result. The arrays are read-only and
+    shared between calls; with the columnar cache enabled, the numeric columns are views into
+    a memory map of the run.
+    """
+    run = _get_parsed(path, _load_run)
+    if columns is None:
+        return dict(run)
+    return {column: run[column] for column in columns if column in run}
+
+
+# bytes read per step when scanning a CSV backwards for its last rows
+_TAIL_BLOCK_BYTES = 1 << 16
+
+
+def _read_tail(path: str, num_rows: int, columns: Optional[Iterable[str]]):
+    with open(path, "rb") as f:
+        header_line = f.readline()
+        header_end = f.tell()
+        position = f.seek(0, os.SEEK_END)
+        chunk = b""
+        # one newline more than the rows we need, so that the first (partial) line can be dropped
+        while position > header_end and chunk.count(b"\n") <= num_rows:
+            step = min(_TAIL_BLOCK_BYTES, position - header_end)
+            position -= step
+            f.seek(position)
+            chunk = f.read(step) + chunk
+    if b'"' in chunk:
+        # quoted fields may span lines, so the records cannot be split on newlines
+        return {column: values[-num_rows:] for column, values in parse_csv(path, columns).items()}
+    lines = chunk.decode().split("\n")
+    if position > header_end:
+        lines = lines[1:]
+    lines = [line.rstrip("\r") for line in lines if line.rstrip("\r")][-num_rows:]
+    header = next(csv.reader([header_line.decode()]))
+    return _to_columns(header, list(csv.reader(lines)), columns)
+
+
+def load_run_tail(path: str, num_rows: int, columns: Optional[Iterable[str]] = None):
+    """
+    Returns {column: array} for the last num_rows rows of a run CSV, e.g. to read a run's final
+    checkpoints. With the columnar cache enabled, or once the run has been parsed in this
+    process, the cached columns are sliced; otherwise only the header and the end of the file
+    are read and decoded.
+    """
+    if num_rows < 1:
+        raise ValueError(f"num_rows must be positive, got {num_rows}")
+    if _config["cache_dir"] or _lookup_parsed(path, os.stat(path), _load_run) is not None:
+        run = load_run_columns(path, columns)
+        return {column: values[-num_rows:] for column, values in run.items()}
+    return _read_tail(path, num_rows, columns)
+
+
+def _load_json(path: str, stat: os.stat_result) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_run_json(path: str) -> Dict:
+    """
+    Returns the parsed metrics of a JSON run file (e.g. external models' evals). The dict is
+    shared between calls and must not be modified.
+    """
+    return _get_parsed(path, _load_json)
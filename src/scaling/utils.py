@@ -1,11 +1,10 @@
-import csv
 import json
-from collections import defaultdict
 from dataclasses import dataclass
 from typing import Dict, List, Optional
 
 import numpy as np
 
+from scaling.run_cache import load_run_columns, load_run_json, load_run_tail
 from scaling.task_utils import *
 
 
@@ -85,65 +84,260 @@ def moving_average(arr, n):
     return np.concatenate([ret[: n - 1] / np.arange(1, n), ret[n - 1 :] / n])
 
 
-def get_length(path):
-    try:
-        return path.split("/")[-1].split(".csv")[0].split("-")[1]
-    except IndexError:
-        return ""
+class LadderData:
+    """
+    The points of one ladder model (one config entry), as contiguous float64 columns: model
+    size "ns", tokens "ds", the metric(s) "xs" and "ys", and FLOPs "fs". The length labels
+    "ls" (e.g. "1xC") are stored as codes into a small table of labels. Columns that a loader
+    does not fill are left empty.
+
+    Indexing by column name (data["xs"], data["mode"]) matches the dicts this replaces. The
+    filtering methods return views that share the column buffers instead of copying them.
+    """
 
+    __slots__ = ("ns", "ds", "xs", "ys", "fs", "_length_codes", "_length_labels", "mode")
 
-def get_step1_data_by_name(configs, task_name, y_metric="rc_bpb", moving_avg=1):
-    task = tasks[task_name]
-    if y_metric == "rc_bpb":
+    COLUMNS = ("ns", "ds", "xs", "ys", "fs", "ls")
+
+    def __init__(self, ns=(), ds=(), xs=(), ys=(), fs=(), ls=(), mode="train"):
+        self.ns = np.asarray(ns, dtype=float)
+        self.ds = np.asarray(ds, dtype=float)
+        self.xs = np.asarray(xs, dtype=float)
+        self.ys = np.asarray(ys, dtype=float)
+        self.fs = np.asarray(fs, dtype=float)
+        self.ls = ls
+        self.mode = mode
+
+    @property
+    def ls(self):
+        return self._length_labels[self._length_codes]
+
+    @ls.setter
+    def ls(self, labels):
+        self._length_labels, self._length_codes = np.unique(
+            np.asarray(labels, dtype=str), return_inverse=True
+        )
+
+    @property
+    def is_train(self):
+        return self.mode == "train"
+
+    def __len__(self):
+        return max(len(self.ns), len(self.ds), len(self.xs), len(self.ys), len(self.fs))
+
+    def __getitem__(self, key):
+        if key not in self.COLUMNS and key != "mode":
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.COLUMNS and key != "mode":
+            raise KeyError(key)
+        if key in ("ls", "mode"):
+            setattr(self, key, value)
+        else:
+            setattr(self, key, np.asarray(value, dtype=float))
+
+    def __contains__(self, key):
+        return key in self.COLUMNS or key == "mode"
+
+    def keys(self):
+        return list(self.COLUMNS) + ["mode"]
+
+    def _apply(self, index):
+        # index every non-empty column the same way; slices give views, index arrays copies
+        data = LadderData.__new__(LadderData)
+        num_points = len(self)
+        for column in ("ns", "ds", "xs", "ys", "fs", "_length_codes"):
+            values = getattr(self, column)
+            setattr(data, column, values[index] if len(values) == num_points else values)
+        data._length_labels = self._length_labels
+        data.mode = self.mode
+        return data
+
+    def copy(self):
+        # a shallow copy: columns can be reassigned on the copy without affecting this one
+        return self._apply(slice(None))
+
+    def take(self, indices):
+        return self._apply(np.asarray(indices, dtype=int))
+
+    def select(self, mask):
+        return self._apply(np.asarray(mask, dtype=bool))
+
+    def skip_first(self, perc):
+        """
+        Drops the first perc of the points (rounded up); perc == 1 keeps only the last one.
+        """
+        if perc == 1:
+            return self._apply(slice(-1, None))
+        return self._apply(slice(int(np.ceil(perc * len(self))), None))
+
+    def last(self, num_points):
+        return self._apply(slice(-num_points, None)) if num_points > 0 else self
+
+    def smoothed(self, n, columns=("xs", "ys")):
+        data = self.copy()
+        for column in columns:
+            if len(getattr(self, column)):
+                setattr(data, column, moving_average(getattr(self, column), n=n))
+        return data
+
+    @classmethod
+    def concat(cls, parts, mode="train"):
+        if not parts:
+            return cls(mode=mode)
+        data = cls(
+            **{column: np.concatenate([part[column] for part in parts]) for column in cls.COLUMNS},
+            mode=mode,
+        )
+        return data
+
+    def __repr__(self):
+        return f"LadderData(mode={self.mode!r}, num_points={len(self)})"
+
+
+def split_train_eval(data_by_name):
+    """
+    Splits {name: LadderData} into the train and eval models, sharing the data.
+    """
+    train = {name: data for name, data in data_by_name.items() if data["mode"] == "train"}
+    eval_ = {name: data for name, data in data_by_name.items() if data["mode"] != "train"}
+    return train, eval_
+
+
+def get_train_columns(data_by_name, *columns):
+    """
+    Concatenates the given columns over the train models, e.g.
+    train_ns, train_ds, train_xs = get_train_columns(data_by_name, "ns", "ds", "xs").
+    """
+    train, _ = split_train_eval(data_by_name)
+    return tuple(
+        np.concatenate([np.asarray(data[column], dtype=float) for data in train.values()])
+        if train
+        else np.empty(0)
+        for column in columns
+    )
+
+
+def trim_eval_points(data_by_name):
+    """
+    A copy of data_by_name in which the eval models keep only their final checkpoint ("xs" and
+    "ys"), the points that predict_step2 and plot_step2 evaluate. The input is not modified.
+    """
+    trimmed = {}
+    for name, data in data_by_name.items():
+        if data["mode"] != "train":
+            data = data.copy()
+            data["xs"] = data["xs"][-1:]
+            data["ys"] = data["ys"][-1:]
+        trimmed[name] = data
+    return trimmed
+
+
+# columns from which the number of training tokens is derived
+TOKEN_KEYS = ["throughput/total_tokens", "_step", "batch_size_in_tokens"]
+
+
+@dataclass
+class MetricPlan:
+    """
+    How a metric is aggregated from the columns of a run: the weighted average of `keys`. The
+    weights are normalized, and negated for metrics that are flipped (e.g. rc_soft_log), so that
+    the aggregate over all rows of a run is a single matrix-vector product.
+    """
+
+    keys: List[str]
+    """
+    The columns that are averaged.
+    """
+
+    weights: np.ndarray
+    """
+    The signed, normalized weight of each key.
+    """
+
+    def aggregate(self, columns, source: str = "run") -> np.ndarray:
+        """
+        Returns the metric for every row of columns ({key: array}, or {key: scalar} for a
+        single row). Raises a ValueError naming source (e.g. the run's path) and the column if
+        a key has an empty (NaN) value.
+        """
+        matrix = np.column_stack([np.asarray(columns[key], dtype=float) for key in self.keys])
+        if np.isnan(matrix).any():
+            _check_not_empty(columns, self.keys, source)
+        return matrix @ self.weights
+
+
+def _check_not_empty(columns, keys, source):
+    # the run cache reads empty cells (e.g. metrics a download did not get) as NaN
+    for key in keys:
+        if np.isnan(np.asarray(columns[key], dtype=float)).any():
+            raise ValueError(f"{source}: column {key} has empty values in the rows used")
+
+
+def get_metric_plan(task, metric: str) -> MetricPlan:
+    if metric == "rc_bpb":
         keys = task.get_loss_keys()
-    elif y_metric == "rc_acc":
+    elif metric == "rc_acc":
         keys = task.get_accuracy_keys()
-    elif y_metric == "c4":
+    elif metric == "mc_acc":
+        keys = task.get_mc_accuracy_keys()
+    elif metric == "c4":
         keys = ["eval/c4_en-validation/CrossEntropyLoss"]
-    elif y_metric == "rc_soft_log":
-        keys = task.get_accuracy_keys()
+    elif metric == "rc_soft_log":
         keys = [
-            key.replace("/downstream/", "/downstream_soft_log/") if "_len_norm" in key else key
-            for key in keys
+            key.replace("/downstream/", "/downstream_soft_log/").replace("_len_norm", "_soft_log")
+            if "_len_norm" in key
+            else key
+            for key in task.get_accuracy_keys()
         ]
-        keys = [key.replace("_len_norm", "_soft_log") for key in keys]
     else:
+        raise ValueError(f"Invalid metric: {metric}")
+    weights = np.array([WEIGHT_BY_KEY.get(key, 1.0) for key in keys])
+    weights /= weights.sum()
+    if metric == "rc_soft_log":
+        weights *= -1
+    return MetricPlan(keys=keys, weights=weights)
+
+
+def get_tokens(columns, source: str = "run") -> np.ndarray:
+    """
+    The number of tokens seen at each row of a run.
+    """
+    if "throughput/total_tokens" in columns:
+        _check_not_empty(columns, ["throughput/total_tokens"], source)
+        return columns["throughput/total_tokens"].astype(np.int64)
+    _check_not_empty(columns, ["_step", "batch_size_in_tokens"], source)
+    return columns["_step"].astype(np.int64) * columns["batch_size_in_tokens"].astype(np.int64)
+
+
+def get_length(path):
+    try:
+        return path.split("/")[-1].split(".csv")[0].split("-")[1]
+    except IndexError:
+        return ""
+
+
+def get_step1_data_by_name(configs, task_name, y_metric="rc_bpb", moving_avg=1):
+    if y_metric not in ["rc_bpb", "rc_acc", "c4", "rc_soft_log"]:
         raise ValueError(f"Invalid y_metric: {y_metric}")
+    plan = get_metric_plan(tasks[task_name], y_metric)
 
-    data_by_name: Dict = defaultdict(lambda: {"ns": [], "ds": [], "xs": [], "ls": [], "fs": []})
+    data_by_name: Dict[str, LadderData] = {}
     for name, config in configs.items():
         n = config.n
+        points: Dict = {"ns": [], "ds": [], "xs": [], "ls": [], "fs": []}
         for path in config.paths:
-            length = get_length(path)
-            with open(path) as file_ref:
-                reader = csv.DictReader(file_ref)
-                rows = [row for row in reader]
-                rows = rows[-moving_avg:]
-                ds, xs, fs = [], [], []
-                for row in rows:
-                    if "throughput/total_tokens" in row:
-                        d = int(float(row["throughput/total_tokens"]))
-                    else:
-                        d = int(float(row["_step"])) * int(float(row["batch_size_in_tokens"]))
-                    f = float(d * MODEL_FLOPS[name.split("-")[0]])
-                    x = np.average(
-                        [float(row[key]) for key in keys],
-                        weights=[WEIGHT_BY_KEY.get(key, 1.0) for key in keys],
-                    )
-                    if y_metric == "rc_soft_log":
-                        x *= -1
-                    ds.append(d)
-                    xs.append(x)
-                    fs.append(f)
-                d = ds[-1]
-                x = np.mean(xs)
-                f = fs[-1]
-                data_by_name[name]["ns"].append(n)
-                data_by_name[name]["ds"].append(d)
-                data_by_name[name]["xs"].append(x)
-                data_by_name[name]["ls"].append(length)
-                data_by_name[name]["fs"].append(f)
-        data_by_name[name]["mode"] = config.mode
+            # the final checkpoint, with its loss averaged over the last moving_avg rows
+            tail = load_run_tail(path, moving_avg, plan.keys + TOKEN_KEYS)
+            d = int(get_tokens(tail, path)[-1])
+            points["ns"].append(n)
+            points["ds"].append(d)
+            points["xs"].append(np.mean(plan.aggregate(tail, path)))
+            points["ls"].append(get_length(path))
+            points["fs"].append(float(d * MODEL_FLOPS[name.split("-")[0]]))
+        data_by_name[name] = LadderData(**points, mode=config.mode)
     return data_by_name
 
 
@@ -156,120 +350,51 @@ def get_step2_data_by_name(
     skip_perc=0.0,
     last_n_points=-1,
 ):
-    task = tasks[task_name]
-    if x_metric == "rc_bpb":
-        loss_keys = task.get_loss_keys()
-    elif x_metric == "rc_soft_log":
-        loss_keys = task.get_accuracy_keys()
-        loss_keys = [
-            key.replace("/downstream/", "/downstream_soft_log/") if "_len_norm" in key else key
-            for key in loss_keys
-        ]
-        loss_keys = [key.replace("_len_norm", "_soft_log") for key in loss_keys]
-    elif x_metric == "c4":
-        loss_keys = ["eval/c4_en-validation/CrossEntropyLoss"]
-    else:
+    if x_metric not in ["rc_bpb", "rc_soft_log", "c4"]:
         raise ValueError(f"Invalid x_metric: {x_metric}")
-    if y_metric == "rc_acc":
-        accuracy_keys = task.get_accuracy_keys()
-    elif y_metric == "mc_acc":
-        accuracy_keys = task.get_mc_accuracy_keys()
-    else:
+    if y_metric not in ["rc_acc", "mc_acc"]:
         raise ValueError(f"Invalid y_metric: {y_metric}")
+    loss_plan = get_metric_plan(tasks[task_name], x_metric)
+    accuracy_plan = get_metric_plan(tasks[task_name], y_metric)
 
-    data_by_name: Dict = defaultdict(lambda: {"xs": [], "ys": [], "ds": [], "ns": [], "ls": []})
+    data_by_name: Dict[str, LadderData] = {}
 
     for name, config in configs.items():
         if name == "external":
             xs, ys = [], []
             for path in config.paths:
-                with open(path) as f:
-                    data = json.load(f)
-                    x = np.average(
-                        [float(data[key]) for key in loss_keys],
-                        weights=[WEIGHT_BY_KEY.get(key, 1.0) for key in loss_keys],
-                    )
-                    y = np.average(
-                        [float(data[key]) for key in accuracy_keys],
-                        weights=[WEIGHT_BY_KEY.get(key, 1.0) for key in accuracy_keys],
-                    )
-                    xs.append(x)
-                    ys.append(y)
-            data_by_name[name] = {"xs": xs, "ys": ys, "ds": [], "ns": [], "ls": []}
+                data = load_run_json(path)
+                xs.append(loss_plan.aggregate(data, path)[0])
+                ys.append(accuracy_plan.aggregate(data, path)[0])
+            data_by_name[name] = LadderData(xs=xs, ys=ys, mode=config.mode)
 
         else:
             n = config.n
+            parts = []
             for path in config.paths:
-                length = get_length(path)
-                with open(path) as file_ref:
-                    reader = csv.DictReader(file_ref)
-                    rows = [row for row in reader]
-                    xs, ys, ds, ns, ls = [], [], [], [], []
-                    for row in rows:
-                        if "throughput/total_tokens" in row:
-                            d = int(float(row["throughput/total_tokens"]))
-                        else:
-                            d = int(float(row["_step"])) * int(float(row["batch_size_in_tokens"]))
-                        x = np.average(
-                            [float(row[key]) for key in loss_keys],
-                            weights=[WEIGHT_BY_KEY.get(key, 1.0) for key in loss_keys],
-                        )
-                        if x_metric == "rc_soft_log":
-                            x *= -1
-
-                        y = np.average(
-                            [float(row[key]) for key in accuracy_keys],
-                            weights=[WEIGHT_BY_KEY.get(key, 1.0) for key in accuracy_keys],
-                        )
-                        if y_metric == "rc_soft_log":
-                            y *= -1
-
-                        xs.append(x)
-                        ys.append(y)
-                        ds.append(d)
-                        ns.append(n)
-                        ls.append(length)
-
-                    if config.mode == "train":
-                        # skip initial ckpts
-
-                        if skip_perc == 1:
-                            xs = [xs[-1]]
-                            ys = [ys[-1]]
-                            ds = [ds[-1]]
-                            ns = [ns[-1]]
-                            ls = [ls[-1]]
-                        else:
-                            xs = xs[int(np.ceil(skip_perc * len(xs))) :]
-                            ys = ys[int(np.ceil(skip_perc * len(ys))) :]
-                            ds = ds[int(np.ceil(skip_perc * len(ds))) :]
-                            ns = ns[int(np.ceil(skip_perc * len(ns))) :]
-                            ls = ls[int(np.ceil(skip_perc * len(ls))) :]
-
-                    # apply moving_avg
-                    xs = moving_average(xs, n=moving_avg).tolist()
-                    ys = moving_average(ys, n=moving_avg).tolist()
-                    # ys = ys[moving_avg-1:]
-                    # ds = ds[moving_avg-1:]
-                    # ns = ns[moving_avg-1:]
-                    # ls = ls[moving_avg-1:]
-
-                    if config.mode == "train":
-                        # last n points
-                        if last_n_points > 0:
-                            xs = xs[-last_n_points:]  # type: ignore
-                            ys = ys[-last_n_points:]  # type: ignore
-                            ds = ds[-last_n_points:]
-                            ns = ns[-last_n_points:]
-                            ls = ls[-last_n_points:]
-
-                    data_by_name[name]["xs"] += xs
-                    data_by_name[name]["ys"] += ys
-                    data_by_name[name]["ds"] += ds
-                    data_by_name[name]["ns"] += ns
-                    data_by_name[name]["ls"] += ls
-
-        data_by_name[name]["mode"] = config.mode
+                columns = load_run_columns(path, loss_plan.keys + accuracy_plan.keys + TOKEN_KEYS)
+                ds = get_tokens(columns, path)
+                run = LadderData(
+                    ns=np.full(len(ds), n),
+                    ds=ds,
+                    xs=loss_plan.aggregate(columns, path),
+                    ys=accuracy_plan.aggregate(columns, path),
+                    ls=[get_length(path)] * len(ds),
+                    mode=config.mode,
+                )
+                if config.mode == "train":
+                    # skip initial ckpts
+                    run = run.skip_first(skip_perc)
+
+                # apply moving_avg
+                run = run.smoothed(moving_avg)
+
+                if config.mode == "train":
+                    # last n points
+                    run = run.last(last_n_points)
+
+                parts.append(run)
+            data_by_name[name] = LadderData.concat(parts, mode=config.mode)
 
     return data_by_name
 
@@ -0,0 +1,151 @@
+# python src/scripts/benchmark_solvers.py -k v2_main -c src/scripts/paper/configs/final.json --moving_avg 5
+# python src/scripts/benchmark_solvers.py -k v2_main -c src/scripts/paper/configs/final.json --moving_avg 5 -y c4 --repeats 5
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from scaling.fit_cache import set_fit_cache
+from scaling.fitting_functions import (
+    chinchilla_n_d_fit,
+    chinchilla_n_d_fit_e,
+    evaluate_fit,
+    get_coefficients,
+    get_coefficients_huber,
+    get_coefficients_least_squares,
+    grad_chinchilla_n_d_fit,
+)
+from scaling.utils import (
+    get_final_configs,
+    get_step1_data_by_name,
+    get_task_sets,
+    get_train_columns,
+)
+
+P0 = [3.0, 6.0, 0.1, 0.2, 1.0]
+BOUNDS = [(0, None), (0, None), (0, None), (0, None), (0, None)]
+DELTA = 1e-3
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", "--keys", nargs="+", default=[], help="Key(s) for tasks")
+    parser.add_argument(
+        "-y",
+        "--y_metric",
+        default="rc_bpb",
+        choices=["rc_bpb", "c4", "rc_soft_log"],
+        help="Metric to fit",
+    )
+    parser.add_argument("--moving_avg", type=int, default=1, help="Moving average for bpb loss")
+    parser.add_argument("-c", "--config-path", type=str, required=True, help="Path to config file")
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="Timed runs per backend (best is kept)"
+    )
+    args = parser.parse_args()
+
+    if not args.keys:
+        args.keys = ["main"]
+    args.keys = get_task_sets(args.keys)
+
+    return args
+
+
+def huber_objective(train_nds, train_ys, coefficients):
+    us = np.log(evaluate_fit(chinchilla_n_d_fit, train_nds, coefficients)) - np.log(train_ys)
+    abs_us = np.abs(us)
+    return float(np.sum(np.where(abs_us < DELTA, 0.5 * us**2, DELTA * (abs_us - 0.5 * DELTA))))
+
+
+def fit_curve_fit(train_nds, train_ys):
+    # plain least squares on the raw values, as used by get_coefficients for step 2
+    return get_coefficients(
+        train_nds,
+        train_ys,
+        chinchilla_n_d_fit_e,
+        p0=P0,
+        bounds=([lo for lo, _ in BOUNDS], [np.inf for _ in BOUNDS]),
+        disp=False,
+    )
+
+
+def fit_lbfgs(train_nds, train_ys):
+    return get_coefficients_huber(
+        train_nds,
+        train_ys,
+        chinchilla_n_d_fit,
+        grad_chinchilla_n_d_fit,
+        p0=P0,
+        bounds=BOUNDS,
+        max_iter=1000000,
+        disp=False,
+        vectorized=True,
+    )
+
+
+def fit_trf(train_nds, train_ys):
+    return get_coefficients_least_squares(
+        train_nds,
+        train_ys,
+        chinchilla_n_d_fit,
+        grad_chinchilla_n_d_fit,
+        p0=P0,
+        bounds=BOUNDS,
+        f_scale=DELTA,
+        disp=False,
+    )
+
+
+BACKENDS = {"curve_fit": fit_curve_fit, "lbfgs": fit_lbfgs, "trf": fit_trf}
+
+
+def main():
+    args = parse_args()
+    configs = get_final_configs(args.config_path)
+    # time the solvers, not the on-disk fit cache
+    set_fit_cache(None)
+
+    data = []
+    for task_name in args.keys:
+        data_by_name = get_step1_data_by_name(
+            configs, task_name, y_metric=args.y_metric, moving_avg=args.moving_avg
+        )
+        train_ns, train_ds, train_ys = get_train_columns(data_by_name, "ns", "ds", "xs")
+        train_nds = np.stack([train_ns, train_ds], axis=1)
+        data.append((task_name, train_nds, train_ys))
+
+    objectives, times = {}, {}
+    for backend, fit in BACKENDS.items():
+        times[backend] = np.inf
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            coefficients = [fit(train_nds, train_ys) for _, train_nds, train_ys in data]
+            times[backend] = min(times[backend], time.perf_counter() - start)
+        objectives[backend] = [
+            huber_objective(train_nds, train_ys, c)
+            for c, (_, train_nds, train_ys) in zip(coefficients, data)
+        ]
+
+    # a backend has converged on a task if it reaches the best Huber objective of all backends
+    best = np.min([objectives[backend] for backend in BACKENDS], axis=0)
+    rows = []
+    for backend in BACKENDS:
+        task_objectives = np.array(objectives[backend])
+        rows.append(
+            {
+                "Backend": backend,
+                "Total Time (s)": times[backend],
+                "Time per Fit (ms)": 1000 * times[backend] / len(data),
+                "Huber Objective": task_objectives.sum(),
+                "Converged": f"{np.sum(task_objectives <= best * (1 + 1e-6))}/{len(data)}",
+            }
+        )
+    df = pd.DataFrame(rows)
+    print(df.to_string(index=False, float_format=lambda x: f"{x:.4g}"))
+    return df
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# python src/scripts/bootstrap.py -k v2_main -c src/scripts/paper/configs/final.json -n 6887575552 -d 3945065873408 -t 7B-4T --skip_perc 0.1 --moving_avg 5 --num_replicates 1000
+# python src/scripts/bootstrap.py -k v2_main -c src/scripts/paper/configs/final.json -n 13202396160 -d 5000088518656 -t 13B-5T --skip_perc 0.1 --moving_avg 5 --num_replicates 1000 --resample rungs -o src/scripts/paper/figures/bootstrap_13B.csv
+
+import argparse
+import os
+from collections import Counter
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from chained_fits import (
+    WORKER_STATE,
+    add_chained_args,
+    fit_chained,
+    load_data_by_task,
+    map_jobs,
+    predict_chained,
+)
+
+from scaling.utils import get_task_sets
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    add_chained_args(parser)
+    parser.add_argument(
+        "-o", "--output-path", type=str, default=None, help="Path to write the intervals (csv)"
+    )
+    parser.add_argument("-n", "--n", type=int, required=True, help="Model size of the target model")
+    parser.add_argument("-d", "--d", type=int, required=True, help="Data size of the target model")
+    parser.add_argument(
+        "-t", "--target-name", type=str, default=None, help="Name of the target model in the config"
+    )
+    parser.add_argument(
+        "--num_replicates", type=int, default=1000, help="Number of bootstrap replicates"
+    )
+    parser.add_argument(
+        "--resample",
+        default="checkpoints",
+        choices=["checkpoints", "rungs"],
+        help="Resample individual ladder checkpoints, or whole rungs (N, xC runs)",
+    )
+    parser.add_argument(
+        "--confidence", type=float, default=0.95, help="Confidence level of the intervals"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    args.keys = get_task_sets(args.keys)
+
+    return args
+
+
+def resample_data_by_name(step1_data_by_name, step2_data_by_name, resample, rng):
+    """
+    Draws one bootstrap replicate of the train entries; eval entries are kept as they are.
+    With resample="rungs", whole runs (name, length) are drawn with replacement and the same
+    draw is applied to both steps.
+    """
+    step1_resampled: Dict[str, Dict] = {}
+    step2_resampled: Dict[str, Dict] = {}
+    if resample == "rungs":
+        rungs = [
+            (name, length)
+            for name, data in step1_data_by_name.items()
+            if data["mode"] == "train"
+            for length in data["ls"]
+        ]
+        counts = Counter(rungs[i] for i in rng.integers(0, len(rungs), len(rungs)))
+
+    for resampled, data_by_name in [
+        (step1_resampled, step1_data_by_name),
+        (step2_resampled, step2_data_by_name),
+    ]:
+        for name, data in data_by_name.items():
+            if data["mode"] != "train":
+                resampled[name] = data.copy()
+                continue
+            if resample == "rungs":
+                indices = [
+                    i for i, length in enumerate(data["ls"]) for _ in range(counts[(name, length)])
+                ]
+            else:
+                indices = rng.integers(0, len(data["xs"]), len(data["xs"])).tolist()
+            if indices:
+                resampled[name] = data.take(indices)
+
+    return step1_resampled, step2_resampled
+
+
+def _run_replicate(task_name, seed):
+    args = WORKER_STATE["args"]
+    step1_data_by_name, step2_data_by_name = WORKER_STATE["data"][task_name]
+    rng = np.random.default_rng(seed)
+    step1_resampled, step2_resampled = resample_data_by_name(
+        step1_data_by_name, step2_data_by_name, args.resample, rng
+    )
+    try:
+        coefficients = fit_chained(
+            step1_resampled,
+            step2_resampled,
+            task_name,
+            args,
+            p0s=WORKER_STATE["coefficients"][task_name],
+        )
+        prediction = predict_chained(coefficients, args.n, args.d, args.use_log_sigmoid)
+    except (RuntimeError, ValueError):
+        # the fit did not converge on this replicate
+        prediction = (np.nan, np.nan)
+    return prediction
+
+
+def run_bootstrap(args, data_by_task):
+    """
+    Fits every task on the full data, then refits num_replicates bootstrap replicates per task
+    across a process pool, warm-started from the full-data coefficients.
+    Returns {task_name: {"full": (loss, acc), "replicates": (num_replicates, 2) array}}.
+    """
+    coefficients_by_task, full_by_task = {}, {}
+    for task_name, (step1_data_by_name, step2_data_by_name) in data_by_task.items():
+        coefficients_by_task[task_name] = fit_chained(
+            step1_data_by_name, step2_data_by_name, task_name, args
+        )
+        full_by_task[task_name] = predict_chained(
+            coefficients_by_task[task_name], args.n, args.d, args.use_log_sigmoid
+        )
+
+    seeds = np.random.SeedSequence(args.seed).generate_state(args.num_replicates)
+    jobs = [(task_name, int(seed)) for task_name in data_by_task for seed in seeds]
+    predictions = map_jobs(
+        _run_replicate, jobs, args, data_by_task, coefficients_by_task, workers=args.workers
+    )
+
+    results = {}
+    for i, task_name in enumerate(data_by_task):
+        replicates = predictions[i * args.num_replicates : (i + 1) * args.num_replicates]
+        results[task_name] = {"full": full_by_task[task_name], "replicates": np.array(replicates)}
+    return results
+
+
+def get_intervals(results, confidence=0.95):
+    lower_q, upper_q = 50 * (1 - confidence), 50 * (1 + confidence)
+    rows = []
+    for task_name, result in results.items():
+        replicates = result["replicates"]
+        valid = ~np.isnan(replicates).any(axis=1)
+        loss_lower, loss_upper = np.percentile(replicates[valid, 0], [lower_q, upper_q])
+        acc_lower, acc_upper = np.percentile(replicates[valid, 1], [lower_q, upper_q])
+        rows.append(
+            {
+                "Task": task_name,
+                "Pred Loss": result["full"][0],
+                "Loss Lower": loss_lower,
+                "Loss Upper": loss_upper,
+                "Pred Acc": result["full"][1],
+                "Acc Lower": acc_lower,
+                "Acc Upper": acc_upper,
+                "Valid Replicates": int(valid.sum()),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def main():
+    args = parse_args()
+    data_by_task = load_data_by_task(args)
+
+    results = run_bootstrap(args, data_by_task)
+    df = get_intervals(results, args.confidence)
+
+    if args.target_name:
+        df["Actual Acc"] = [
+            data_by_task[task_name][1][args.target_name]["ys"][-1] for task_name in df["Task"]
+        ]
+
+    print(f"{args.confidence * 100:.0f}% bootstrap intervals ({args.num_replicates} replicates):")
+    print(df.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+
+    if args.output_path:
+        os.makedirs(os.path.dirname(args.output_path), exist_ok=True)
+        df.to_csv(args.output_path, index=False)
+
+    return df
+
+
+if __name__ == "__main__":
+    main()
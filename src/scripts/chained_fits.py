@@ -0,0 +1,152 @@
+"""
+Shared by the scripts that refit the chained (step 1 + step 2) prediction many times, e.g.
+bootstrap.py and cross_validation.py: their common arguments and data loading, the chained
+fit and prediction, and a process pool whose workers hold the loaded data.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from step1 import fit_step1
+from step2 import fit_step2
+from step2_mc import fit_step2 as fit_step2_mc
+
+from scaling.fitting_functions import predict_chained_fit
+from scaling.utils import (
+    get_final_configs,
+    get_step1_data_by_name,
+    get_step2_data_by_name,
+)
+
+
+def add_chained_args(parser):
+    """
+    Adds the arguments that select the tasks, the metrics and the data of the chained fit.
+    """
+    parser.add_argument("-k", "--keys", nargs="+", default=[], help="Key(s) for tasks")
+    parser.add_argument(
+        "-x",
+        "--x_metric",
+        default="rc_bpb",
+        choices=["rc_bpb", "c4", "rc_soft_log"],
+        help="Metric as input",
+    )
+    parser.add_argument(
+        "-y", "--y_metric", default="rc_acc", choices=["rc_acc", "mc_acc"], help="Metric to predict"
+    )
+    parser.add_argument("--moving_avg", type=int, default=1, help="Moving average for bpb loss")
+    parser.add_argument(
+        "--skip_perc",
+        type=float,
+        default=0.0,
+        help="Percentage of intermediate ckpts to skip from the beginning (for loss to accuracy fitting)",
+    )
+    parser.add_argument("-c", "--config-path", type=str, required=True, help="Path to config file")
+    parser.add_argument(
+        "--step2-config-path", type=str, default=None, help="Path to config file for step2"
+    )
+    parser.add_argument(
+        "--use_log_sigmoid", action="store_true", help="Use log sigmoid for fitting"
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+
+
+def load_data_by_task(args):
+    """
+    Returns {task_name: (step1_data_by_name, step2_data_by_name)} for args.keys.
+    """
+    configs = get_final_configs(args.config_path)
+    if args.step2_config_path:
+        step2_configs = get_final_configs(args.step2_config_path)
+    else:
+        step2_configs = configs
+
+    data_by_task = {}
+    for task_name in args.keys:
+        step1_data_by_name = get_step1_data_by_name(
+            configs, task_name, y_metric=args.x_metric, moving_avg=args.moving_avg
+        )
+        step2_data_by_name = get_step2_data_by_name(
+            step2_configs,
+            task_name,
+            x_metric=args.x_metric,
+            y_metric=args.y_metric,
+            moving_avg=args.moving_avg,
+            skip_perc=args.skip_perc,
+        )
+        data_by_task[task_name] = (step1_data_by_name, step2_data_by_name)
+    return data_by_task
+
+
+def fit_chained(step1_data_by_name, step2_data_by_name, task_name, args, p0s=(None, None)):
+    step1_coefficients, _ = fit_step1(step1_data_by_name, y_metric=args.x_metric, p0=p0s[0])
+    if args.y_metric == "rc_acc":
+        step2_coefficients, _ = fit_step2(
+            step2_data_by_name,
+            task_name,
+            args.y_metric,
+            use_log_sigmoid=args.use_log_sigmoid,
+            p0=p0s[1],
+        )
+    elif args.y_metric == "mc_acc":
+        step2_coefficients, _ = fit_step2_mc(
+            step2_data_by_name,
+            task_name,
+            args.y_metric,
+            use_log_sigmoid=args.use_log_sigmoid,
+            p0=p0s[1],
+        )
+    else:
+        raise ValueError(f"Invalid y_metric: {args.y_metric}")
+
+    return step1_coefficients, step2_coefficients
+
+
+def predict_chained(coefficients, n, d, use_log_sigmoid=False):
+    """
+    The (loss, accuracy) predicted for a model of n parameters trained on d tokens. n and d
+    may be arrays (e.g. an (N, D) grid) and the coefficients batches, as in
+    predict_chained_fit; a single prediction is returned as floats.
+    """
+    step1_coefficients, step2_coefficients = coefficients
+    pred_loss, pred_acc = predict_chained_fit(
+        [n, d], step1_coefficients, step2_coefficients, use_log_sigmoid=use_log_sigmoid
+    )
+    if np.ndim(pred_loss) == 0 and np.ndim(pred_acc) == 0:
+        return float(pred_loss), float(pred_acc)
+    return pred_loss, pred_acc
+
+
+# Worker state: the loaded data and full-data fits are shipped once per process, not per job
+WORKER_STATE: Dict[str, Any] = {}
+
+
+def _init_worker(args, data_by_task, coefficients_by_task):
+    WORKER_STATE.update(args=args, data=data_by_task, coefficients=coefficients_by_task)
+
+
+def map_jobs(
+    func: Callable,
+    jobs: Sequence[Tuple],
+    args,
+    data_by_task: Dict,
+    coefficients_by_task: Dict,
+    workers=None,
+) -> List:
+    """
+    Returns [func(*job) for job in jobs], spread over a process pool (all cores if workers is
+    None). func reads args ("args"), data_by_task ("data") and coefficients_by_task
+    ("coefficients") from WORKER_STATE, which is filled once per worker process.
+    """
+    initargs = (args, data_by_task, coefficients_by_task)
+    num_workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    if num_workers == 1:
+        _init_worker(*initargs)
+        return [func(*job) for job in jobs]
+    with ProcessPoolExecutor(
+        max_workers=num_workers, initializer=_init_worker, initargs=initargs
+    ) as executor:
+        chunksize = max(1, len(jobs) // (4 * num_workers))
+        return list(executor.map(func, *zip(*jobs), chunksize=chunksize))
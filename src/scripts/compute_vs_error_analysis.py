@@ -6,15 +6,21 @@
 # python src/scripts/compute_vs_error_analysis.py --moving_avg 5 --skip_perc 0.1 -o src/scripts/paper/figures/step2_compute_error.pdf --vary flops --which_step step2 --do_average
 # python src/scripts/compute_vs_error_analysis.py --moving_avg 5 --skip_perc 0.1 -o src/scripts/paper/figures/stacked_compute_error.pdf --vary flops --which_step stacked --do_average
 import argparse
+import hashlib
+import json
+import os
+from typing import List, Tuple, Union
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
+from pipeline import map_tasks
 from step1 import fit_step1, predict_step1
 from step2 import fit_step2, predict_step2
 
-from scaling.fitting_functions import chinchilla_n_d_fit, sigmoid
+from scaling.fit_cache import get_solver_version, load_json_result, save_json_result
+from scaling.fitting_functions import predict_chained_fit
 from scaling.utils import (
     MODEL_FLOPS,
     MODEL_PARAMS,
@@ -22,6 +28,7 @@ from scaling.utils import (
     get_step1_data_by_name,
     get_step2_data_by_name,
     tasks,
+    trim_eval_points,
 )
 
 MODELS = ["190M", "370M", "760M", "1.3B"]
@@ -43,6 +50,7 @@ TARGET_CONFIG = {
     "paths": ["src/scripts/paper/data/ladder-runs/peteish7_eval_anneal.csv"],
     "mode": "eval",
     "n": 6887575552,
+    "flops": MODEL_FLOPS["7B"],
     "label": "7B-4T",
     "color": "darkviolet",
 }
@@ -72,10 +80,9 @@ def predict_stacked(configs, data_by_name, step1_coefficients, step2_coefficient
         config = configs[name]
         predicted_data_by_name[name] = {
             "ds": data["ds"],
-            "xs": [
-                sigmoid(chinchilla_n_d_fit([n, d], step1_coefficients), *step2_coefficients)
-                for n, d in zip(data["ns"], data["ds"])
-            ],
+            "xs": predict_chained_fit(
+                [data["ns"], data["ds"]], step1_coefficients, step2_coefficients
+            )[1],
         }
 
         if config.mode == "eval":
@@ -88,12 +95,10 @@ def predict_stacked(configs, data_by_name, step1_coefficients, step2_coefficient
                 unsigned_rel_errors.append(np.abs(rel_error_t))
 
         ds = np.exp(np.linspace(np.log(dmin), np.log(dmax), 100))
-        ns = [data["ns"][0]] * len(ds)
         plotted_predicted_data_by_name[name] = {
             "ds": ds,
-            "ys": [
-                sigmoid(chinchilla_n_d_fit([n, d], step1_coefficients), *step2_coefficients)
-                for n, d in zip(ns, ds)
+            "ys": predict_chained_fit([data["ns"][0], ds], step1_coefficients, step2_coefficients)[
+                1
             ],
         }
 
@@ -105,77 +110,229 @@ def predict_stacked(configs, data_by_name, step1_coefficients, step2_coefficient
     )
 
 
-def run_all_steps(configs, moving_avg=1, skip_perc=0.0, which_error="pred_error"):
-    step1_fitting_error = 0.0
-    step2_fitting_error = 0.0
-    stacked_fitting_error = 0.0
-
-    # step1_pred_error = 0.0
-    # step2_pred_error = 0.0
-    # stacked_pred_error = 0.0
-
-    output = {}
-
-    for task_name in TASKS:
-        step1_data_by_name = get_step1_data_by_name(
-            configs, task_name, y_metric="rc_bpb", moving_avg=moving_avg
+def get_sweep_configs():
+    """
+    Every ladder model with all of its runs, and the target. Each prefix of a sweep selects
+    its runs from these, so that the data of a task is loaded once for the whole sweep. The
+    target comes last, as the predict functions return the errors of the last eval entry.
+    """
+    configs = {}
+    for N in MODELS:
+        configs[N] = FinalConfig(
+            paths=[
+                f"src/scripts/paper/data/ladder-runs/{path_name(N, mult)}.csv"
+                for mult in CHINCHILLA_MULTIPLIERS
+            ],
+            mode="train",
+            n=MODEL_PARAMS[N],
+            flops=MODEL_FLOPS[N],
+            label=N,
+            color=COLOR_MAP[N],
         )
+    configs[TARGET_CONFIG["label"]] = FinalConfig(**TARGET_CONFIG)  # type: ignore
+    return configs
+
+
+def get_prefixes(vary) -> List[Tuple[Union[str, int, float], List[Tuple[str, str]]]]:
+    """
+    Returns [(key, rungs)]: the x-axis value and the ladder runs (N, length) fit by each prefix
+    of the sweep. Each prefix extends the previous one by one model size (N), one multiplier
+    (xC) or one run, in order of FLOPs (flops) or of model size and multiplier (flops_step).
+    """
+    steps: List[Tuple[Union[str, int, float], List[Tuple[str, int]]]]
+    if vary == "N":
+        steps = [(N, [(N, mult) for mult in CHINCHILLA_MULTIPLIERS]) for N in MODELS]
+    elif vary == "xC":
+        steps = [(mult, [(N, mult) for N in MODELS]) for mult in CHINCHILLA_MULTIPLIERS]
+    elif vary in ["flops", "flops_step"]:
+        all_flops = {
+            (N, mult): MODEL_FLOPS[N] * (MODEL_PARAMS[N] * 20 * mult)
+            for N in MODELS
+            for mult in CHINCHILLA_MULTIPLIERS
+        }
+        order = list(all_flops)
+        if vary == "flops":
+            order.sort(key=lambda rung: all_flops[rung])
+        steps = [(all_flops[rung], [rung]) for rung in order]
+    else:
+        raise ValueError(f"vary = {vary} not recognized. Use one of [N, xC, flops]")
 
-        step1_coefficients, cov = fit_step1(step1_data_by_name, y_metric="rc_bpb")
-
-        a, b, (y, y_pred, step1_rel_error), step1_unsigned_rel_errors = predict_step1(
-            configs, step1_data_by_name, step1_coefficients, y_metric="rc_bpb"
-        )
+    prefixes = []
+    rungs: List[Tuple[str, str]] = []
+    for key, new_rungs in steps:
+        rungs = rungs + [(N, f"{mult}xC") for N, mult in new_rungs]
+        prefixes.append((key, rungs))
+    return prefixes
 
-        step1_avg_unsigned_rel_error = np.mean(step1_unsigned_rel_errors)
-        step1_fitting_error += step1_avg_unsigned_rel_error
 
-        step2_data_by_name = get_step2_data_by_name(
+def load_task_data(configs, task_name, moving_avg=1, skip_perc=0.0):
+    return {
+        "step1": get_step1_data_by_name(
+            configs, task_name, y_metric="rc_bpb", moving_avg=moving_avg
+        ),
+        "step2": get_step2_data_by_name(
             configs,
             task_name,
             x_metric="rc_bpb",
             y_metric="rc_acc",
             moving_avg=moving_avg,
             skip_perc=skip_perc,
-        )
+        ),
+        "stacked": get_step1_data_by_name(
+            configs, task_name, y_metric="rc_acc", moving_avg=moving_avg
+        ),
+    }
+
+
+def select_rungs(data_by_name, rungs):
+    """
+    Keeps the eval entries and the train runs in rungs; models without any are left out.
+    """
+    selected = {}
+    for name, data in data_by_name.items():
+        if data["mode"] != "train":
+            selected[name] = data.copy()
+            continue
+        keep = np.array([(name, length) in rungs for length in data["ls"]], dtype=bool)
+        if keep.any():
+            selected[name] = data.select(keep)
+    return selected
+
+
+def run_all_steps(configs, data, task_name, rungs, p0s=(None, None)):
+    """
+    Fits step 1 and step 2 of one task on the given runs (warm-started from p0s, e.g. the
+    previous prefix's coefficients) and returns their errors on the target: the prediction
+    errors ("pred_error") and the fitting errors on the train runs ("fit_error"), for step 1,
+    step 2 and the stacked prediction, and the coefficients.
+    """
+    step1_data_by_name = select_rungs(data["step1"], rungs)
+    step1_coefficients, cov = fit_step1(
+        step1_data_by_name, y_metric="rc_bpb", varpro=True, p0=p0s[0]
+    )
 
-        step2_coefficients, cov = fit_step2(step2_data_by_name, task_name, "rc_acc")
+    a, b, (y, y_pred), step1_unsigned_rel_errors = predict_step1(
+        configs, step1_data_by_name, step1_coefficients, y_metric="rc_bpb"
+    )
+    step1_rel_error = (y_pred - y) / y
 
-        a, b, (y, y_pred, step2_rel_error, _), step2_unsigned_rel_errors = predict_step2(
-            configs, step2_data_by_name, step2_coefficients, cov, y_metric="rc_acc"
-        )
+    step2_data_by_name = select_rungs(data["step2"], rungs)
+    step2_coefficients, cov = fit_step2(step2_data_by_name, task_name, "rc_acc", p0=p0s[1])
 
-        step2_avg_unsigned_rel_error = np.mean(step2_unsigned_rel_errors)
-        step2_fitting_error += step2_avg_unsigned_rel_error
+    a, b, (y, y_pred), step2_unsigned_rel_errors = predict_step2(
+        configs, trim_eval_points(step2_data_by_name), step2_coefficients, cov, y_metric="rc_acc"
+    )
+    step2_rel_error = (y_pred - y) / y
 
-        step1_data_by_name = get_step1_data_by_name(
-            configs, task_name, y_metric="rc_acc", moving_avg=args.moving_avg
-        )
+    a, b, (y, y_pred, stacked_rel_error), stacked_unsigned_rel_errors = predict_stacked(
+        configs, select_rungs(data["stacked"], rungs), step1_coefficients, step2_coefficients
+    )
 
-        a, b, (y, y_pred, stacked_rel_error), stacked_unsigned_rel_errors = predict_stacked(
-            configs, step1_data_by_name, step1_coefficients, step2_coefficients
+    # if "hellaswag" in task_name:
+    #     print(task_name, step1_rel_error, step2_rel_error, stacked_rel_error)
+
+    return {
+        "pred_error": {
+            "step1": float(np.abs(step1_rel_error)),
+            "step2": float(np.abs(step2_rel_error)),
+            "stacked": float(np.abs(stacked_rel_error)),
+        },
+        "fit_error": {
+            "step1": float(np.mean(step1_unsigned_rel_errors)),
+            "step2": float(np.mean(step2_unsigned_rel_errors)),
+            "stacked": float(np.mean(stacked_unsigned_rel_errors)),
+        },
+        "coefficients": [np.asarray(step1_coefficients).tolist(), list(step2_coefficients)],
+    }
+
+
+def get_prefix_key(task_name, data, rungs, args, previous_key=""):
+    """
+    Content hash of everything a prefix's result depends on: the runs it fits, the fitting
+    options and solver version, and, when warm-started, the previous prefix's key (the
+    coefficients it starts from).
+    """
+    train = {
+        step: {
+            name: {key: data_by_name[key].tolist() for key in ["xs", "ys", "ns", "ds", "ls"]}
+            for name, data_by_name in select_rungs(step_data, rungs).items()
+        }
+        for step, step_data in data.items()
+    }
+    options = {key: getattr(args, key) for key in ["moving_avg", "skip_perc", "warm_start"]}
+    payload = json.dumps(
+        {
+            "task": task_name,
+            "train": train,
+            "options": options,
+            "solver": get_solver_version(),
+            "previous": previous_key,
+        },
+        sort_keys=True,
+        default=float,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _run_prefix(configs, data, task_name, rungs, args, p0s=(None, None), previous_key=""):
+    key = get_prefix_key(task_name, data, rungs, args, previous_key)
+    result = load_json_result(args.cache_dir, key)
+    if result is None:
+        try:
+            result = run_all_steps(configs, data, task_name, rungs, p0s)
+        except (RuntimeError, ValueError):
+            # the fit did not converge on this prefix; not cached, so that it is retried
+            nan_errors = {step: np.nan for step in ["step1", "step2", "stacked"]}
+            return key, {"pred_error": nan_errors, "fit_error": nan_errors, "coefficients": None}
+        save_json_result(args.cache_dir, key, result)
+    return key, result
+
+
+def run_task_sweep(configs, prefixes, args, task_name):
+    """
+    Fits the prefixes of a sweep in order, each warm-started from the previous one.
+    """
+    data = load_task_data(configs, task_name, args.moving_avg, args.skip_perc)
+    results, p0s, previous_key = [], (None, None), ""
+    for _, rungs in prefixes:
+        previous_key, result = _run_prefix(configs, data, task_name, rungs, args, p0s, previous_key)
+        p0s = result["coefficients"] or (None, None)
+        results.append(result)
+    return results
+
+
+def run_prefix(configs, prefixes, args, job):
+    task_name, i = job
+    data = load_task_data(configs, task_name, args.moving_avg, args.skip_perc)
+    return _run_prefix(configs, data, task_name, prefixes[i][1], args)[1]
+
+
+def run_sweep(args, prefixes, which_error="pred_error"):
+    """
+    Returns {key: {task_name: {step: error}}} for the prefixes of a sweep. Every (task,
+    prefix) is fit from scratch, all in parallel; with args.warm_start, prefixes are
+    warm-started from the previous one, so each task's prefixes run in order and the tasks
+    run in parallel. Results are cached in args.cache_dir, so that e.g. plotting another step
+    refits nothing.
+    """
+    configs = get_sweep_configs()
+    workers = args.workers or os.cpu_count() or 1
+    if args.warm_start:
+        results_by_task = dict(
+            zip(TASKS, map_tasks(run_task_sweep, TASKS, workers, configs, prefixes, args))
         )
+    else:
+        jobs = [(task_name, i) for task_name in TASKS for i in range(len(prefixes))]
+        results = map_tasks(run_prefix, jobs, workers, configs, prefixes, args)
+        results_by_task = {
+            task_name: results[j * len(prefixes) : (j + 1) * len(prefixes)]
+            for j, task_name in enumerate(TASKS)
+        }
 
-        # if "hellaswag" in task_name:
-        #     print(task_name, step1_rel_error, step2_rel_error, stacked_rel_error)
-
-        stacked_avg_unsigned_rel_error = np.mean(stacked_unsigned_rel_errors)
-        stacked_fitting_error += stacked_avg_unsigned_rel_error
-
-        if which_error == "pred_error":
-            output[task_name] = {
-                "step1": np.abs(step1_rel_error),
-                "step2": np.abs(step2_rel_error),
-                "stacked": np.abs(stacked_rel_error),
-            }
-        else:
-            output[task_name] = {
-                "step1": np.abs(step1_avg_unsigned_rel_error),
-                "step2": np.abs(step2_avg_unsigned_rel_error),
-                "stacked": np.abs(stacked_avg_unsigned_rel_error),
-            }
-
-    return output
+    return {
+        key: {task_name: results_by_task[task_name][i][which_error] for task_name in TASKS}
+        for i, (key, _) in enumerate(prefixes)
+    }
 
 
 def plot_vary_n(N_df, output_path, which_step):
@@ -253,32 +410,7 @@ def plot_vary_n(N_df, output_path, which_step):
 
 
 def run_predictions_vary_n(args, which_step="stacked"):
-    output_per_N = {}
-
-    configs = {TARGET_CONFIG["label"]: TARGET_CONFIG}
-
-    for N in MODELS:
-        paths = [
-            f"src/scripts/paper/data/ladder-runs/{path_name(N, mult)}.csv"
-            for mult in CHINCHILLA_MULTIPLIERS
-        ]
-        configs[N] = {
-            "paths": paths,
-            "mode": "train",
-            "n": MODEL_PARAMS[N],
-            "label": N,
-            "color": COLOR_MAP[N],
-        }
-
-        final_configs = {name: FinalConfig(**config) for name, config in configs.items()}  # type: ignore
-
-        if N == "1.3B":
-            print(final_configs)
-
-        output = run_all_steps(final_configs, moving_avg=args.moving_avg, skip_perc=args.skip_perc)
-
-        # output_per_N[N] = {key: val[which_step] for key, val in output.items()}
-        output_per_N[N] = output
+    output_per_N = run_sweep(args, get_prefixes("N"))
 
     N_df = pd.DataFrame.from_dict(output_per_N).transpose()
     plot_vary_n(N_df, args.output_path, which_step)
@@ -357,32 +489,7 @@ def plot_vary_xC(xC_df, output_path, which_step):
 
 
 def run_predictions_vary_xC(args, which_step="stacked"):
-    output_per_xC = {}
-
-    configs = {TARGET_CONFIG["label"]: TARGET_CONFIG}
-
-    for mult in CHINCHILLA_MULTIPLIERS:
-        for N in MODELS:
-            if N in configs:
-                configs[N]["paths"] += [
-                    f"src/scripts/paper/data/ladder-runs/{path_name(N, mult)}.csv"
-                ]  # type: ignore
-            else:
-                paths = [f"src/scripts/paper/data/ladder-runs/{path_name(N, mult)}.csv"]
-                configs[N] = {
-                    "paths": paths,
-                    "mode": "train",
-                    "n": MODEL_PARAMS[N],
-                    "label": N,
-                    "color": COLOR_MAP[N],
-                }
-
-        final_configs = {name: FinalConfig(**config) for name, config in configs.items()}  # type: ignore
-
-        output = run_all_steps(final_configs, moving_avg=args.moving_avg, skip_perc=args.skip_perc)
-
-        # output_per_xC[mult] = {key: val[which_step] for key, val in output.items()}
-        output_per_xC[mult] = output
+    output_per_xC = run_sweep(args, get_prefixes("xC"))
 
     xC_df = pd.DataFrame.from_dict(output_per_xC).transpose()
     plot_vary_xC(xC_df, args.output_path, which_step)
@@ -435,10 +542,7 @@ def plot_vary_flops(flops_df, output_path, which_step, do_average=False):
             # ax.set_xticks([MODEL_FLOPS[model] for model in task_df.index], task_df.index)
 
     else:
-        import pdb
-
-        pdb.set_trace()
-        flops_df["average"] = flops_df.mean(axis=1)
+        flops_df["average"] = flops_df.map(lambda x: x[which_step]).mean(axis=1)
 
         fig, ax = plt.subplots(figsize=(3, 2.5))
         ax.plot(
@@ -488,47 +592,8 @@ def plot_vary_flops(flops_df, output_path, which_step, do_average=False):
 
 
 def run_predictions_vary_flops(args, which_step="stacked", do_average=False):
-    output_per_flops = {}
-
-    configs = {TARGET_CONFIG["label"]: TARGET_CONFIG}
-
-    all_flops = {}
-    for N in MODELS:
-        for mult in CHINCHILLA_MULTIPLIERS:
-            all_flops[f"{path_name(N, mult)}"] = MODEL_FLOPS[N] * (MODEL_PARAMS[N] * 20 * mult)
-
-    sorted_flops = sorted(all_flops.items(), key=lambda item: item[1])
-
-    cum_flops = 0
-
-    for run_name, num_flops in sorted_flops:
-        cum_flops = num_flops
-        N, xC = run_name.replace("xC", "").split("-")
-        if N == "1B":
-            N = "1.3B"
-        elif N == "3B":
-            N = "3.2B"
-        mult = int(xC)
-        if N in configs:
-            configs[N]["paths"] += [f"src/scripts/paper/data/ladder-runs/{path_name(N, mult)}.csv"]  # type: ignore
-        else:
-            paths = [f"src/scripts/paper/data/ladder-runs/{path_name(N, mult)}.csv"]
-            print(N)
-            configs[N] = {
-                "paths": paths,
-                "mode": "train",
-                "n": MODEL_PARAMS[N],
-                "label": N,
-                "color": COLOR_MAP[N],
-            }
-
-        final_configs = {name: FinalConfig(**config) for name, config in configs.items()}  # type: ignore
-
-        output = run_all_steps(final_configs, moving_avg=args.moving_avg, skip_perc=args.skip_perc)
-
-        # output_per_flops[cum_flops] = {key: val[which_step] for key, val in output.items()}
-        output_per_flops[cum_flops] = output
-
+    output_per_flops = run_sweep(args, get_prefixes("flops"))
+    for cum_flops, output in output_per_flops.items():
         print(f"{cum_flops:.3e}", output["mmlu_avg_test_5shot"])
 
     flops_df = pd.DataFrame.from_dict(output_per_flops).transpose()
@@ -537,44 +602,8 @@ def run_predictions_vary_flops(args, which_step="stacked", do_average=False):
 
 
 def run_predictions_vary_flops_step(args, which_step="stacked", do_average=False):
-    output_per_flops = {}
-
-    configs = {TARGET_CONFIG["label"]: TARGET_CONFIG}
-
-    all_flops = {}
-    for N in MODELS:
-        for mult in CHINCHILLA_MULTIPLIERS:
-            all_flops[f"{path_name(N, mult)}"] = MODEL_FLOPS[N] * (MODEL_PARAMS[N] * 20 * mult)
-
-    # sorted_flops = sorted(all_flops.items(), key=lambda item: item[1])
-    sorted_flops = all_flops.items()
-
-    cum_flops = 0
-
-    for run_name, num_flops in sorted_flops:
-        cum_flops = num_flops
-        N, xC = run_name.replace("xC", "").split("-")
-        mult = int(xC)
-        if N in configs:
-            configs[N]["paths"] += [f"src/scripts/paper/data/ladder-runs/{path_name(N, mult)}.csv"]  # type: ignore
-        else:
-            paths = [f"src/scripts/paper/data/ladder-runs/{path_name(N, mult)}.csv"]
-            configs[N] = {
-                "paths": paths,
-                "mode": "train",
-                "n": MODEL_PARAMS[N],
-                "label": N,
-                "color": COLOR_MAP[N],
-            }
-
-        final_configs = {name: FinalConfig(**config) for name, config in configs.items()}  # type: ignore
-        print(final_configs)
-
-        output = run_all_steps(final_configs, moving_avg=args.moving_avg, skip_perc=args.skip_perc)
-
-        # output_per_flops[cum_flops] = {key: val[which_step] for key, val in output.items()}
-        output_per_flops[cum_flops] = output
-
+    output_per_flops = run_sweep(args, get_prefixes("flops_step"))
+    for cum_flops, output in output_per_flops.items():
         print(f"{cum_flops:.3e}", output["mmlu_avg_test_5shot"])
 
     flops_df = pd.DataFrame.from_dict(output_per_flops).transpose()
@@ -599,6 +628,20 @@ def parse_args():
     parser.add_argument("--vary", type=str, default="flops")
     parser.add_argument("--which_step", type=str, default="stacked")
     parser.add_argument("--do_average", action="store_true", default=False)
+    parser.add_argument(
+        "--warm_start",
+        action="store_true",
+        help="Start each prefix's fit from the previous prefix's coefficients (changes results)",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=".cache/compute_vs_error_analysis",
+        help="Directory for cached prefix results (empty string to disable)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Number of worker processes (default: all cores)"
+    )
 
     args = parser.parse_args()
 
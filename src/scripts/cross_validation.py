@@ -0,0 +1,267 @@
+# python src/scripts/cross_validation.py -k v2_main -c src/scripts/paper/configs/final.json --skip_perc 0.1 --moving_avg 5
+# python src/scripts/cross_validation.py -k v2_main -c src/scripts/paper/configs/final.json --skip_perc 0.1 --moving_avg 5 --holdout size -o src/scripts/paper/figures/cv_size.csv
+
+import argparse
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from chained_fits import (
+    WORKER_STATE,
+    add_chained_args,
+    fit_chained,
+    load_data_by_task,
+    map_jobs,
+    predict_chained,
+)
+
+from scaling.fit_cache import load_json_result, save_json_result
+from scaling.utils import get_task_sets
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    add_chained_args(parser)
+    parser.add_argument(
+        "-o", "--output-path", type=str, default=None, help="Path to write the fold results (csv)"
+    )
+    parser.add_argument(
+        "--holdout",
+        default="rung",
+        choices=["rung", "size"],
+        help="Hold out one rung (N, xC run) or one model size (all of its runs) per fold",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=".cache/cross_validation",
+        help="Directory for cached fold results (empty string to disable)",
+    )
+    args = parser.parse_args()
+
+    args.keys = get_task_sets(args.keys)
+
+    return args
+
+
+def get_folds(step1_data_by_name, holdout="rung"):
+    """
+    Returns {fold_name: [(name, length), ...]}, the train rungs held out by each fold.
+    """
+    folds = {}
+    for name, data in step1_data_by_name.items():
+        if data["mode"] != "train":
+            continue
+        if holdout == "size":
+            folds[name] = [(name, length) for length in data["ls"]]
+        else:
+            for length in data["ls"]:
+                folds[f"{name}-{length}" if length else name] = [(name, length)]
+    return folds
+
+
+def _drop_rungs(data_by_name, rungs):
+    dropped = {}
+    for name, data in data_by_name.items():
+        if data["mode"] != "train":
+            dropped[name] = data.copy()
+            continue
+        keep = np.array([(name, length) not in rungs for length in data["ls"]], dtype=bool)
+        if keep.any():
+            dropped[name] = data.select(keep)
+    return dropped
+
+
+def get_heldout_targets(step1_data_by_name, step2_data_by_name, rungs):
+    """
+    The final checkpoint of each held-out rung: its size, data, task loss and task accuracy.
+    """
+    targets = []
+    for name, length in rungs:
+        step1_data, step2_data = step1_data_by_name[name], step2_data_by_name[name]
+        i = np.flatnonzero(step1_data["ls"] == length)[0]
+        j = np.flatnonzero(step2_data["ls"] == length)[-1]
+        targets.append(
+            {
+                "name": name,
+                "length": length,
+                "n": int(step1_data["ns"][i]),
+                "d": int(step1_data["ds"][i]),
+                "loss": float(step1_data["xs"][i]),
+                "acc": float(step2_data["ys"][j]),
+            }
+        )
+    return targets
+
+
+def get_fold_key(task_name, step1_data_by_name, step2_data_by_name, targets, args):
+    """
+    Content hash of everything a fold's result depends on: its training data, its held-out
+    targets and the fitting options. The warm start is deliberately left out, so that changing
+    the full fit (e.g. by adding a rung) does not invalidate folds whose own data is unchanged.
+    """
+    train = {
+        step: {
+            name: {key: data[key].tolist() for key in ["xs", "ys", "ns", "ds", "ls"]}
+            for name, data in data_by_name.items()
+            if data["mode"] == "train"
+        }
+        for step, data_by_name in [("step1", step1_data_by_name), ("step2", step2_data_by_name)]
+    }
+    options = {
+        key: getattr(args, key)
+        for key in ["x_metric", "y_metric", "moving_avg", "skip_perc", "use_log_sigmoid"]
+    }
+    payload = json.dumps(
+        {"task": task_name, "train": train, "targets": targets, "options": options},
+        sort_keys=True,
+        default=float,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _run_fold(task_name, rungs):
+    args = WORKER_STATE["args"]
+    step1_data_by_name, step2_data_by_name = WORKER_STATE["data"][task_name]
+    targets = get_heldout_targets(step1_data_by_name, step2_data_by_name, rungs)
+    try:
+        coefficients = fit_chained(
+            _drop_rungs(step1_data_by_name, rungs),
+            _drop_rungs(step2_data_by_name, rungs),
+            task_name,
+            args,
+            p0s=WORKER_STATE["coefficients"][task_name],
+        )
+        predictions = [
+            predict_chained(coefficients, target["n"], target["d"], args.use_log_sigmoid)
+            for target in targets
+        ]
+    except (RuntimeError, ValueError):
+        # the fit did not converge on this fold
+        predictions = [(np.nan, np.nan)] * len(targets)
+    return [
+        {**target, "pred_loss": pred_loss, "pred_acc": pred_acc}
+        for target, (pred_loss, pred_acc) in zip(targets, predictions)
+    ]
+
+
+def run_cross_validation(args, data_by_task):
+    """
+    Fits every task on the full data, then refits each fold (warm-started from the full fit)
+    across a process pool. Folds found in args.cache_dir are not refit.
+    Returns {task_name: {fold_name: [row per held-out rung]}}.
+    """
+    jobs: List[Tuple[str, str, List]] = []
+    keys: Dict[Tuple[str, str], str] = {}
+    results: Dict[str, Dict[str, Any]] = {}
+    for task_name, (step1_data_by_name, step2_data_by_name) in data_by_task.items():
+        results[task_name] = {}
+        for fold_name, rungs in get_folds(step1_data_by_name, args.holdout).items():
+            targets = get_heldout_targets(step1_data_by_name, step2_data_by_name, rungs)
+            key = get_fold_key(
+                task_name,
+                _drop_rungs(step1_data_by_name, rungs),
+                _drop_rungs(step2_data_by_name, rungs),
+                targets,
+                args,
+            )
+            cached = load_json_result(args.cache_dir, key)
+            if cached is not None:
+                results[task_name][fold_name] = cached
+            else:
+                jobs.append((task_name, fold_name, rungs))
+                keys[(task_name, fold_name)] = key
+
+    # the warm starts are only needed for the tasks that still have folds to fit
+    coefficients_by_task = {}
+    for task_name in dict.fromkeys(task_name for task_name, _, _ in jobs):
+        step1_data_by_name, step2_data_by_name = data_by_task[task_name]
+        coefficients_by_task[task_name] = fit_chained(
+            step1_data_by_name, step2_data_by_name, task_name, args
+        )
+
+    fold_rows = map_jobs(
+        _run_fold,
+        [(task_name, rungs) for task_name, _, rungs in jobs],
+        args,
+        data_by_task,
+        coefficients_by_task,
+        workers=args.workers,
+    )
+
+    for (task_name, fold_name, _), rows in zip(jobs, fold_rows):
+        results[task_name][fold_name] = rows
+        save_json_result(args.cache_dir, keys[(task_name, fold_name)], rows)
+
+    return results
+
+
+def get_fold_table(results):
+    rows = []
+    for task_name, folds in results.items():
+        for fold_name, fold_rows in folds.items():
+            for row in fold_rows:
+                rows.append(
+                    {
+                        "Task": task_name,
+                        "Fold": fold_name,
+                        "Rung": f"{row['name']}-{row['length']}" if row["length"] else row["name"],
+                        "Actual Loss": row["loss"],
+                        "Pred Loss": row["pred_loss"],
+                        "Loss Rel Error": (row["pred_loss"] - row["loss"]) / row["loss"],
+                        "Actual Acc": row["acc"],
+                        "Pred Acc": row["pred_acc"],
+                        "Acc Abs Error": row["pred_acc"] - row["acc"],
+                    }
+                )
+    return pd.DataFrame(rows)
+
+
+def get_summary_table(df):
+    return (
+        df.assign(
+            **{
+                "Loss Rel Error": df["Loss Rel Error"].abs(),
+                "Acc Abs Error": df["Acc Abs Error"].abs(),
+            }
+        )
+        .groupby("Task", sort=False)
+        .agg(
+            **{
+                "Mean |Loss Rel Error|": ("Loss Rel Error", "mean"),
+                "Max |Loss Rel Error|": ("Loss Rel Error", "max"),
+                "Mean |Acc Abs Error|": ("Acc Abs Error", "mean"),
+                "Max |Acc Abs Error|": ("Acc Abs Error", "max"),
+                "Folds": ("Fold", "nunique"),
+            }
+        )
+        .reset_index()
+    )
+
+
+def main():
+    args = parse_args()
+    data_by_task = load_data_by_task(args)
+
+    results = run_cross_validation(args, data_by_task)
+    df = get_fold_table(results)
+
+    float_format = lambda x: f"{x:.4f}"  # noqa: E731
+    for task_name, task_df in df.groupby("Task", sort=False):
+        print(f"Held-out errors for {task_name} (leave-one-{args.holdout}-out):")
+        print(task_df.drop(columns="Task").to_string(index=False, float_format=float_format))
+        print()
+    print(get_summary_table(df).to_string(index=False, float_format=float_format))
+
+    if args.output_path:
+        os.makedirs(os.path.dirname(args.output_path), exist_ok=True)
+        df.to_csv(args.output_path, index=False)
+
+    return df
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+Pipeline for the two-step ladder model: load → fit step 1 → fit step 2 → chain.
+
+A Pipeline holds the options of one prediction setup and computes each stage of a task at
+most once: loaded data and fitted coefficients are memoized, and are shared with the pipelines
+derived from it with with_options(), so that e.g. a step 2 fit with log sigmoid reuses the
+step 1 fit and the loaded data of the pipeline without it. Pipeline.run() evaluates the stages
+of several tasks as a dependency graph; with workers > 1, the tasks are fit in parallel on a
+process pool (the fits are CPU-bound, so threads would serialize on the GIL).
+
+The step1, step2 and predict scripts are thin CLIs over it, and other scripts (e.g.
+variance_analysis) call it directly instead of re-running those CLIs.
+"""
+
+import functools
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from scaling.utils import (
+    get_final_configs,
+    get_step1_data_by_name,
+    get_step2_data_by_name,
+    trim_eval_points,
+)
+
+# stage: the stages it depends on
+STAGES: Dict[str, Tuple[str, ...]] = {
+    "step1_data": (),
+    "step2_data": (),
+    "fit_step1": ("step1_data",),
+    "fit_step2": ("step2_data",),
+    "chain": ("fit_step1", "fit_step2"),
+}
+
+
+@dataclass
+class Fit:
+    coefficients: Any
+    cov: Any
+    data_by_name: Dict
+    """
+    The data the coefficients were fitted on (for step 2, with the eval entries trimmed to
+    their final checkpoint, as predict_step2 expects).
+    """
+
+
+def run_dag(graph: Dict[Hashable, Tuple[Callable[[], Any], Iterable]], workers: int = 1):
+    """
+    Runs graph ({node: (func, dependencies)}) and returns {node: func()}. A node is started
+    once all of its dependencies have finished; with workers > 1, nodes whose dependencies
+    have finished run concurrently on a thread pool. The first exception raised by a node is
+    re-raised once the running nodes have finished.
+    """
+    remaining = {node: set(dependencies) for node, (_, dependencies) in graph.items()}
+    for node, dependencies in remaining.items():
+        missing = dependencies - graph.keys()
+        if missing:
+            raise ValueError(f"{node} depends on {missing}, which are not in the graph")
+
+    results: Dict[Hashable, Any] = {}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        running: Dict[Future, Hashable] = {}
+        while remaining or running:
+            for node in [node for node, dependencies in remaining.items() if not dependencies]:
+                del remaining[node]
+                running[executor.submit(graph[node][0])] = node
+            if not running:
+                raise ValueError(f"The graph has a cycle through {list(remaining)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                results[node] = future.result()
+                for dependencies in remaining.values():
+                    dependencies.discard(node)
+    return results
+
+
+def map_tasks(func: Callable, task_names: Sequence, workers: int = 1, *args) -> List:
+    """
+    Returns [func(*args, task_name) for task_name in task_names]. With workers > 1, the calls
+    are spread over a process pool (func and args must be picklable); the results are still
+    returned in task order, so that tables and figures do not depend on the number of workers.
+    """
+    func = functools.partial(func, *args)
+    workers = min(workers or 1, len(task_names))
+    if workers <= 1:
+        return [func(task_name) for task_name in task_names]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, task_names))
+
+
+class _Memo:
+    """
+    Thread-safe memo of {key: Future}. Concurrent requests for the same key wait for the
+    first one instead of recomputing it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures: Dict[Hashable, Future] = {}
+
+    def get(self, key: Hashable, func: Callable[[], Any]):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if future is None:
+                future = self._futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Stores a value computed elsewhere (e.g. in a worker process), unless key is already
+        memoized.
+        """
+        with self._lock:
+            if key not in self._futures:
+                future = self._futures[key] = Future()
+                future.set_result(value)
+
+
+def _run_task(options: Dict, stages: List[str], task_name: str) -> Dict:
+    # runs in a worker process, on a pipeline of its own
+    pipeline = Pipeline(**options)
+    return run_dag(pipeline.get_graph([task_name], stages))
+
+
+class Pipeline:
+    """
+    config_path is used for step 1 and step2_config_path (config_path if None) for step 2.
+    x_metric is the task loss predicted by step 1 and used as the input of step 2, y_metric
+    the accuracy predicted by step 2. n and d are the size and tokens of the target model,
+    used by the chain stage.
+    """
+
+    def __init__(
+        self,
+        config_path: str,
+        step2_config_path: Optional[str] = None,
+        x_metric: str = "rc_bpb",
+        y_metric: str = "rc_acc",
+        moving_avg: int = 1,
+        skip_perc: float = 0.0,
+        use_log_sigmoid: bool = False,
+        num_starts: int = 1,
+        varpro: bool = False,
+        solver: str = "lbfgs",
+        grid_search: bool = False,
+        n: Optional[int] = None,
+        d: Optional[int] = None,
+        memo: Optional[_Memo] = None,
+    ):
+        self.options: Dict[str, Any] = dict(
+            config_path=config_path,
+            step2_config_path=step2_config_path or config_path,
+            x_metric=x_metric,
+            y_metric=y_metric,
+            moving_avg=moving_avg,
+            skip_perc=skip_perc,
+            use_log_sigmoid=use_log_sigmoid,
+            num_starts=num_starts,
+            varpro=varpro,
+            solver=solver,
+            grid_search=grid_search,
+            n=n,
+            d=d,
+        )
+        self._memo = memo if memo is not None else _Memo()
+        self.configs = self._memo.get(
+            ("configs", config_path), lambda: get_final_configs(config_path)
+        )
+        self.step2_configs = self._memo.get(
+            ("configs", self.options["step2_config_path"]),
+            lambda: get_final_configs(self.options["step2_config_path"]),
+        )
+
+    def with_options(self, **overrides) -> "Pipeline":
+        """
+        A pipeline with some options changed, sharing this one's memo: the stages that do not
+        depend on the changed options are not recomputed.
+        """
+        return Pipeline(**{**self.options, **overrides}, memo=self._memo)
+
+    def stage_key(self, stage: str, task_name: str) -> Tuple:
+        """
+        Identifies a stage of a task by the options it depends on (including those of the
+        stages it depends on), so that pipelines which agree on them share the stage.
+        """
+        options = self.options
+        if stage == "step1_data":
+            keys = ["config_path", "x_metric", "moving_avg"]
+        elif stage == "step2_data":
+            keys = ["step2_config_path", "x_metric", "y_metric", "moving_avg", "skip_perc"]
+        elif stage == "fit_step1":
+            keys = [
+                "config_path",
+                "x_metric",
+                "moving_avg",
+                "num_starts",
+                "varpro",
+                "solver",
+                "grid_search",
+            ]
+        elif stage == "fit_step2":
+            keys = [
+                "step2_config_path",
+                "x_metric",
+                "y_metric",
+                "moving_avg",
+                "skip_perc",
+                "use_log_sigmoid",
+            ]
+        elif stage == "chain":
+            keys = list(options)
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+        return (stage, task_name) + tuple(options[key] for key in keys)
+
+    def step1_data(self, task_name: str) -> Dict:
+        return self._memo.get(
+            self.stage_key("step1_data", task_name),
+            lambda: get_step1_data_by_name(
+                self.configs,
+                task_name,
+                y_metric=self.options["x_metric"],
+                moving_avg=self.options["moving_avg"],
+            ),
+        )
+
+    def step2_data(self, task_name: str) -> Dict:
+        return self._memo.get(
+            self.stage_key("step2_data", task_name),
+            lambda: get_step2_data_by_name(
+                self.step2_configs,
+                task_name,
+                x_metric=self.options["x_metric"],
+                y_metric=self.options["y_metric"],
+                moving_avg=self.options["moving_avg"],
+                skip_perc=self.options["skip_perc"],
+            ),
+        )
+
+    def fit_step1(self, task_name: str) -> Fit:
+        return self._memo.get(
+            self.stage_key("fit_step1", task_name), lambda: self._fit_step1(task_name)
+        )
+
+    def fit_step2(self, task_name: str) -> Fit:
+        return self._memo.get(
+            self.stage_key("fit_step2", task_name), lambda: self._fit_step2(task_name)
+        )
+
+    def chain(self, task_name: str) -> Tuple[float, float]:
+        """
+        The predicted task loss and accuracy of the target model (n, d).
+        """
+        return self._memo.get(self.stage_key("chain", task_name), lambda: self._chain(task_name))
+
+    def _fit_step1(self, task_name):
+        from step1 import fit_step1
+
+        data_by_name = self.step1_data(task_name)
+        coefficients, cov = fit_step1(
+            data_by_name,
+            self.options["x_metric"],
+            num_starts=self.options["num_starts"],
+            varpro=self.options["varpro"],
+            solver=self.options["solver"],
+            grid_search=self.options["grid_search"],
+        )
+        return Fit(coefficients, cov, data_by_name)
+
+    def _fit_step2(self, task_name):
+        y_metric = self.options["y_metric"]
+        use_log_sigmoid = self.options["use_log_sigmoid"]
+        data_by_name = self.step2_data(task_name)
+        if y_metric == "rc_acc":
+            from step2 import fit_step2
+
+            coefficients, cov = fit_step2(
+                data_by_name, task_name, y_metric, use_log_sigmoid=use_log_sigmoid
+            )
+        elif y_metric == "mc_acc":
+            from step2_mc import fit_step2 as fit_step2_mc
+
+            coefficients, cov = fit_step2_mc(
+                data_by_name, task_name, y_metric, use_log_sigmoid=use_log_sigmoid
+            )
+        else:
+            raise ValueError(f"Invalid y_metric: {y_metric}")
+        return Fit(coefficients, cov, trim_eval_points(data_by_name))
+
+    def _chain(self, task_name):
+        from chained_fits import predict_chained
+
+        if self.options["n"] is None or self.options["d"] is None:
+            raise ValueError("The chain stage needs the target model's n and d")
+        coefficients = (
+            self.fit_step1(task_name).coefficients,
+            self.fit_step2(task_name).coefficients,
+        )
+        return predict_chained(
+            coefficients, self.options["n"], self.options["d"], self.options["use_log_sigmoid"]
+        )
+
+    def get_graph(self, task_names: List[str], stages: Iterable[str]):
+        """
+        The dependency graph (as taken by run_dag) of the given stages of each task, and of
+        the stages they depend on. Nodes are stage keys, so graphs of pipelines sharing a
+        memo can be merged and run together.
+        """
+        graph = {}
+        for task_name in task_names:
+            pending = list(stages)
+            while pending:
+                stage = pending.pop()
+                key = self.stage_key(stage, task_name)
+                if key in graph:
+                    continue
+                dependencies = STAGES[stage]
+                graph[key] = (
+                    lambda stage=stage, task_name=task_name: getattr(self, stage)(task_name),
+                    [self.stage_key(dependency, task_name) for dependency in dependencies],
+                )
+                pending.extend(dependencies)
+        return graph
+
+    def run(self, task_names: List[str], stages: Iterable[str] = ("chain",), workers: int = 1):
+        """
+        Computes the given stages (and the stages they depend on) of every task, and memoizes
+        them. With workers > 1, the tasks are computed in parallel on a process pool of
+        `workers` processes. Returns {task_name: {stage: result}} for the given stages.
+        """
+        stages = list(stages)
+        if workers > 1 and len(task_names) > 1:
+            results = {}
+            for task_results in map_tasks(_run_task, task_names, workers, self.options, stages):
+                for key, value in task_results.items():
+                    self._memo.set(key, value)
+                results.update(task_results)
+        else:
+            results = run_dag(self.get_graph(task_names, stages))
+        return {
+            task_name: {stage: results[self.stage_key(stage, task_name)] for stage in stages}
+            for task_name in task_names
+        }
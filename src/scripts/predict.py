@@ -8,24 +8,11 @@
 
 import argparse
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-import seaborn as sns
-from step1 import fit_step1
-from step2 import fit_step2
-from step2_mc import fit_step2 as fit_step2_mc
-
-from scaling.fitting_functions import chinchilla_n_d_fit, log_sigmoid, sigmoid
-from scaling.utils import (
-    TaskFittingResults,
-    get_final_configs,
-    get_step1_data_by_name,
-    get_step2_data_by_name,
-    get_task_sets,
-    print_results_table,
-    tasks,
-)
+from pipeline import Pipeline
+
+from scaling.fitting_functions import predict_chained_fit
+from scaling.utils import TaskFittingResults, get_task_sets, print_results_table, tasks
 
 MARKERS = {"0.5xC": "D", "1xC": "s", "2xC": "P", "5xC": "p", "10xC": "*", "": "o"}
 FONTSIZE = 9
@@ -76,6 +63,14 @@ def parse_args():
     parser.add_argument(
         "--use_log_sigmoid", action="store_true", help="Use log sigmoid for fitting"
     )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes to fit tasks in parallel"
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Skip the figure and only write the results (csv) next to the output path",
+    )
     args = parser.parse_args()
 
     args.keys = get_task_sets(args.keys)
@@ -90,24 +85,25 @@ def predict_chained(data_by_name, step1_coefficients, step2_coefficients, use_lo
     dmin = 0.8 * min([min(data["ds"]) for data in data_by_name.values()])
     dmax = 1.5 * max([max(data["ds"]) for data in data_by_name.values()])
 
-    fit_fn = log_sigmoid if use_log_sigmoid else sigmoid
-
     for name, data in data_by_name.items():
         predicted_data_by_name[name] = {
             "ds": data["ds"],
-            "ys": [
-                fit_fn(chinchilla_n_d_fit([n, d], step1_coefficients), *step2_coefficients)  # type: ignore
-                for n, d in zip(data["ns"], data["ds"])
-            ],
+            "ys": predict_chained_fit(
+                [data["ns"], data["ds"]],
+                step1_coefficients,
+                step2_coefficients,
+                use_log_sigmoid=use_log_sigmoid,
+            )[1],
         }
         ds = np.exp(np.linspace(np.log(dmin), np.log(dmax), 100))
-        ns = [data["ns"][0]] * len(ds)
         plotted_predicted_data_by_name[name] = {
             "ds": ds,
-            "ys": [
-                fit_fn(chinchilla_n_d_fit([n, d], step1_coefficients), *step2_coefficients)  # type: ignore
-                for n, d in zip(ns, ds)
-            ],
+            "ys": predict_chained_fit(
+                [data["ns"][0], ds],
+                step1_coefficients,
+                step2_coefficients,
+                use_log_sigmoid=use_log_sigmoid,
+            )[1],
         }
 
         if data["mode"] == "eval":
@@ -136,8 +132,13 @@ def plot_chained(
     plotted_predicted_data_by_name,
     task_name,
     fit_str,
-    ax=plt.gca(),
+    ax=None,
 ):
+    if ax is None:
+        import matplotlib.pyplot as plt
+
+        ax = plt.gca()
+
     # plot the fitted curve
     for name, data in plotted_predicted_data_by_name.items():
         config = configs[name]
@@ -206,76 +207,69 @@ def plot_chained(
 
 def main():
     args = parse_args()
-    configs = get_final_configs(args.config_path)
-    if args.step2_config_path:
-        step2_configs = get_final_configs(args.step2_config_path)
-    else:
-        step2_configs = configs
+    pipeline = Pipeline(
+        args.config_path,
+        step2_config_path=args.step2_config_path,
+        x_metric=args.x_metric,
+        y_metric=args.y_metric,
+        moving_avg=args.moving_avg,
+        skip_perc=args.skip_perc,
+        use_log_sigmoid=args.use_log_sigmoid,
+        n=args.n,
+        d=args.d,
+    )
+    configs = pipeline.configs
+    # the accuracy of the runs themselves, which the chained fit is plotted against
+    single_step_pipeline = pipeline.with_options(x_metric="rc_acc")
+    pipeline.run(args.keys, stages=["chain"], workers=args.workers)
 
-    sns.set_style("whitegrid")
+    # plotting libraries are only imported when a figure is made
+    plot = args.output_path and not args.headless
     num_tasks = len(args.keys)
     num_cols = min(4, num_tasks)
     num_rows = (num_tasks + num_cols - 1) // num_cols
-    fig, axes = plt.subplots(
-        num_rows, num_cols, figsize=(2.75 * num_cols, 2.25 * num_rows), squeeze=False
-    )
+    if plot:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        sns.set_style("whitegrid")
+        fig, axes = plt.subplots(
+            num_rows, num_cols, figsize=(2.75 * num_cols, 2.25 * num_rows), squeeze=False
+        )
 
     results = []
 
     for r, task_name in enumerate(args.keys):
-        step1_data_by_name = get_step1_data_by_name(
-            configs, task_name, y_metric=args.x_metric, moving_avg=args.moving_avg
-        )
-        step2_data_by_name = get_step2_data_by_name(
-            step2_configs,
-            task_name,
-            x_metric=args.x_metric,
-            y_metric=args.y_metric,
-            moving_avg=args.moving_avg,
-            skip_perc=args.skip_perc,
-        )
-        single_step_data_by_name = get_step1_data_by_name(
-            configs, task_name, y_metric="rc_acc", moving_avg=args.moving_avg
-        )
-
-        # fit the parameters
-        step1_coefficients, _ = fit_step1(step1_data_by_name, y_metric=args.x_metric)
-        if args.y_metric == "rc_acc":
-            step2_coefficients, _ = fit_step2(
-                step2_data_by_name, task_name, args.y_metric, args.use_log_sigmoid
-            )
-        elif args.y_metric == "mc_acc":
-            step2_coefficients, _ = fit_step2_mc(
-                step2_data_by_name, task_name, args.y_metric, args.use_log_sigmoid
+        if plot:
+            single_step_data_by_name = single_step_pipeline.step1_data(task_name)
+            step1_coefficients = pipeline.fit_step1(task_name).coefficients
+            step2_coefficients = pipeline.fit_step2(task_name).coefficients
+
+            # make predictions
+            (
+                predicted_data_by_name,
+                plotted_predicted_data_by_name,
+                (y, y_pred, rel_error),
+            ) = predict_chained(
+                single_step_data_by_name,
+                step1_coefficients,
+                step2_coefficients,
+                args.use_log_sigmoid,
             )
-        else:
-            raise ValueError(f"Invalid y_metric: {args.y_metric})")
-
-        # make predictions
-        (
-            predicted_data_by_name,
-            plotted_predicted_data_by_name,
-            (y, y_pred, rel_error),
-        ) = predict_chained(
-            single_step_data_by_name, step1_coefficients, step2_coefficients, args.use_log_sigmoid
-        )
 
-        plot_chained(
-            configs,
-            single_step_data_by_name,
-            predicted_data_by_name,
-            plotted_predicted_data_by_name,
-            task_name,
-            str_chained_fit(step1_coefficients, step2_coefficients, args.use_log_sigmoid),
-            axes[r // num_cols][r % num_cols],
-        )
+            plot_chained(
+                configs,
+                single_step_data_by_name,
+                predicted_data_by_name,
+                plotted_predicted_data_by_name,
+                task_name,
+                str_chained_fit(step1_coefficients, step2_coefficients, args.use_log_sigmoid),
+                axes[r // num_cols][r % num_cols],
+            )
 
-        # make predictions
-        pred_loss = chinchilla_n_d_fit([args.n, args.d], step1_coefficients)
-        fit_fn = log_sigmoid if args.use_log_sigmoid else sigmoid
-        pred_acc = fit_fn(pred_loss, *step2_coefficients)  # type: ignore
+        _, pred_acc = pipeline.chain(task_name)
         if args.target_name:
-            data = step2_data_by_name[args.target_name]
+            data = pipeline.step2_data(task_name)[args.target_name]
             actual_acc = data["ys"][-1]
             results.append(
                 TaskFittingResults(
@@ -288,35 +282,37 @@ def main():
         else:
             print(f"\n{task_name} | {pred_acc * 100:.1f} | - | - | -")
 
-    handles, labels = axes[-1][-1].get_legend_handles_labels()
-    # delete x-axis labels for all but the bottom row
-    for i in range(num_cols):
-        for j in range(num_rows):
-            if j != num_rows - 1:
-                axes[j][i].set_xlabel("")
-            if i != 0:
-                axes[j][i].set_ylabel("")
-
-            axes[j][i].legend().remove()
-
-    fig.tight_layout(w_pad=0.01)
-    legend = fig.legend(
-        handles,
-        labels,
-        loc="upper center",
-        ncol=10,
-        fontsize=FONTSIZE,
-        bbox_to_anchor=(0.5, 1.07),
-        handletextpad=0.3,
-        columnspacing=0.7,
-    )
-    for handle in legend.legend_handles:
-        handle.set_alpha(1.0)
+    if plot:
+        handles, labels = axes[-1][-1].get_legend_handles_labels()
+        # delete x-axis labels for all but the bottom row
+        for i in range(num_cols):
+            for j in range(num_rows):
+                if j != num_rows - 1:
+                    axes[j][i].set_xlabel("")
+                if i != 0:
+                    axes[j][i].set_ylabel("")
+
+                axes[j][i].legend().remove()
+
+        fig.tight_layout(w_pad=0.01)
+        legend = fig.legend(
+            handles,
+            labels,
+            loc="upper center",
+            ncol=10,
+            fontsize=FONTSIZE,
+            bbox_to_anchor=(0.5, 1.07),
+            handletextpad=0.3,
+            columnspacing=0.7,
+        )
+        for handle in legend.legend_handles:
+            handle.set_alpha(1.0)
 
-    fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
+        fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
 
     if args.output_path:
-        fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
+        import pandas as pd
+
         results_dict = {res.task_name: res.__dict__ for res in results}
         df = (
             pd.DataFrame.from_dict(results_dict, orient="index")
@@ -2,15 +2,12 @@
 
 import argparse
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-import seaborn as sns
 from step1_flops import fit_step1
 from step2 import fit_step2
 from step2_mc import fit_step2 as fit_step2_mc
 
-from scaling.fitting_functions import chinchilla_flops_fit, log_sigmoid, sigmoid
+from scaling.fitting_functions import chinchilla_flops_fit, predict_chained_fit
 from scaling.utils import (
     get_final_configs,
     get_step1_data_by_name,
@@ -90,6 +87,11 @@ def parse_args():
     parser.add_argument(
         "--use_log_sigmoid", action="store_true", help="Use log sigmoid for fitting"
     )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Skip the figure and only write the results (csv) next to the output path",
+    )
     args = parser.parse_args()
 
     args.keys = get_task_sets(args.keys)
@@ -107,18 +109,16 @@ def predict_chained_flops(data_by_name, step1_coefficients, step2_coefficients):
     for name, data in data_by_name.items():
         predicted_data_by_name[name] = {
             "fs": data["fs"],
-            "ys": [
-                sigmoid(chinchilla_flops_fit(f, step1_coefficients), *step2_coefficients)
-                for f in data["fs"]
-            ],
+            "ys": predict_chained_fit(
+                data["fs"], step1_coefficients, step2_coefficients, chinchilla_flops_fit
+            )[1],
         }
         fs = np.exp(np.linspace(np.log(fmin), np.log(fmax), 100))
         plotted_predicted_data_by_name[name] = {
             "fs": fs,
-            "ys": [
-                sigmoid(chinchilla_flops_fit(f, step1_coefficients), *step2_coefficients)
-                for f in fs
-            ],
+            "ys": predict_chained_fit(
+                fs, step1_coefficients, step2_coefficients, chinchilla_flops_fit
+            )[1],
         }
 
         if data["mode"] == "eval":
@@ -143,8 +143,13 @@ def plot_chained(
     plotted_predicted_data_by_name,
     task_name,
     fit_str,
-    ax=plt.gca(),
+    ax=None,
 ):
+    if ax is None:
+        import matplotlib.pyplot as plt
+
+        ax = plt.gca()
+
     # plot the fitted curve
     for name, data in plotted_predicted_data_by_name.items():
         config = configs[name]
@@ -218,13 +223,19 @@ def main():
     else:
         step2_configs = configs
 
-    sns.set_style("whitegrid")
+    # plotting libraries are only imported when a figure is made
+    plot = args.output_path and not args.headless
     num_tasks = len(args.keys)
     num_cols = min(4, num_tasks)
     num_rows = (num_tasks + num_cols - 1) // num_cols
-    fig, axes = plt.subplots(
-        num_rows, num_cols, figsize=(2.75 * num_cols, 2.25 * num_rows), squeeze=False
-    )
+    if plot:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        sns.set_style("whitegrid")
+        fig, axes = plt.subplots(
+            num_rows, num_cols, figsize=(2.75 * num_cols, 2.25 * num_rows), squeeze=False
+        )
 
     results = {}
     results_str = "Task Name | Prediction | Actual | Rel Error"
@@ -265,15 +276,16 @@ def main():
             (y, y_pred, rel_error),
         ) = predict_chained_flops(single_step_data_by_name, step1_coefficients, step2_coefficients)
 
-        plot_chained(
-            configs,
-            single_step_data_by_name,
-            predicted_data_by_name,
-            plotted_predicted_data_by_name,
-            task_name,
-            str_chained_fit(step1_coefficients, step2_coefficients),
-            axes[r // num_cols][r % num_cols],
-        )
+        if plot:
+            plot_chained(
+                configs,
+                single_step_data_by_name,
+                predicted_data_by_name,
+                plotted_predicted_data_by_name,
+                task_name,
+                str_chained_fit(step1_coefficients, step2_coefficients),
+                axes[r // num_cols][r % num_cols],
+            )
 
         # make predictions
         if args.n == 6887575552:
@@ -281,9 +293,13 @@ def main():
         elif args.n == 13202396160:
             f = MODEL_FLOPS["13B"]
 
-        pred_loss = chinchilla_flops_fit(f * args.d, step1_coefficients)
-        fit_fn = log_sigmoid if args.use_log_sigmoid else sigmoid
-        pred_acc = fit_fn(pred_loss, *step2_coefficients)  # type: ignore
+        pred_loss, pred_acc = predict_chained_fit(
+            f * args.d,
+            step1_coefficients,
+            step2_coefficients,
+            chinchilla_flops_fit,
+            use_log_sigmoid=args.use_log_sigmoid,
+        )
         if args.target_name:
             data = step2_data_by_name[args.target_name]
             actual_acc = data["ys"][-1]
@@ -293,35 +309,36 @@ def main():
         else:
             results_str += f"\n{task_name} | {pred_acc * 100:.1f} | - | -"
 
-    handles, labels = axes[-1][-1].get_legend_handles_labels()
-    # delete x-axis labels for all but the bottom row
-    for i in range(num_cols):
-        for j in range(num_rows):
-            if j != num_rows - 1:
-                axes[j][i].set_xlabel("")
-            if i != 0:
-                axes[j][i].set_ylabel("")
-
-            axes[j][i].legend().remove()
-
-    fig.tight_layout(w_pad=0.01)
-    legend = fig.legend(
-        handles,
-        labels,
-        loc="upper center",
-        ncol=10,
-        fontsize=FONTSIZE,
-        bbox_to_anchor=(0.5, 1.07),
-        handletextpad=0.3,
-        columnspacing=0.7,
-    )
-    for handle in legend.legend_handles:
-        handle.set_alpha(1.0)
-
-    # fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
+    if plot:
+        handles, labels = axes[-1][-1].get_legend_handles_labels()
+        # delete x-axis labels for all but the bottom row
+        for i in range(num_cols):
+            for j in range(num_rows):
+                if j != num_rows - 1:
+                    axes[j][i].set_xlabel("")
+                if i != 0:
+                    axes[j][i].set_ylabel("")
+
+                axes[j][i].legend().remove()
+
+        fig.tight_layout(w_pad=0.01)
+        legend = fig.legend(
+            handles,
+            labels,
+            loc="upper center",
+            ncol=10,
+            fontsize=FONTSIZE,
+            bbox_to_anchor=(0.5, 1.07),
+            handletextpad=0.3,
+            columnspacing=0.7,
+        )
+        for handle in legend.legend_handles:
+            handle.set_alpha(1.0)
+        fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
 
     if args.output_path:
-        fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
+        import pandas as pd
+
         df = (
             pd.DataFrame.from_dict(results, orient="index")
             .reset_index()
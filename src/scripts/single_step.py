@@ -2,19 +2,20 @@
 
 import argparse
 
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
+from pipeline import map_tasks
 
 from scaling.fitting_functions import (
     combined_fit,
     get_coefficients_huber,
     grad_combined_fit,
+    predict_fit,
 )
 from scaling.utils import (
     get_final_configs,
     get_step1_data_by_name,
     get_task_sets,
+    get_train_columns,
     prettify,
     tasks,
 )
@@ -31,6 +32,14 @@ def parse_args():
     parser.add_argument(
         "-o", "--output-path", type=str, required=True, help="Path to write output figure"
     )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes to fit tasks in parallel"
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Skip the figure and only print the results",
+    )
     args = parser.parse_args()
 
     args.keys = get_task_sets(args.keys)
@@ -39,11 +48,8 @@ def parse_args():
 
 
 def fit_single_step(data_by_name, task_name):
-    train_nds, train_ys = [], []
-    for name, data in data_by_name.items():
-        if data["mode"] == "train":
-            train_nds += [[n, d] for n, d in zip(data["ns"], data["ds"])]
-            train_ys += data["xs"]
+    train_ns, train_ds, train_ys = get_train_columns(data_by_name, "ns", "ds", "xs")
+    train_nds = np.stack([train_ns, train_ds], axis=1)
 
     p0 = [3.0, 5.0, 0.2, 0.3, 0.0, tasks[task_name].task_minimum - 1.0, 1.0]
     # bounds = [(0, 10), (0, 10), (0, 1), (0, 1), (-10, 10), (-0.9999, 0), (0, 1)]
@@ -72,13 +78,12 @@ def predict_single_step(data_by_name, coefficients):
     for name, data in data_by_name.items():
         predicted_data_by_name[name] = {
             "ds": data["ds"],
-            "ys": [combined_fit([n, d], coefficients) for n, d in zip(data["ns"], data["ds"])],
+            "ys": predict_fit(combined_fit, [data["ns"], data["ds"]], coefficients),
         }
         ds = np.exp(np.linspace(np.log(dmin), np.log(dmax), 100))
-        ns = [data["ns"][0]] * len(ds)
         plotted_predicted_data_by_name[name] = {
             "ds": ds,
-            "ys": [combined_fit([n, d], coefficients) for n, d in zip(ns, ds)],
+            "ys": predict_fit(combined_fit, [data["ns"][0], ds], coefficients),
         }
 
         if data["mode"] == "eval":
@@ -102,8 +107,13 @@ def plot_single_step(
     plotted_predicted_data_by_name,
     task_name,
     fit_str,
-    ax=plt.gca(),
+    ax=None,
 ):
+    if ax is None:
+        import matplotlib.pyplot as plt
+
+        ax = plt.gca()
+
     # plot the fitted curve
     for name, data in plotted_predicted_data_by_name.items():
         config = configs[name]
@@ -171,31 +181,41 @@ def plot_single_step(
     )
 
 
+def load_and_fit(configs, moving_avg, task_name):
+    data_by_name = get_step1_data_by_name(
+        configs, task_name, y_metric="rc_acc", moving_avg=moving_avg
+    )
+
+    for name, data in data_by_name.items():
+        data["ys"] = data["xs"]  # to deal with refactor
+
+    # fit the parameters
+    coefficients = fit_single_step(data_by_name, task_name)
+    return data_by_name, coefficients
+
+
 def main():
     args = parse_args()
     configs = get_final_configs(args.config_path)
 
-    sns.set_style("whitegrid")
+    # plotting libraries are only imported when a figure is made
+    plot = args.output_path and not args.headless
     num_tasks = len(args.keys)
     num_cols = min(4, num_tasks)
     num_rows = (num_tasks + num_cols - 1) // num_cols
-    fig, axes = plt.subplots(
-        num_rows, num_cols, figsize=(2.75 * num_cols, 2.25 * num_rows), squeeze=False
-    )
-
-    results = "Task Name | Actual Value | Predicted Value | Absolute Error | Relative Error"
+    if plot:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
 
-    for i, task_name in enumerate(args.keys):
-        data_by_name = get_step1_data_by_name(
-            configs, task_name, y_metric="rc_acc", moving_avg=args.moving_avg
+        sns.set_style("whitegrid")
+        fig, axes = plt.subplots(
+            num_rows, num_cols, figsize=(2.75 * num_cols, 2.25 * num_rows), squeeze=False
         )
 
-        for name, data in data_by_name.items():
-            data["ys"] = data["xs"]  # to deal with refactor
-
-        # fit the parameters
-        coefficients = fit_single_step(data_by_name, task_name)
+    results = "Task Name | Actual Value | Predicted Value | Absolute Error | Relative Error"
 
+    fits = map_tasks(load_and_fit, args.keys, args.workers, configs, args.moving_avg)
+    for i, (task_name, (data_by_name, coefficients)) in enumerate(zip(args.keys, fits)):
         # make predictions
         (
             predicted_data_by_name,
@@ -204,42 +224,44 @@ def main():
         ) = predict_single_step(data_by_name, coefficients)
         results += f"\n{task_name} | {prettify(y, False)} | {prettify(y_pred, False)} | {prettify(abs(y_pred - y), False)} | {prettify(rel_error)}"
 
-        plot_single_step(
-            configs,
-            data_by_name,
-            predicted_data_by_name,
-            plotted_predicted_data_by_name,
-            task_name,
-            str_combined_fit(coefficients),
-            axes[i // num_cols][i % num_cols],
-        )
+        if plot:
+            plot_single_step(
+                configs,
+                data_by_name,
+                predicted_data_by_name,
+                plotted_predicted_data_by_name,
+                task_name,
+                str_combined_fit(coefficients),
+                axes[i // num_cols][i % num_cols],
+            )
 
-    handles, labels = axes[-1][-1].get_legend_handles_labels()
-    # delete x-axis labels for all but the bottom row
-    for i in range(num_cols):
-        for j in range(num_rows):
-            if j != num_rows - 1:
-                axes[j][i].set_xlabel("")
-            if i != 0:
-                axes[j][i].set_ylabel("")
-
-            axes[j][i].legend().remove()
-
-    fig.tight_layout(w_pad=0.01)
-    legend = fig.legend(
-        handles,
-        labels,
-        loc="upper center",
-        ncol=10,
-        fontsize=FONTSIZE,
-        bbox_to_anchor=(0.5, 1.07),
-        handletextpad=0.3,
-        columnspacing=0.7,
-    )
-    for handle in legend.legend_handles:
-        handle.set_alpha(1.0)
+    if plot:
+        handles, labels = axes[-1][-1].get_legend_handles_labels()
+        # delete x-axis labels for all but the bottom row
+        for i in range(num_cols):
+            for j in range(num_rows):
+                if j != num_rows - 1:
+                    axes[j][i].set_xlabel("")
+                if i != 0:
+                    axes[j][i].set_ylabel("")
+
+                axes[j][i].legend().remove()
+
+        fig.tight_layout(w_pad=0.01)
+        legend = fig.legend(
+            handles,
+            labels,
+            loc="upper center",
+            ncol=10,
+            fontsize=FONTSIZE,
+            bbox_to_anchor=(0.5, 1.07),
+            handletextpad=0.3,
+            columnspacing=0.7,
+        )
+        for handle in legend.legend_handles:
+            handle.set_alpha(1.0)
 
-    fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
+        fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
 
     print(results)
 
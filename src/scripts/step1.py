@@ -7,27 +7,32 @@ import argparse
 import os
 from typing import Any, List, Tuple
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-import seaborn as sns
+from pipeline import Pipeline
 
 from scaling.fitting_functions import (
     chinchilla_n_d_fit,
     chinchilla_n_d_negated_fit,
     get_coefficients_huber,
+    get_coefficients_huber_multistart,
+    get_coefficients_least_squares,
+    get_coefficients_varpro,
+    get_huber_covariance,
+    get_latin_hypercube_initializations,
     grad_chinchilla_n_d_fit,
     grad_chinchilla_n_d_negated_fit,
+    grid_search_chinchilla_n_d_fit,
+    predict_fit,
 )
 from scaling.utils import (
     TaskFittingResults,
-    get_final_configs,
-    get_step1_data_by_name,
     get_task_sets,
+    get_train_columns,
     print_results_table,
     tasks,
 )
 
+GRID_SIZE = 51  # per exponent, for --grid_search
 MARKERS = {"0.5xC": "D", "1xC": "s", "2xC": "P", "5xC": "p", "10xC": "*"}
 FONTSIZE = 9
 
@@ -43,10 +48,40 @@ def parse_args():
         help="Metric to predict",
     )
     parser.add_argument("--moving_avg", type=int, default=1, help="Moving average for bpb loss")
+    parser.add_argument(
+        "--num_starts",
+        type=int,
+        default=1,
+        help="Number of Latin-hypercube initializations for a multi-start fit (1 = single start)",
+    )
+    parser.add_argument(
+        "--varpro",
+        action="store_true",
+        help="Fit the (N, D) power law by variable projection (loss metrics only)",
+    )
+    parser.add_argument(
+        "--solver",
+        default="lbfgs",
+        choices=["lbfgs", "trf"],
+        help="Huber fit on the scalar loss (L-BFGS-B) or on the residuals (least_squares TRF)",
+    )
+    parser.add_argument(
+        "--grid_search",
+        action="store_true",
+        help="Fit the (N, D) power law from an (alpha, beta) grid search (loss metrics only)",
+    )
     parser.add_argument("-c", "--config-path", type=str, required=True, help="Path to config file")
     parser.add_argument(
         "-o", "--output-path", type=str, required=False, help="Path to write output figure"
     )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes to fit tasks in parallel"
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Skip the figure and only write the results (csv) next to the output path",
+    )
     args = parser.parse_args()
 
     if not args.keys:
@@ -56,46 +91,126 @@ def parse_args():
     return args
 
 
-def fit_step1(data_by_name, y_metric):
-    train_nds, train_ys = [], []
-    for name, data in data_by_name.items():
-        if data["mode"] == "train":
-            train_nds += [[n, d] for n, d in zip(data["ns"], data["ds"])]
-            train_ys += data["xs"]
+def _get_coefficients_huber(
+    train_nds, train_ys, fitting_func, grad_func, p0, bounds, ranges, num_starts, solver="lbfgs"
+):
+    if num_starts > 1:
+        p0s = get_latin_hypercube_initializations(ranges, num_starts)
+        coefficients, cov, _ = get_coefficients_huber_multistart(
+            train_nds,
+            train_ys,
+            fitting_func,
+            grad_func,
+            p0s=np.concatenate([[p0], p0s]),
+            bounds=bounds,
+            max_iter=1000000,
+            disp=False,
+            return_cov=True,
+        )
+        return coefficients, cov
+    if solver == "trf":
+        return get_coefficients_least_squares(
+            train_nds,
+            train_ys,
+            fitting_func,
+            grad_func,
+            p0=p0,
+            bounds=bounds,
+            disp=False,
+            return_cov=True,
+        )
+    return get_coefficients_huber(
+        train_nds,
+        train_ys,
+        fitting_func,
+        grad_func,
+        p0=p0,
+        bounds=bounds,
+        max_iter=1000000,
+        disp=False,
+        return_cov=True,
+        vectorized=True,
+    )
+
+
+def fit_step1(
+    data_by_name,
+    y_metric,
+    num_starts=1,
+    varpro=False,
+    p0=None,
+    solver="lbfgs",
+    grid_search=False,
+):
+    if grid_search and (varpro or num_starts > 1 or solver != "lbfgs"):
+        raise ValueError("grid_search cannot be combined with varpro, num_starts or solver")
+    if varpro and (num_starts > 1 or solver != "lbfgs"):
+        raise ValueError("varpro cannot be combined with num_starts or solver")
+    train_ns, train_ds, train_ys = get_train_columns(data_by_name, "ns", "ds", "xs")
+    train_nds = np.stack([train_ns, train_ds], axis=1)
 
     bounds: List[Tuple[Any, Any]]
 
+    # p0 can be passed in to warm-start the fit, e.g. from the full-data coefficients
     if y_metric == "rc_bpb" or y_metric == "c4" or y_metric == "rc_soft_log":
-        p0 = [3.0, 6.0, 0.1, 0.2, 1.0]
+        p0 = [3.0, 6.0, 0.1, 0.2, 1.0] if p0 is None else p0
         bounds = [(0, None), (0, None), (0, None), (0, None), (0, None)]
         # p0 = [3.0, 6.0, 0.25, 0.3, 1.0]
         # bounds = [(0, None), (0, None), (0.25, 0.4), (0.19, 0.31), (0, None)] # moving_avg=1
         # # bounds = [(0, None), (0, None), (0, 0.3), (0.25, 0.45), (0, None)] # moving_avg=10
         # # bounds = [(0, None), (0, None), (0.15, 0.4), (0.3, 0.33), (0, None)]
-        coefficients, cov = get_coefficients_huber(
-            train_nds,
-            train_ys,
-            chinchilla_n_d_fit,
-            grad_chinchilla_n_d_fit,
-            p0=p0,
-            bounds=bounds,
-            max_iter=1000000,
-            disp=False,
-            return_cov=True,
-        )
+        ranges = [(0, 15), (0, 15), (0, 1), (0, 1), (0, 2)]  # sampled for multi-start fits
+        if grid_search:
+            coefficients = grid_search_chinchilla_n_d_fit(
+                train_nds,
+                train_ys,
+                alphas=np.linspace(*ranges[2], GRID_SIZE),
+                betas=np.linspace(*ranges[3], GRID_SIZE),
+                bounds=bounds,
+                max_iter=1000000,
+                disp=False,
+            )
+            cov = get_huber_covariance(
+                train_nds, train_ys, chinchilla_n_d_fit, grad_chinchilla_n_d_fit, coefficients
+            )
+        elif varpro:
+            coefficients, cov = get_coefficients_varpro(
+                train_nds,
+                train_ys,
+                exponents0=p0[2:4],
+                bounds=bounds,
+                max_iter=1000000,
+                disp=False,
+                return_cov=True,
+            )
+        else:
+            coefficients, cov = _get_coefficients_huber(
+                train_nds,
+                train_ys,
+                chinchilla_n_d_fit,
+                grad_chinchilla_n_d_fit,
+                p0,
+                bounds,
+                ranges,
+                num_starts,
+                solver,
+            )
     elif y_metric == "rc_acc":
-        p0 = [2.0, 2.0, 0.2, 0.2, 1.0]
+        if grid_search or varpro:
+            raise ValueError("grid_search and varpro are only supported for the loss metrics")
+        p0 = [2.0, 2.0, 0.2, 0.2, 1.0] if p0 is None else p0
         bounds = [(0, None), (0, None), (0, None), (None, None), (None, None)]
-        coefficients, cov = get_coefficients_huber(
+        ranges = [(0, 10), (0, 10), (0, 1), (0, 1), (0, 2)]
+        coefficients, cov = _get_coefficients_huber(
             train_nds,
             train_ys,
             chinchilla_n_d_negated_fit,
             grad_chinchilla_n_d_negated_fit,
-            p0=p0,
-            bounds=bounds,
-            max_iter=1000000,
-            disp=False,
-            return_cov=True,
+            p0,
+            bounds,
+            ranges,
+            num_starts,
+            solver,
         )
     else:
         raise ValueError(f"Unknown y_metric: {y_metric}")
@@ -135,13 +250,12 @@ def predict_step1(configs, data_by_name, coefficients, y_metric):
     for name, data in data_by_name.items():
         predicted_data_by_name[name] = {
             "ds": data["ds"],
-            "xs": [func([n, d], coefficients) for n, d in zip(data["ns"], data["ds"])],
+            "xs": predict_fit(func, [data["ns"], data["ds"]], coefficients),
         }
         ds = np.exp(np.linspace(np.log(dmin), np.log(dmax), 100))
-        ns = [data["ns"][0]] * len(ds)
         plotted_predicted_data_by_name[name] = {
             "ds": ds,
-            "xs": [func([n, d], coefficients) for n, d in zip(ns, ds)],
+            "xs": predict_fit(func, [data["ns"][0], ds], coefficients),
         }
 
         if configs[name].mode == "eval":
@@ -180,8 +294,13 @@ def plot_step1(
     y_metric,
     coefficients,
     cov,
-    ax=plt.gca(),
+    ax=None,
 ):
+    if ax is None:
+        import matplotlib.pyplot as plt
+
+        ax = plt.gca()
+
     # plot the fitted curve
     for name, data in plotted_predicted_data_by_name.items():
         config = configs[name]
@@ -264,14 +383,29 @@ def plot_step1(
 
 def main():
     args = parse_args()
-    configs = get_final_configs(args.config_path)
+    pipeline = Pipeline(
+        args.config_path,
+        x_metric=args.y_metric,
+        moving_avg=args.moving_avg,
+        num_starts=args.num_starts,
+        varpro=args.varpro,
+        solver=args.solver,
+        grid_search=args.grid_search,
+    )
+    configs = pipeline.configs
+    pipeline.run(args.keys, stages=["fit_step1"], workers=args.workers)
 
-    sns.set_style("whitegrid")
+    # plotting libraries are only imported when a figure is made
+    plot = args.output_path and not args.headless
     num_tasks = len(args.keys)
     num_cols = min(4, num_tasks)
     num_rows = (num_tasks + num_cols - 1) // num_cols
 
-    if args.output_path:
+    if plot:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        sns.set_style("whitegrid")
         fig, axes = plt.subplots(
             num_rows, num_cols, figsize=(2.75 * num_cols, 2.25 * num_rows), squeeze=False
         )
@@ -279,12 +413,8 @@ def main():
     results = []
 
     for i, task_name in enumerate(args.keys):
-        data_by_name = get_step1_data_by_name(
-            configs, task_name, y_metric=args.y_metric, moving_avg=args.moving_avg
-        )
-
-        # fit the parameters
-        coefficients, cov = fit_step1(data_by_name, args.y_metric)
+        fit = pipeline.fit_step1(task_name)
+        data_by_name, coefficients, cov = fit.data_by_name, fit.coefficients, fit.cov
 
         # make predictions
         (
@@ -306,7 +436,7 @@ def main():
             )
         )
 
-        if args.output_path:
+        if plot:
             plot_step1(
                 configs,
                 data_by_name,
@@ -320,43 +450,49 @@ def main():
                 axes[i // num_cols][i % num_cols],
             )
 
-    handles, labels = axes[-1][-1].get_legend_handles_labels()
-    # delete x-axis labels for all but the bottom row
-    for i in range(num_cols):
-        for j in range(num_rows):
-            if j != num_rows - 1:
-                axes[j][i].set_xlabel("")
-            if i != 0:
-                axes[j][i].set_ylabel("")
-
-            axes[j][i].legend().remove()
-
-    fig.tight_layout(w_pad=0.01)
-    if num_tasks > 1:
-        legend = fig.legend(
-            handles,
-            labels,
-            loc="upper center",
-            ncol=10,
-            fontsize=FONTSIZE,
-            bbox_to_anchor=(0.5, 1.07),
-            handletextpad=0.3,
-            columnspacing=0.7,
-        )
-    else:
-        legend = fig.legend(
-            handles,
-            labels,
-            loc="upper center",
-            ncol=1,
-            fontsize=FONTSIZE,
-            bbox_to_anchor=(1.3, 0.9),
-            handletextpad=0.1,
-            columnspacing=0.7,
-        )
+    if plot:
+        handles, labels = axes[-1][-1].get_legend_handles_labels()
+        # delete x-axis labels for all but the bottom row
+        for i in range(num_cols):
+            for j in range(num_rows):
+                if j != num_rows - 1:
+                    axes[j][i].set_xlabel("")
+                if i != 0:
+                    axes[j][i].set_ylabel("")
+
+                axes[j][i].legend().remove()
+
+        fig.tight_layout(w_pad=0.01)
+        if num_tasks > 1:
+            legend = fig.legend(
+                handles,
+                labels,
+                loc="upper center",
+                ncol=10,
+                fontsize=FONTSIZE,
+                bbox_to_anchor=(0.5, 1.07),
+                handletextpad=0.3,
+                columnspacing=0.7,
+            )
+        else:
+            legend = fig.legend(
+                handles,
+                labels,
+                loc="upper center",
+                ncol=1,
+                fontsize=FONTSIZE,
+                bbox_to_anchor=(1.3, 0.9),
+                handletextpad=0.1,
+                columnspacing=0.7,
+            )
+
+        for handle in legend.legend_handles:
+            handle.set_alpha(1.0)
 
-    for handle in legend.legend_handles:
-        handle.set_alpha(1.0)
+        os.makedirs(os.path.dirname(args.output_path), exist_ok=True)
+        fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
+
+    import pandas as pd
 
     results_dict = {res.task_name: res.__dict__ for res in results}
     df = (
@@ -367,7 +503,6 @@ def main():
 
     if args.output_path:
         os.makedirs(os.path.dirname(args.output_path), exist_ok=True)
-        fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
         df.to_csv(args.output_path.replace(".pdf", ".csv").replace(".png", ".csv"), index=False)
 
     print_results_table(results, show_fitted_function=True)
@@ -2,19 +2,19 @@
 
 import argparse
 
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
 
 from scaling.fitting_functions import (
     chinchilla_flops_fit,
     get_coefficients_huber,
     grad_chinchilla_flops_fit,
+    predict_fit,
 )
 from scaling.utils import (
     get_final_configs,
     get_step1_data_by_name,
     get_task_sets,
+    get_train_columns,
     prettify,
     tasks,
 )
@@ -34,6 +34,11 @@ def parse_args():
     parser.add_argument(
         "-o", "--output-path", type=str, required=False, help="Path to write output figure"
     )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Skip the figure and only print the results",
+    )
     args = parser.parse_args()
 
     if not args.keys:
@@ -44,11 +49,7 @@ def parse_args():
 
 
 def fit_step1(data_by_name, y_metric):
-    train_fs, train_xs = [], []
-    for name, data in data_by_name.items():
-        if data["mode"] == "train":
-            train_fs += data["fs"]
-            train_xs += data["xs"]
+    train_fs, train_xs = get_train_columns(data_by_name, "fs", "xs")
 
     if y_metric == "rc_bpb":
         p0 = [3.0, 0.1, 1.0]
@@ -62,6 +63,7 @@ def fit_step1(data_by_name, y_metric):
             bounds=bounds,
             max_iter=1000000,
             disp=False,
+            vectorized=True,
             return_cov=True,
         )
     else:
@@ -100,12 +102,12 @@ def predict_step1(configs, data_by_name, coefficients, y_metric):
     for name, data in data_by_name.items():
         predicted_data_by_name[name] = {
             "fs": data["fs"],
-            "xs": [func(f, coefficients) for f in data["fs"]],
+            "xs": predict_fit(func, data["fs"], coefficients),
         }
         fs = np.exp(np.linspace(np.log(fmin), np.log(fmax), 100))
         plotted_predicted_data_by_name[name] = {
             "fs": fs,
-            "xs": [func(f, coefficients) for f in fs],
+            "xs": predict_fit(func, fs, coefficients),
         }
 
         if configs[name].mode == "eval":
@@ -142,8 +144,13 @@ def plot_step1(
     y_metric,
     coefficients,
     cov,
-    ax=plt.gca(),
+    ax=None,
 ):
+    if ax is None:
+        import matplotlib.pyplot as plt
+
+        ax = plt.gca()
+
     # fmin = min(min(data["fs"]) for data in plotted_predicted_data_by_name.values())
     # fmax = max(max(data["fs"]) for data in plotted_predicted_data_by_name.values())
     # fs = np.linspace(fmin, fmax, 100)
@@ -244,14 +251,19 @@ def main():
     args = parse_args()
     configs = get_final_configs(args.config_path)
 
-    sns.set_style("whitegrid")
+    # plotting libraries are only imported when a figure is made
+    plot = args.output_path and not args.headless
     num_tasks = len(args.keys)
     num_cols = min(4, num_tasks)
     num_rows = (num_tasks + num_cols - 1) // num_cols
 
     fitting_error = 0
 
-    if args.output_path:
+    if plot:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        sns.set_style("whitegrid")
         fig, axes = plt.subplots(
             num_rows, num_cols, figsize=(2.75 * num_cols, 2.25 * num_rows), squeeze=False
         )
@@ -281,7 +293,7 @@ def main():
 
         results += f"\n{task_name} | {prettify(y, False)} | {prettify(y_pred, False)} | {prettify(rel_error)} | {prettify(avg_unsigned_rel_error)}"
 
-        if args.output_path:
+        if plot:
             plot_step1(
                 configs,
                 data_by_name,
@@ -295,32 +307,31 @@ def main():
                 axes[i // num_cols][i % num_cols],
             )
 
-    handles, labels = axes[-1][-1].get_legend_handles_labels()
-    # delete x-axis labels for all but the bottom row
-    for i in range(num_cols):
-        for j in range(num_rows):
-            if j != num_rows - 1:
-                axes[j][i].set_xlabel("")
-            if i != 0:
-                axes[j][i].set_ylabel("")
-
-            axes[j][i].legend().remove()
-
-    fig.tight_layout(w_pad=0.01)
-    legend = fig.legend(
-        handles,
-        labels,
-        loc="upper center",
-        ncol=10,
-        fontsize=FONTSIZE,
-        bbox_to_anchor=(0.5, 1.07),
-        handletextpad=0.3,
-        columnspacing=0.7,
-    )
-    for handle in legend.legend_handles:
-        handle.set_alpha(1.0)
-
-    if args.output_path:
+    if plot:
+        handles, labels = axes[-1][-1].get_legend_handles_labels()
+        # delete x-axis labels for all but the bottom row
+        for i in range(num_cols):
+            for j in range(num_rows):
+                if j != num_rows - 1:
+                    axes[j][i].set_xlabel("")
+                if i != 0:
+                    axes[j][i].set_ylabel("")
+
+                axes[j][i].legend().remove()
+
+        fig.tight_layout(w_pad=0.01)
+        legend = fig.legend(
+            handles,
+            labels,
+            loc="upper center",
+            ncol=10,
+            fontsize=FONTSIZE,
+            bbox_to_anchor=(0.5, 1.07),
+            handletextpad=0.3,
+            columnspacing=0.7,
+        )
+        for handle in legend.legend_handles:
+            handle.set_alpha(1.0)
         fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
 
     print(results)
@@ -4,10 +4,8 @@
 
 import argparse
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-import seaborn as sns
+from pipeline import Pipeline
 
 from scaling.fitting_functions import (
     get_coefficients,
@@ -16,14 +14,14 @@ from scaling.fitting_functions import (
     grad_sigmoid_fit,
     log_sigmoid,
     log_sigmoid_fit,
+    predict_sigmoid,
     sigmoid,
     sigmoid_fit,
 )
 from scaling.utils import (
     TaskFittingResults,
-    get_final_configs,
-    get_step2_data_by_name,
     get_task_sets,
+    get_train_columns,
     print_results_table,
     tasks,
 )
@@ -56,20 +54,23 @@ def parse_args():
         "-o", "--output-path", type=str, required=True, help="Path to write output figure"
     )
     parser.add_argument("--use_log_sigmoid", action="store_true", help="Use log sigmoid instead")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes to fit tasks in parallel"
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Skip the figure and only write the results (csv) next to the output path",
+    )
     args = parser.parse_args()
 
     return args
 
 
-def fit_step2(data_by_name, task_name, y_metric, _min=None, _max=None, use_log_sigmoid=False):
-    train_xs, train_ys = [], []
-    for name, data in data_by_name.items():
-        if data["mode"] == "train":
-            train_xs += data["xs"]
-            train_ys += data["ys"]
-        else:
-            data["xs"] = data["xs"][-1:]
-            data["ys"] = data["ys"][-1:]
+def fit_step2(
+    data_by_name, task_name, y_metric, _min=None, _max=None, use_log_sigmoid=False, p0=None
+):
+    train_xs, train_ys = (values.tolist() for values in get_train_columns(data_by_name, "xs", "ys"))
 
     if _max is None:
         _max = tasks[task_name].task_maximum
@@ -83,13 +84,13 @@ def fit_step2(data_by_name, task_name, y_metric, _min=None, _max=None, use_log_s
         # train_xs.append(max(train_xs))
         # train_ys.append(tasks[task_name].task_minimum)
 
-    # fit the parameters
+    # fit the parameters (p0 can be passed in to warm-start the fit)
     if use_log_sigmoid:
         coefficients, cov = get_coefficients(
             train_xs,
             train_ys,
             log_sigmoid,
-            p0=[-0.1, 0.9, 3.0],
+            p0=[-0.1, 0.9, 3.0] if p0 is None else p0,
             bounds=([-np.inf, 0.0, 0.0], [0.0, np.inf, np.inf]),
             disp=False,
             return_cov=True,
@@ -99,7 +100,7 @@ def fit_step2(data_by_name, task_name, y_metric, _min=None, _max=None, use_log_s
             train_xs,
             train_ys,
             sigmoid,
-            p0=[_min - 1.0, 0.9, 3.0, _max],
+            p0=[_min - 1.0, 0.9, 3.0, _max] if p0 is None else p0,
             bounds=([-1.0, 0.0, 0.0, 0.0], [0.0, np.inf, np.inf, 1.0]),
             # bounds=([tasks[task_name].task_minimum - 1.0, 0.0, 0.0, tasks[task_name].task_maximum - 0.0001], [tasks[task_name].task_minimum - 0.9999, np.inf, np.inf, tasks[task_name].task_maximum]),
             disp=False,
@@ -110,8 +111,6 @@ def fit_step2(data_by_name, task_name, y_metric, _min=None, _max=None, use_log_s
 
 
 def predict_step2(configs, data_by_name, coefficients, cov, y_metric, use_log_sigmoid=False):
-    predict_fn = log_sigmoid if use_log_sigmoid else sigmoid
-
     unsigned_rel_errors = []
 
     predicted_data_by_name = {}
@@ -119,7 +118,7 @@ def predict_step2(configs, data_by_name, coefficients, cov, y_metric, use_log_si
         config = configs[name]
         predicted_data_by_name[name] = {
             "xs": data["xs"],
-            "ys": [predict_fn(x, *coefficients) for x in data["xs"]],  # type: ignore
+            "ys": predict_sigmoid(data["xs"], coefficients, use_log_sigmoid),
         }
         if config.mode == "eval":
             e_y = data["ys"][-1]
@@ -139,7 +138,7 @@ def predict_step2(configs, data_by_name, coefficients, cov, y_metric, use_log_si
     xs = np.linspace(xmin, xmax, 100)
     plotted_predicted_data = {
         "xs": xs,
-        "ys": [predict_fn(x, *coefficients) for x in xs],  # type: ignore
+        "ys": predict_sigmoid(xs, coefficients, use_log_sigmoid),
     }
 
     return (
@@ -163,8 +162,13 @@ def plot_step2(
     cov,
     use_log_sigmoid=False,
     add_texts=False,
-    ax=plt.gca(),
+    ax=None,
 ):
+    if ax is None:
+        import matplotlib.pyplot as plt
+
+        ax = plt.gca()
+
     fit_fn = log_sigmoid_fit if use_log_sigmoid else sigmoid_fit
     grad_fit_fn = grad_log_sigmoid_fit if use_log_sigmoid else grad_sigmoid_fit
 
@@ -321,33 +325,38 @@ def str_sigmoid(coefficients, use_log_sigmoid=False):
 def main():
     args = parse_args()
 
-    configs = get_final_configs(args.config_path)
-
     args.keys = get_task_sets(args.keys)
 
-    sns.set_style("whitegrid")
+    pipeline = Pipeline(
+        args.config_path,
+        x_metric=args.x_metric,
+        y_metric=args.y_metric,
+        moving_avg=args.moving_avg,
+        skip_perc=args.skip_perc,
+        use_log_sigmoid=args.use_log_sigmoid,
+    )
+    configs = pipeline.configs
+    pipeline.run(args.keys, stages=["fit_step2"], workers=args.workers)
+
+    # plotting libraries are only imported when a figure is made
+    plot = args.output_path and not args.headless
     num_tasks = len(args.keys)
     num_cols = min(4, num_tasks)
     num_rows = (num_tasks + num_cols - 1) // num_cols
-    fig, axes = plt.subplots(
-        num_rows, num_cols, figsize=(2.75 * num_cols, 2.5 * num_rows), squeeze=False
-    )
+    if plot:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        sns.set_style("whitegrid")
+        fig, axes = plt.subplots(
+            num_rows, num_cols, figsize=(2.75 * num_cols, 2.5 * num_rows), squeeze=False
+        )
 
     results = []
 
     for i, task_name in enumerate(args.keys):
-        data_by_name = get_step2_data_by_name(
-            configs,
-            task_name,
-            x_metric=args.x_metric,
-            y_metric=args.y_metric,
-            moving_avg=args.moving_avg,
-            skip_perc=args.skip_perc,
-        )
-
-        coefficients, cov = fit_step2(
-            data_by_name, task_name, args.y_metric, use_log_sigmoid=args.use_log_sigmoid
-        )
+        fit = pipeline.fit_step2(task_name)
+        data_by_name, coefficients, cov = fit.data_by_name, fit.coefficients, fit.cov
         # a, x0, k, b = coefficients
 
         # make predictions
@@ -378,60 +387,65 @@ def main():
             )
         )
 
-        # plot the actual and predicted data
-        ax = axes[i // num_cols][i % num_cols]
+        if plot:
+            # plot the actual and predicted data
+            ax = axes[i // num_cols][i % num_cols]
+
+            plot_step2(
+                configs,
+                data_by_name,
+                predicted_data_by_name,
+                plotted_predicted_data,
+                task_name,
+                str_formula,
+                args.x_metric,
+                args.y_metric,
+                coefficients,
+                cov,
+                use_log_sigmoid=args.use_log_sigmoid,
+                ax=ax,
+            )
 
-        plot_step2(
-            configs,
-            data_by_name,
-            predicted_data_by_name,
-            plotted_predicted_data,
-            task_name,
-            str_formula,
-            args.x_metric,
-            args.y_metric,
-            coefficients,
-            cov,
-            use_log_sigmoid=args.use_log_sigmoid,
-            ax=ax,
-        )
+    if plot:
+        handles, labels = axes[-1][-1].get_legend_handles_labels()
+        # delete x-axis labels for all but the bottom row
+        for i in range(num_cols):
+            for j in range(num_rows):
+                if j != num_rows - 1:
+                    axes[j][i].set_xlabel("")
+                if i != 0:
+                    axes[j][i].set_ylabel("")
+
+                axes[j][i].legend().remove()
+
+        fig.tight_layout(w_pad=0.01)
+        if num_tasks > 1:
+            legend = fig.legend(
+                handles,
+                labels,
+                loc="upper center",
+                ncol=10,
+                fontsize=FONTSIZE,
+                bbox_to_anchor=(0.5, 1.07),
+                handletextpad=0.1,
+                columnspacing=0.7,
+            )
+        else:
+            legend = fig.legend(
+                handles,
+                labels,
+                loc="upper center",
+                ncol=1,
+                fontsize=FONTSIZE,
+                bbox_to_anchor=(1.4, 0.8),
+                handletextpad=0.1,
+                columnspacing=0.7,
+            )
+        for handle in legend.legend_handles:
+            handle.set_alpha(1.0)
+        fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
 
-    handles, labels = axes[-1][-1].get_legend_handles_labels()
-    # delete x-axis labels for all but the bottom row
-    for i in range(num_cols):
-        for j in range(num_rows):
-            if j != num_rows - 1:
-                axes[j][i].set_xlabel("")
-            if i != 0:
-                axes[j][i].set_ylabel("")
-
-            axes[j][i].legend().remove()
-
-    fig.tight_layout(w_pad=0.01)
-    if num_tasks > 1:
-        legend = fig.legend(
-            handles,
-            labels,
-            loc="upper center",
-            ncol=10,
-            fontsize=FONTSIZE,
-            bbox_to_anchor=(0.5, 1.07),
-            handletextpad=0.1,
-            columnspacing=0.7,
-        )
-    else:
-        legend = fig.legend(
-            handles,
-            labels,
-            loc="upper center",
-            ncol=1,
-            fontsize=FONTSIZE,
-            bbox_to_anchor=(1.4, 0.8),
-            handletextpad=0.1,
-            columnspacing=0.7,
-        )
-    for handle in legend.legend_handles:
-        handle.set_alpha(1.0)
+    import pandas as pd
 
     results_dict = {res.task_name: res.__dict__ for res in results}
     df = (
@@ -441,7 +455,6 @@ def main():
     )
 
     if args.output_path:
-        fig.savefig(args.output_path, dpi=300, bbox_inches="tight")
         df.to_csv(args.output_path.replace(".pdf", ".csv").replace(".png", ".csv"), index=False)
 
     print_results_table(results, show_fitted_function=True)
@@ -8,7 +8,6 @@
 
 import argparse
 import os
-import sys
 
 # Suppress matplot warnings from other curve-fitting functions
 import warnings
@@ -17,10 +16,10 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
-from predict import main as predict_main
+from pipeline import Pipeline, run_dag
 from scipy import stats
-from step1 import main as step1_main
-from step2 import main as step2_main
+from step1 import predict_step1
+from step2 import predict_step2
 
 from scaling.utils import (
     get_final_configs,
@@ -354,100 +353,65 @@ def compute_variance(configs, keys, last_n_points, variant="rc_bpb"):
 
 
 def run_two_step_prediction(keys_key, variant=None):
-    """Use subprocesses to run each stage of the ladder model"""
-    # Run predictions on 7B scale
-    orig_argv = sys.argv
-    original_stdout = sys.stdout
-    sys.stdout = open(os.devnull, "w")  # surpress printing
-
-    # Run step 1 only
-    step1_args = [
-        "-k",
-        keys_key,
-        "-c",
-        "src/scripts/paper/configs/final_7b_only.json",
-        "-o",
-        "/tmp/step1_main.pdf",
-        "--moving_avg",
-        "5",
-    ]
-    if variant == "c4":
-        step1_args += ["-y", "c4"]
-    elif variant == "rc_soft_log":
-        step1_args += ["-y", "rc_soft_log"]
-    elif variant == "rc_bpb":
-        pass
-    else:
+    """Fit each stage of the ladder model on the 7B ladder and report its error on the 7B run"""
+    if variant not in ["rc_bpb", "c4", "rc_soft_log"]:
         raise ValueError(variant)
-    sys.argv = [sys.argv[0]] + step1_args
-    step1_df = step1_main()
+    target_name, n, d = "7B-4T", 6887575552, 3945065873408
 
-    # Run step 2 only
-    step2_args = [
-        "-k",
-        keys_key,
-        "-c",
+    keys = get_task_sets([keys_key])
+    pipeline = Pipeline(
         "src/scripts/paper/configs/final_7b_only.json",
-        "-o",
-        "/tmp/step2_main.pdf",
-        "--skip_perc",
-        "0.1",
-        "--moving_avg",
-        "5",
-    ]
-    if variant == "c4":
-        step2_args += ["-x", "c4"]
-    elif variant == "rc_soft_log":
-        step2_args += ["-x", "rc_soft_log", "--use_log_sigmoid"]
-    elif variant == "rc_bpb":
-        pass
-    else:
-        raise ValueError(variant)
-    sys.argv = [sys.argv[0]] + step2_args
-    step2_df = step2_main()
-
-    # Run stacked
-    predict_args = [
-        "-k",
-        keys_key,
-        "-c",
-        "src/scripts/paper/configs/final.json",
-        "--step2-config-path",
-        "src/scripts/paper/configs/final_7b_only.json",
-        "-o",
-        "/tmp/chained_main.pdf",
-        "-n",
-        "6887575552",
-        "-d",
-        "3945065873408",
-        "-t",
-        "7B-4T",
-        "--skip_perc",
-        "0.1",
-        "--moving_avg",
-        "5",
-    ]
-    if variant == "c4":
-        predict_args += ["--x_metric", "c4"]
-    elif variant == "rc_soft_log":
-        predict_args += ["--x_metric", "rc_soft_log"]  # '--use_log_sigmoid'
-    sys.argv = [sys.argv[0]] + predict_args
-    predict_df = predict_main()
-
-    # Restore original argv and printing
-    sys.stdout.close()
-    sys.stdout = original_stdout
-    sys.argv = orig_argv
-
-    # Rename columns
-    step1_df = step1_df[["Task", "Rel Error"]].rename(columns={"Rel Error": "7B Loss Rel Error"})
-    step2_df = step2_df[["Task", "Rel Error"]].rename(
-        columns={"Rel Error": "7B Accuracy Rel Error"}
+        x_metric=variant,
+        moving_avg=5,
+        skip_perc=0.1,
+        n=n,
+        d=d,
     )
-    predict_df = predict_df[["Task", "Rel Error"]].rename(
-        columns={"Rel Error": "7B Stacked Rel Error"}
+    # step 2 alone is reported with the log sigmoid for the task loss, the stacked prediction
+    # with the sigmoid
+    step2_pipeline = pipeline.with_options(use_log_sigmoid=variant == "rc_soft_log")
+    run_dag(
+        {
+            **pipeline.get_graph(keys, ["chain"]),
+            **step2_pipeline.get_graph(keys, ["fit_step2"]),
+        }
     )
 
+    rows = []
+    for task_name in keys:
+        step1_fit = pipeline.fit_step1(task_name)
+        _, _, (y, y_pred), _ = predict_step1(
+            pipeline.configs, step1_fit.data_by_name, step1_fit.coefficients, y_metric=variant
+        )
+        step1_rel_error = (y_pred - y) / y
+
+        step2_fit = step2_pipeline.fit_step2(task_name)
+        _, _, (y, y_pred), _ = predict_step2(
+            pipeline.configs,
+            step2_fit.data_by_name,
+            step2_fit.coefficients,
+            step2_fit.cov,
+            y_metric="rc_acc",
+            use_log_sigmoid=step2_pipeline.options["use_log_sigmoid"],
+        )
+        step2_rel_error = (y_pred - y) / y
+
+        _, pred_acc = pipeline.chain(task_name)
+        actual_acc = pipeline.step2_data(task_name)[target_name]["ys"][-1]
+        rows.append(
+            {
+                "Task": task_name,
+                "7B Loss Rel Error": step1_rel_error,
+                "7B Accuracy Rel Error": step2_rel_error,
+                "7B Stacked Rel Error": (pred_acc - actual_acc) / actual_acc,
+            }
+        )
+
+    df = pd.DataFrame(rows)
+    step1_df = df[["Task", "7B Loss Rel Error"]]
+    step2_df = df[["Task", "7B Accuracy Rel Error"]]
+    predict_df = df[["Task", "7B Stacked Rel Error"]]
+
     return step1_df, step2_df, predict_df
 
 
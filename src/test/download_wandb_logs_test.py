@@ -0,0 +1,149 @@
+import csv
+import json
+
+import pytest
+
+from scaling.download_wandb_logs import download, with_retries
+
+
+class FakeRun:
+    def __init__(self, name, steps, learning_rate=0.001, failures=0):
+        self.name = name
+        self.id = f"id-{name}"
+        self.history = [{"_step": step, "train/CrossEntropyLoss": 10.0 / step} for step in steps]
+        self.failures = failures
+        self.min_steps = []
+        self.set_config(learning_rate)
+
+    def set_config(self, learning_rate):
+        self.json_config = json.dumps(
+            {
+                "global_train_batch_size": {"value": 4},
+                "model": {"value": {"max_sequence_length": 8}},
+                "optimizer": {"value": {"learning_rate": learning_rate}},
+            }
+        )
+
+    def scan_history(self, keys, page_size, min_step=None):
+        self.min_steps.append(min_step)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("flaky")
+        for row in self.history:
+            if min_step is None or row["_step"] >= min_step:
+                yield {key: row[key] for key in keys if key in row}
+
+
+class FakeApi:
+    def __init__(self, *runs):
+        self.runs_by_name = {run.name: run for run in runs}
+
+    def runs(self, path, filters):
+        names = [f["display_name"] for f in filters["$or"]]
+        return [self.runs_by_name[name] for name in names if name in self.runs_by_name]
+
+
+def make_job(output, names, sync=False):
+    return {
+        "names": [f"ai2-llm/olmo-ladder/{name}" for name in names],
+        "output": str(output),
+        "x_axis": "_step",
+        "y_axis": ["train/CrossEntropyLoss"],
+        "eval_only": True,
+        "sync": sync,
+    }
+
+
+def run_download(jobs, api):
+    download(jobs, api=api, workers=2, backoff=0, requests_per_second=None)
+
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def read_steps(path):
+    return [int(row["_step"]) for row in read_rows(path)]
+
+
+def test_download_merges_runs(tmp_path):
+    first = FakeRun("run-a", [1, 2, 3, 4])
+    # a restart that rewinds to step 3, with a failed first request
+    restart = FakeRun("run-b", [3, 5, 6], failures=1)
+    output = tmp_path / "run.csv"
+    run_download([make_job(output, ["run-a", "run-b"])], FakeApi(first, restart))
+
+    rows = read_rows(output)
+    assert read_steps(output) == [1, 2, 3, 4, 5, 6]
+    assert restart.min_steps == [None, None]
+    assert rows[0]["batch_size_in_tokens"] == "32"
+    assert rows[0]["learning_rate_peak"] == "0.001"
+    assert not (tmp_path / "run.csv.sync.json").exists()
+
+
+def test_sync_appends_new_steps(tmp_path):
+    run = FakeRun("run-a", [1, 2, 3])
+    api = FakeApi(run)
+    output = tmp_path / "run.csv"
+    job = make_job(output, ["run-a"], sync=True)
+    run_download([job], api)
+    run.history += FakeRun("run-a", [4, 5]).history
+    run_download([job], api)
+
+    assert run.min_steps == [None, 4]
+    assert read_steps(output) == [1, 2, 3, 4, 5]
+    with open(f"{output}.sync.json") as f:
+        state = json.load(f)
+    assert state["last_x"] == 5.0
+    assert state["runs"][run.id]["last_step"] == 5
+    assert state["size"] == output.stat().st_size
+
+
+def test_sync_rewind_rewrites_csv(tmp_path):
+    first = FakeRun("run-a", [1, 2, 3, 4])
+    output = tmp_path / "run.csv"
+    run_download([make_job(output, ["run-a"], sync=True)], FakeApi(first))
+    # a restart from step 2 overlaps the rows already synced, so the csv is merged and rewritten
+    restart = FakeRun("run-b", [2, 3, 5])
+    restart.history[0]["train/CrossEntropyLoss"] = 0.5
+    run_download([make_job(output, ["run-a", "run-b"], sync=True)], FakeApi(first, restart))
+
+    assert first.min_steps == [None, 5]
+    assert restart.min_steps == [None]
+    rows = read_rows(output)
+    assert read_steps(output) == [1, 2, 3, 4, 5]
+    assert float(rows[1]["train/CrossEntropyLoss"]) == 0.5
+
+
+def test_sync_config_change_downloads_again(tmp_path):
+    run = FakeRun("run-a", [1, 2, 3])
+    api = FakeApi(run)
+    output = tmp_path / "run.csv"
+    job = make_job(output, ["run-a"], sync=True)
+    run_download([job], api)
+    run.set_config(learning_rate=0.002)
+    run_download([job], api)
+
+    assert run.min_steps == [None, None]
+    rows = read_rows(output)
+    assert read_steps(output) == [1, 2, 3]
+    assert {row["learning_rate_peak"] for row in rows} == {"0.002"}
+
+
+def test_with_retries():
+    calls = {"count": 0}
+
+    def flaky():
+        calls["count"] += 1
+        if calls["count"] < 3:
+            raise ConnectionError("flaky")
+        return "done"
+
+    assert with_retries(flaky, "flaky", max_retries=2, backoff=0) == "done"
+    assert calls["count"] == 3
+
+    calls["count"] = 0
+    with pytest.raises(ConnectionError):
+        with_retries(flaky, "flaky", max_retries=1, backoff=0)
+    assert calls["count"] == 2